@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Measure the import and startup costs of the chatbot plugin.
+
+Each measure runs in a fresh interpreter:
+- `discovery`: importing the plugin entry point, as Ouranos does whenever it
+  discovers its plugins, even when the chatbot is omitted
+- `startup`: the imports deferred to the chatbot startup, the compilation of the
+  templates and the computation of the help messages
+
+Usage: python scripts/measure_startup.py [--repeat N] [--top N] [--json PATH]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+import subprocess
+import sys
+
+
+# Packages that must not be imported by the plugin discovery
+HEAVY_PACKAGES = ("telegram", "jinja2", "ouranos_chatbot.commands")
+
+DISCOVERY = "import ouranos_chatbot.plugin_setup"
+
+STARTUP = """
+from time import perf_counter
+import ouranos_chatbot.plugin_setup
+start = perf_counter()
+import ouranos_chatbot.commands
+from ouranos_chatbot.messages.templates import precompile_templates
+from ouranos_chatbot.registry import command_registry
+imported = perf_counter()
+precompile_templates()
+command_registry.compile()
+end = perf_counter()
+print(f"{imported - start} {end - imported}")
+"""
+
+
+def _run(code: str) -> tuple[list[tuple[str, int, int]], str]:
+    """Run the code with `-X importtime` and return the (module, self time,
+    cumulative time) of each import, in µs, along with the standard output."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True,
+    )
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative, module = line[len("import time:"):].split("|")
+        imports.append((module.strip(), int(self_time), int(cumulative)))
+    return imports, process.stdout
+
+
+def measure_discovery(top: int) -> dict:
+    imports, _ = _run(DISCOVERY)
+    modules = {module for module, _, _ in imports}
+    return {
+        "total": sum(self_time for _, self_time, _ in imports) / 1e6,
+        "modules": len(imports),
+        "heavy_packages": [
+            package for package in HEAVY_PACKAGES
+            if any(
+                module == package or module.startswith(f"{package}.")
+                for module in modules
+            )
+        ],
+        "slowest": [
+            [module, self_time / 1e6]
+            for module, self_time, _ in sorted(imports, key=lambda i: -i[1])[:top]
+        ],
+    }
+
+
+def measure_startup() -> dict:
+    _, output = _run(STARTUP)
+    imports_time, compile_time = map(float, output.split())
+    return {
+        "imports": imports_time,
+        "compilation": compile_time,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--repeat", type=int, default=5,
+        help="Number of runs, the fastest one is kept (default: 5)")
+    parser.add_argument(
+        "--top", type=int, default=10,
+        help="Number of slowest imports listed (default: 10)")
+    parser.add_argument(
+        "--json", metavar="PATH", default=None,
+        help="Save the results to PATH, to track them over time")
+    args = parser.parse_args()
+
+    discovery = min(
+        (measure_discovery(args.top) for _ in range(args.repeat)),
+        key=lambda result: result["total"])
+    startup = min(
+        (measure_startup() for _ in range(args.repeat)),
+        key=lambda result: result["imports"] + result["compilation"])
+
+    print(f"Plugin discovery: {discovery['total'] * 1000:.1f} ms, "
+          f"{discovery['modules']} modules imported")
+    if discovery["heavy_packages"]:
+        print(f"  Heavy packages imported: {', '.join(discovery['heavy_packages'])}")
+    for module, self_time in discovery["slowest"]:
+        print(f"  {self_time * 1000:8.2f} ms  {module}")
+    print(f"Startup: {startup['imports'] * 1000:.1f} ms of deferred imports, "
+          f"{startup['compilation'] * 1000:.1f} ms compiling the templates and the help")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(
+            {"discovery": discovery, "startup": startup}, indent=2))
+
+    if discovery["heavy_packages"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
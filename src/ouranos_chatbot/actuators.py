@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+from enum import StrEnum
+import logging
+from typing import NamedTuple, Sequence
+
+from dispatcher import AsyncDispatcher
+import gaia_validators as gv
+from ouranos.core.database.models.gaia import Ecosystem
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+class SwitchOutcome(StrEnum):
+    confirmed = "confirmed"
+    # The request was sent but its acknowledgement was not waited for
+    sent = "sent"
+    # The request was sent but no acknowledgement was received in time
+    unconfirmed = "unconfirmed"
+    failed = "failed"
+    # The ecosystem does not manage this type of actuator
+    unmanaged = "unmanaged"
+
+
+class SwitchRequest(NamedTuple):
+    ecosystem: Ecosystem
+    actuator: gv.HardwareType
+
+
+def _name(value: object) -> str:
+    # The payloads might hold either the enums or their names
+    return getattr(value, "name", value)
+
+
+def reached(mode: gv.ActuatorModePayload, actuator_mode: object, status: object) -> bool:
+    """Whether an actuator in the mode and status given has reached the mode
+    requested."""
+    if mode.name == "automatic":
+        return _name(actuator_mode) == "automatic"
+    return _name(actuator_mode) == "manual" and bool(status) == (mode.name == "on")
+
+
+class ActuatorAcknowledgements:
+    """Futures resolved when Gaia reports that an actuator reached the mode
+    requested.
+
+    The futures are indexed by ecosystem uid and actuator type so that each
+    actuator state update only checks the requests concerning it.
+    """
+    def __init__(self) -> None:
+        self._expected: dict[
+            tuple[str, str], list[tuple[gv.ActuatorModePayload, asyncio.Future]]] = {}
+
+    def expect(
+            self,
+            ecosystem_uid: str,
+            actuator: gv.HardwareType,
+            mode: gv.ActuatorModePayload,
+    ) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._expected.setdefault((ecosystem_uid, actuator.name), []).append((mode, future))
+        return future
+
+    def discard(
+            self,
+            ecosystem_uid: str,
+            actuator: gv.HardwareType,
+            future: asyncio.Future,
+    ) -> None:
+        key = (ecosystem_uid, actuator.name)
+        expected = [
+            (mode, other) for mode, other in self._expected.get(key, [])
+            if other is not future
+        ]
+        if expected:
+            self._expected[key] = expected
+        else:
+            self._expected.pop(key, None)
+
+    def update(
+            self,
+            ecosystem_uid: str,
+            actuator: str,
+            actuator_mode: object,
+            status: object,
+    ) -> None:
+        key = (ecosystem_uid, actuator)
+        expected = self._expected.get(key)
+        if not expected:
+            return
+        remaining = []
+        for mode, future in expected:
+            if future.done():
+                continue
+            if reached(mode, actuator_mode, status):
+                future.set_result(True)
+            else:
+                remaining.append((mode, future))
+        if remaining:
+            self._expected[key] = remaining
+        else:
+            del self._expected[key]
+
+    def handle_payload(self, data: object) -> None:
+        """Resolve the requests acknowledged by an 'actuators_data' event."""
+        if not self._expected:
+            return
+        payloads = data if isinstance(data, list) else [data]
+        for payload in payloads:
+            try:
+                ecosystem_uid = payload["uid"]
+                for state in payload["data"]:
+                    self.update(
+                        ecosystem_uid, _name(state["type"]), state["mode"],
+                        state["status"])
+            except (KeyError, TypeError):
+                logger.debug("Received an unexpected 'actuators_data' payload.")
+
+
+actuator_acknowledgements = ActuatorAcknowledgements()
+
+
+async def switch_actuators(
+        dispatcher: AsyncDispatcher,
+        requests: Sequence[SwitchRequest],
+        mode: gv.ActuatorModePayload,
+        countdown: float = 0.0,
+        timeout: float = 10.0,
+) -> list[SwitchOutcome]:
+    """Send all the requests at once, then wait up to `timeout` seconds for
+    Gaia to acknowledge them. Return the outcome of each request."""
+    # Expect the acknowledgements before sending the requests so that none is
+    # missed
+    futures = [
+        actuator_acknowledgements.expect(request.ecosystem.uid, request.actuator, mode)
+        if timeout > 0 else None
+        for request in requests
+    ]
+    try:
+        results = await asyncio.gather(
+            *(
+                request.ecosystem.turn_actuator(
+                    dispatcher, request.actuator, mode, countdown)
+                for request in requests
+            ),
+            return_exceptions=True,
+        )
+        waited = [
+            future for future, result in zip(futures, results)
+            if future is not None and not isinstance(result, BaseException)
+        ]
+        if waited:
+            await asyncio.wait(waited, timeout=timeout)
+        outcomes: list[SwitchOutcome] = []
+        for request, future, result in zip(requests, futures, results):
+            if isinstance(result, BaseException):
+                logger.error(
+                    f"Could not send the request to turn {request.actuator.name} of "
+                    f"ecosystem {request.ecosystem.uid} to {mode.name}. ERROR msg: "
+                    f"`{result.__class__.__name__} :{result}`.")
+                outcomes.append(SwitchOutcome.failed)
+            elif future is None:
+                outcomes.append(SwitchOutcome.sent)
+            elif future.done():
+                outcomes.append(SwitchOutcome.confirmed)
+            else:
+                outcomes.append(SwitchOutcome.unconfirmed)
+        return outcomes
+    finally:
+        for request, future in zip(requests, futures):
+            if future is not None:
+                actuator_acknowledgements.discard(
+                    request.ecosystem.uid, request.actuator, future)
+                future.cancel()
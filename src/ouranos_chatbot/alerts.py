@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import timedelta
+import logging
+import operator
+from time import time
+from typing import Callable, NamedTuple
+
+from telegram import Bot
+
+from ouranos_chatbot.history import format_period
+from ouranos_chatbot.messages.templates import render_template
+from ouranos_chatbot.reference import reference_data
+from ouranos_chatbot.sender import sender
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+OPERATORS: dict[str, Callable[[float, float], bool]] = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+
+class AlertRule(NamedTuple):
+    id: int
+    chat_id: int
+    ecosystem_uid: str
+    measure: str
+    operator: str
+    threshold: float
+    # Number of seconds the condition must hold before the alert is triggered
+    duration: float
+    # Margin the value must cross back past the threshold to clear the alert, so
+    # that a value oscillating around the threshold does not trigger it repeatedly
+    hysteresis: float
+
+    @property
+    def condition(self) -> str:
+        rv = f"{self.measure} {self.operator} {self.threshold:g}"
+        if self.duration:
+            rv += f" for {format_period(timedelta(seconds=self.duration))}"
+        return rv
+
+    def matches(self, value: float) -> bool:
+        return OPERATORS[self.operator](value, self.threshold)
+
+    def cleared(self, value: float) -> bool:
+        if self.operator.startswith(">"):
+            return value < self.threshold - self.hysteresis
+        return value > self.threshold + self.hysteresis
+
+
+class RuleState(NamedTuple):
+    # Timestamp since which the condition holds, if it does
+    pending_since: float | None = None
+    # Whether the alert was triggered and not cleared yet
+    active: bool = False
+
+
+class AlertEvent(NamedTuple):
+    rule: AlertRule
+    value: float
+    triggered: bool
+
+
+class AlertEngine:
+    """Evaluate the users' alert rules against the incoming sensors data.
+
+    The rules are indexed by ecosystem and measure, so that a data point only
+    evaluates the rules concerning it. Each rule keeps a small state: since when
+    its condition holds, and whether it is active. An alert is triggered once
+    the condition held for the duration of the rule, and cleared once the value
+    crossed back past the threshold by the hysteresis of the rule.
+    """
+    def __init__(self, max_rules_per_chat: int = 20) -> None:
+        self.rules: dict[int, AlertRule] = {}
+        self.states: dict[int, RuleState] = {}
+        self._index: dict[tuple[str, str], list[AlertRule]] = {}
+        self._next_id = 1
+        self.configure(max_rules_per_chat)
+
+    def configure(self, max_rules_per_chat: int = 20) -> None:
+        self.max_rules_per_chat = max_rules_per_chat
+
+    def chat_rules(self, chat_id: int) -> list[AlertRule]:
+        return [rule for rule in self.rules.values() if rule.chat_id == chat_id]
+
+    def _index_rule(self, rule: AlertRule) -> None:
+        self.rules[rule.id] = rule
+        self._index.setdefault((rule.ecosystem_uid, rule.measure), []).append(rule)
+        self._next_id = max(self._next_id, rule.id + 1)
+
+    def add(
+            self,
+            chat_id: int,
+            ecosystem_uid: str,
+            measure: str,
+            operator_: str,
+            threshold: float,
+            duration: float = 0.0,
+            hysteresis: float = 0.0,
+    ) -> AlertRule:
+        if operator_ not in OPERATORS:
+            raise ValueError(f"'{operator_}' is not a valid operator")
+        if len(self.chat_rules(chat_id)) >= self.max_rules_per_chat:
+            raise ValueError(
+                f"A chat cannot have more than {self.max_rules_per_chat} alerts")
+        rule = AlertRule(
+            self._next_id, chat_id, ecosystem_uid, measure, operator_, threshold,
+            duration, hysteresis)
+        self._index_rule(rule)
+        self.states[rule.id] = RuleState()
+        return rule
+
+    def remove(self, chat_id: int, rule_id: int) -> bool:
+        rule = self.rules.get(rule_id)
+        if rule is None or rule.chat_id != chat_id:
+            return False
+        del self.rules[rule_id]
+        self.states.pop(rule_id, None)
+        key = (rule.ecosystem_uid, rule.measure)
+        rules = [other for other in self._index[key] if other.id != rule_id]
+        if rules:
+            self._index[key] = rules
+        else:
+            del self._index[key]
+        return True
+
+    def evaluate(
+            self,
+            ecosystem_uid: str,
+            measure: str,
+            value: float,
+            timestamp: float | None = None,
+    ) -> list[AlertEvent]:
+        """Update the state of the rules concerning the data point, and return the
+        alerts triggered or cleared by it."""
+        rules = self._index.get((ecosystem_uid, measure))
+        if not rules:
+            return []
+        timestamp = timestamp if timestamp is not None else time()
+        events: list[AlertEvent] = []
+        for rule in rules:
+            state = self.states.get(rule.id, RuleState())
+            if state.active:
+                if rule.cleared(value):
+                    state = RuleState()
+                    events.append(AlertEvent(rule, value, triggered=False))
+            elif rule.matches(value):
+                pending_since = (
+                    state.pending_since if state.pending_since is not None else timestamp)
+                if timestamp - pending_since >= rule.duration:
+                    state = RuleState(None, active=True)
+                    events.append(AlertEvent(rule, value, triggered=True))
+                else:
+                    state = RuleState(pending_since, active=False)
+            else:
+                state = RuleState()
+            self.states[rule.id] = state
+        return events
+
+    def dump(self) -> dict[str, dict]:
+        return {
+            str(rule_id): {
+                "rule": rule._asdict(),
+                "state": self.states.get(rule_id, RuleState())._asdict(),
+            }
+            for rule_id, rule in self.rules.items()
+        }
+
+    def restore(self, rules: dict[str, dict]) -> None:
+        for rule_id, data in rules.items():
+            try:
+                rule = AlertRule(**data["rule"])
+                state = RuleState(**data["state"])
+            except (KeyError, TypeError):
+                logger.warning(f"Could not restore the alert rule {rule_id}.")
+                continue
+            self._index_rule(rule)
+            self.states[rule.id] = state
+
+    def clear(self) -> None:
+        self.rules.clear()
+        self.states.clear()
+        self._index.clear()
+        self._next_id = 1
+
+    async def handle_payload(self, bot: Bot, data: object) -> None:
+        """Evaluate the rules against a 'sensors_data' event and notify the
+        chats of the alerts triggered or cleared."""
+        if not self._index:
+            return
+        now = time()
+        events: list[AlertEvent] = []
+        payloads = data if isinstance(data, list) else [data]
+        for payload in payloads:
+            try:
+                ecosystem_uid = payload["uid"]
+                for measure, value in _measures_values(payload["data"]).items():
+                    events.extend(self.evaluate(ecosystem_uid, measure, value, now))
+            except (KeyError, TypeError, ValueError):
+                logger.debug("Received an unexpected 'sensors_data' payload.")
+        if events:
+            await self.notify(bot, events)
+
+    async def notify(self, bot: Bot, events: list[AlertEvent]) -> None:
+        units = await reference_data.get_units()
+        sends = []
+        for event in events:
+            msg = await render_template(
+                "alert", rule=event.rule, value=event.value, triggered=event.triggered,
+                ecosystem=await reference_data.get_name(event.rule.ecosystem_uid),
+                unit=units.get(event.rule.measure) or "")
+            sends.append(sender.send_message(bot, event.rule.chat_id, msg, html=True))
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        for event, result in zip(events, results):
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Could not send the alert {event.rule.id} to chat "
+                    f"{event.rule.chat_id}. ERROR msg: "
+                    f"`{result.__class__.__name__} :{result}`.")
+
+
+def _measures_values(data: dict) -> dict[str, float]:
+    """Get the value of each measure of the sensors data: the average computed by
+    Gaia when available, or the mean of the sensors records otherwise.
+
+    The records are either mappings or (sensor_uid, measure, value, ...)
+    sequences, and the averages mappings or (measure, value, ...) sequences.
+    """
+    if data.get("average"):
+        return {
+            measure: float(value)
+            for measure, value in (
+                (record["measure"], record["value"]) if isinstance(record, dict)
+                else (record[0], record[1])
+                for record in data["average"]
+            )
+        }
+    values: dict[str, list[float]] = {}
+    for record in data.get("records", []):
+        if isinstance(record, dict):
+            measure, value = record["measure"], record["value"]
+        else:
+            measure, value = record[1], record[2]
+        values.setdefault(measure, []).append(float(value))
+    return {measure: sum(values_) / len(values_) for measure, values_ in values.items()}
+
+
+alert_engine = AlertEngine()
@@ -1,23 +1,135 @@
 from cachetools import TTLCache
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ouranos import db
 from ouranos.core.database.models.app import anonymous_user, User, UserMixin
 
+from ouranos_chatbot.metrics import cache_hits, cache_misses
 
-cache_users = TTLCache(maxsize=32, ttl=60)
+
+class UserCache:
+    """Cache of the users linked to the Telegram ids.
+
+    Telegram ids not linked to any user are also cached, as the anonymous user,
+    for a shorter time so that a freshly linked account is recognized quickly
+    even if the cache was not explicitly invalidated.
+    """
+    def __init__(
+            self,
+            maxsize: int = 1024,
+            ttl: float = 60,
+            anonymous_ttl: float = 10,
+    ) -> None:
+        self.hits: int = 0
+        self.misses: int = 0
+        self.configure(maxsize, ttl, anonymous_ttl)
+
+    def configure(
+            self,
+            maxsize: int = 1024,
+            ttl: float = 60,
+            anonymous_ttl: float = 10,
+    ) -> None:
+        self._users: TTLCache[int, UserMixin] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._anonymous: TTLCache[int, UserMixin] = TTLCache(
+            maxsize=maxsize, ttl=anonymous_ttl)
+
+    def __getitem__(self, telegram_id: int) -> UserMixin:
+        try:
+            user = self._users[telegram_id]
+        except KeyError:
+            try:
+                user = self._anonymous[telegram_id]
+            except KeyError:
+                self.misses += 1
+                cache_misses.inc("users")
+                raise
+        self.hits += 1
+        cache_hits.inc("users")
+        return user
+
+    def __setitem__(self, telegram_id: int, user: UserMixin) -> None:
+        self.invalidate(telegram_id)
+        if user.is_anonymous:
+            self._anonymous[telegram_id] = user
+        else:
+            self._users[telegram_id] = user
+
+    def invalidate(self, telegram_id: int) -> None:
+        """Forget the user linked to the Telegram id."""
+        self._users.pop(telegram_id, None)
+        self._anonymous.pop(telegram_id, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Forget the user, whatever the Telegram id it is linked to. To call
+        when its role or permissions changed."""
+        telegram_ids = [
+            telegram_id
+            for telegram_id, user in self._users.items()
+            if user.id == user_id
+        ]
+        for telegram_id in telegram_ids:
+            self.invalidate(telegram_id)
+
+    def clear(self) -> None:
+        self._users.clear()
+        self._anonymous.clear()
+
+    def dump(self) -> dict[str, int]:
+        """Get the links between the Telegram ids and the users cached."""
+        return {
+            str(telegram_id): user.id
+            for telegram_id, user in list(self._users.items())
+        }
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "users": len(self._users),
+            "anonymous": len(self._anonymous),
+        }
+
+
+user_cache = UserCache()
+
+
+async def fetch_user(session: AsyncSession, telegram_id: int) -> UserMixin:
+    """Get the user linked to the Telegram id from the database and cache it."""
+    user = await User.get_by(session, telegram_id=telegram_id)
+    if user:
+        _cache_user(session, user, telegram_id)
+        return user
+    user_cache[telegram_id] = anonymous_user
+    return anonymous_user
+
+
+def _cache_user(session: AsyncSession, user: User, telegram_id: int) -> None:
+    session.expunge(user)
+    session.expunge(user.role)
+    user_cache[telegram_id] = user
+
+
+async def restore_user_cache(links: dict[str, int]) -> None:
+    """Cache again the users linked to the Telegram ids given, in a single
+    query. The links are checked against the database as they might have
+    changed in the meantime."""
+    if not links:
+        return
+    telegram_ids = [int(telegram_id) for telegram_id in links]
+    async with db.scoped_session() as session:
+        stmt = select(User).where(User.telegram_id.in_(telegram_ids))
+        result = await session.execute(stmt)
+        for user in result.scalars().all():
+            _cache_user(session, user, user.telegram_id)
 
 
 async def get_current_user(session: AsyncSession, telegram_id: int) -> UserMixin:
     try:
-        return cache_users[telegram_id]
+        return user_cache[telegram_id]
     except KeyError:
-        user = await User.get_by(session, telegram_id=telegram_id)
-        if user:
-            cache_users[telegram_id] = user
-            session.expunge(user)
-            session.expunge(user.role)
-            return user
-        return anonymous_user
+        return await fetch_user(session, telegram_id)
 
 
 async def link_user(
@@ -26,3 +138,6 @@ async def link_user(
         telegram_id: int,
 ) -> None:
     await User.update(session, user_id=user.id, values={"telegram_id": telegram_id})
+    # The user might have been linked to another Telegram id before
+    user_cache.invalidate_user(user.id)
+    user_cache.invalidate(telegram_id)
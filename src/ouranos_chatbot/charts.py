@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from importlib.util import find_spec
+import io
+from time import time
+from typing import Any, Awaitable, Callable, Hashable
+
+from ouranos_chatbot.coalescing import SingleFlight
+from ouranos_chatbot.history import History
+from ouranos_chatbot.metrics import span
+
+
+# Measure, unit and (timestamp, mean, min, max) of each bucket holding data. Only
+# plain values are sent to the workers, so that they are cheap to pickle
+Series = tuple[str, str, list[tuple[float, float, float, float]]]
+
+
+def charts_available() -> bool:
+    """Whether the optional charts dependency, matplotlib, is installed."""
+    return find_spec("matplotlib") is not None
+
+
+def to_series(measure: str, unit: str | None, history: History) -> Series:
+    width = (history.end - history.start).total_seconds() / history.points
+    start = history.start.timestamp()
+    return (
+        measure,
+        unit or "",
+        [
+            (start + (bucket.index + 0.5) * width, bucket.mean, bucket.min, bucket.max)
+            for bucket in history.buckets
+        ],
+    )
+
+
+def draw_chart(title: str, series: list[Series]) -> bytes:
+    """Draw each series in its own panel, the mean as a line over the range
+    between the minimum and the maximum, and return the chart as a PNG image.
+
+    Run by the workers: matplotlib is imported there and the figure is built
+    without pyplot, whose global state is not thread-safe.
+    """
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 1 + 2 * len(series)), dpi=100)
+    axes = figure.subplots(len(series), 1, sharex=True, squeeze=False)[:, 0]
+    for ax, (measure, unit, points) in zip(axes, series):
+        timestamps = [datetime.fromtimestamp(point[0], timezone.utc) for point in points]
+        ax.fill_between(
+            timestamps, [point[2] for point in points], [point[3] for point in points],
+            alpha=0.3, linewidth=0)
+        ax.plot(timestamps, [point[1] for point in points])
+        ax.set_ylabel(f"{measure} ({unit})" if unit else measure)
+        ax.grid(True, alpha=0.3)
+    locator = AutoDateLocator()
+    axes[-1].xaxis.set_major_locator(locator)
+    axes[-1].xaxis.set_major_formatter(ConciseDateFormatter(locator))
+    figure.suptitle(title)
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """Draw the charts in a bounded pool of workers, away from the event loop.
+
+    At most `workers` charts are drawn at once, the other requests waiting on the
+    event loop rather than piling up in the pool. The charts are cached per time
+    bucket of `cache_bucket` seconds: the same chart requested within a bucket is
+    only computed once, and the identical concurrent requests share it.
+    """
+    def __init__(
+            self,
+            workers: int = 2,
+            use_processes: bool = True,
+            cache_bucket: float = 300.0,
+            cache_size: int = 64,
+    ) -> None:
+        self._executor: Executor | None = None
+        self._charts = SingleFlight("charts")
+        self.configure(workers, use_processes, cache_bucket, cache_size)
+
+    def configure(
+            self,
+            workers: int = 2,
+            use_processes: bool = True,
+            cache_bucket: float = 300.0,
+            cache_size: int = 64,
+    ) -> None:
+        self.workers = workers
+        self.use_processes = use_processes
+        self.cache_bucket = cache_bucket
+        self._semaphore = asyncio.Semaphore(workers)
+        self._charts.configure(freshness=cache_bucket, maxsize=cache_size)
+
+    def _get_executor(self) -> Executor:
+        # The pool is only started on the first chart
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="chatbot-charts")
+        return self._executor
+
+    async def draw(self, title: str, series: list[Series]) -> bytes:
+        async with self._semaphore:
+            with span("render"):
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._get_executor(), draw_chart, title, series)
+
+    async def get(
+            self,
+            key: Hashable,
+            func: Callable[..., Awaitable[Any]],
+            *args,
+    ) -> Any:
+        """Get the chart identified by `key` in the current time bucket, computing
+        it with `func(*args)` if needed."""
+        bucket = int(time() // self.cache_bucket) if self.cache_bucket > 0 else None
+        return await self._charts.run((key, bucket), func, *args)
+
+    def clear(self) -> None:
+        self._charts.clear()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+chart_renderer = ChartRenderer()
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from cachetools import TTLCache
+
+from ouranos_chatbot.metrics import cache_hits, cache_misses
+
+
+class _LeaderCancelled(Exception):
+    """The call computing a coalesced result was cancelled."""
+
+
+class SingleFlight:
+    """Coalesce identical concurrent computations.
+
+    The first call made with a given key computes the result, while the calls
+    made with the same key before it is done wait for it and share its result
+    (or its exception). If the first call is cancelled, one of the waiting
+    calls computes the result in its stead. When `freshness` is set, a result is also reused by the
+    calls made within `freshness` seconds after it was computed.
+    """
+    def __init__(
+            self,
+            name: str,
+            freshness: float = 0.0,
+            maxsize: int = 128,
+    ) -> None:
+        self.name = name
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+        self._results: TTLCache | None = None
+        self.configure(freshness, maxsize)
+
+    def configure(self, freshness: float = 0.0, maxsize: int = 128) -> None:
+        self.freshness = freshness
+        if freshness > 0:
+            self._results = TTLCache(maxsize=maxsize, ttl=freshness)
+        else:
+            self._results = None
+
+    def clear(self) -> None:
+        if self._results is not None:
+            self._results.clear()
+
+    async def run(
+            self,
+            key: Hashable,
+            func: Callable[..., Awaitable[Any]],
+            *args,
+            **kwargs,
+    ) -> Any:
+        while True:
+            if self._results is not None:
+                try:
+                    result = self._results[key]
+                except KeyError:
+                    pass
+                else:
+                    cache_hits.inc(self.name)
+                    return result
+            future = self._in_flight.get(key)
+            if future is None:
+                break
+            cache_hits.inc(self.name)
+            try:
+                # Shield the shared future so that a waiting call being
+                # cancelled does not cancel the others
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # The first waiting call to resume computes the result, with
+                # its own arguments, and the others wait for it
+                continue
+        cache_misses.inc(self.name)
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            # The waiting calls did not ask for the cancellation
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no other call waits for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if self._results is not None:
+                self._results[key] = result
+            return result
+        finally:
+            del self._in_flight[key]
+
+
+# Rendered messages of the read-only commands
+command_results = SingleFlight("commands")
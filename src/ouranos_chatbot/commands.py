@@ -1,64 +1,117 @@
-from inspect import getdoc
-from statistics import mean
+import asyncio
 from typing import Sequence
 
-from telegram import Update
-from telegram.ext import CallbackContext, CommandHandler, filters, MessageHandler
+from sqlalchemy import func, select
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import CallbackContext, filters
 
 from dispatcher import AsyncDispatcher
 import gaia_validators as gv
 from ouranos import db
 from ouranos.core.database.models.app import Permission, User
 from ouranos.core.database.models.gaia import (
-    ActuatorState, Ecosystem, GaiaWarning, Measure, SensorDataCache)
-from ouranos.core.dispatchers import DispatcherFactory, DispatcherOptions
+    ActuatorState, Ecosystem, GaiaWarning, SensorDataCache)
+from ouranos.core.dispatchers import DispatcherFactory
 from ouranos.core.utils import Tokenizer, ExpiredTokenError, InvalidTokenError
 
-from ouranos_chatbot.auth import link_user, get_current_user
-from ouranos_chatbot.decorators import (
-    activation_required, make_handler, permission_required)
+from ouranos_chatbot.actuators import SwitchOutcome, SwitchRequest, switch_actuators
+from ouranos_chatbot.alerts import alert_engine, OPERATORS
+from ouranos_chatbot.auth import link_user
+from ouranos_chatbot.charts import chart_renderer, charts_available, to_series
+from ouranos_chatbot.coalescing import command_results
+from ouranos_chatbot.config import settings
+from ouranos_chatbot.digests import digest_scheduler, DigestSchedule
+from ouranos_chatbot.history import get_histories, get_history, parse_period
 from ouranos_chatbot.messages.templates import render_template
+from ouranos_chatbot.notifications import (
+    WARNING_LEVELS, warnings_notifier, WarningsSubscription)
+from ouranos_chatbot.pagination import (
+    ALL_ECOSYSTEMS, decode_warnings_callback, encode_warnings_callback,
+    get_warnings_page, WARNINGS_CALLBACK_PREFIX, warnings_selections, WarningsCursor,
+    WarningsPage)
+from ouranos_chatbot.reference import EcosystemRef, reference_data
+from ouranos_chatbot.registry import command_registry
+from ouranos_chatbot.request import current_user, scoped_session
+from ouranos_chatbot.sender import (
+    edit_html, reply_html, reply_photo, reply_text, split_message)
+from ouranos_chatbot.watch import watch_message, watcher
 
 
 TELEGRAM_CHAT_ACTIVATION_SUB = "link_telegram"
-
-
-DispatcherOptions.set_uri_lookup(
-    "chatbot", DispatcherOptions.get_uri_lookup("application-internal"))
-DispatcherOptions.set_options(
-    "chatbot", DispatcherOptions.get_options("application-internal"))
+DEFAULT_CHART_PERIOD = "1d"
+RECAP_SEPARATOR = "\n-----------\n"
 
 
 async def _get_ecosystems(session, ecosystems: list[str] | None) -> Sequence[Ecosystem]:
-    if ecosystems:
-        return await Ecosystem.get_multiple(session, name=ecosystems)
-    return await Ecosystem.get_multiple_by_id(session, ecosystems_id=["recent"])
+    """Get the ecosystems named, or the recently seen ones when no name is given.
+    To use when the ecosystems' status is needed, `reference_data` is enough
+    otherwise."""
+    ecosystems_uid = [
+        ecosystem.uid for ecosystem in await reference_data.get_ecosystems(ecosystems)]
+    if not ecosystems_uid:
+        return []
+    return await Ecosystem.get_multiple_by_id(session, ecosystems_id=ecosystems_uid)
 
 
-async def _get_warnings(
+async def _get_sensors_summary(
         session,
-        ecosystems: Sequence[Ecosystem],
-) -> Sequence[GaiaWarning]:
+        ecosystems: Sequence[Ecosystem | EcosystemRef],
+        extrema: bool = False,
+) -> dict[str, list[dict]]:
+    """Get the average of each measure of the ecosystems' current sensors data.
+
+    The data is aggregated by the database in a single grouped query. When
+    `extrema` is True, the minimal and maximal values are also returned.
+    """
+    rv: dict[str, list[dict]] = {ecosystem.uid: [] for ecosystem in ecosystems}
     if not ecosystems:
-        return []
-    return await GaiaWarning.get_multiple(
-        session, ecosystems=[ecosystem.uid for ecosystem in ecosystems])
+        return rv
+    columns = [
+        SensorDataCache.ecosystem_uid,
+        SensorDataCache.measure,
+        func.avg(SensorDataCache.value),
+    ]
+    if extrema:
+        columns.extend([
+            func.min(SensorDataCache.value),
+            func.max(SensorDataCache.value),
+        ])
+    stmt = (
+        select(*columns)
+        .where(SensorDataCache.ecosystem_uid.in_(rv.keys()))
+        .group_by(SensorDataCache.ecosystem_uid, SensorDataCache.measure)
+        .order_by(SensorDataCache.ecosystem_uid, SensorDataCache.measure)
+    )
+    result = await session.execute(stmt)
+    for row in result:
+        summary = {
+            "name": row[1],
+            "value": round(row[2], 2),
+        }
+        if extrema:
+            summary["min"] = round(row[3], 2)
+            summary["max"] = round(row[4], 2)
+        rv[row[0]].append(summary)
+    return rv
 
 
-def _summarize_sensors_data(sensors_data: list[SensorDataCache]) -> list[dict]:
-    rv = {}
-    for sensor_data in sensors_data:
-        try:
-            rv[sensor_data.measure].append(sensor_data.value)
-        except KeyError:
-            rv[sensor_data.measure] = [sensor_data.value]
-    return [
-        {
-            "name": measure,
-            "value": round(mean(data), 2),
-        }
-        for measure, data in rv.items()
-    ]
+async def _get_actuators_state(
+        session,
+        ecosystems: Sequence[Ecosystem | EcosystemRef],
+) -> dict[str, list[ActuatorState]]:
+    """Get the actuators state of all the ecosystems in a single query."""
+    rv: dict[str, list[ActuatorState]] = {ecosystem.uid: [] for ecosystem in ecosystems}
+    if not ecosystems:
+        return rv
+    stmt = (
+        select(ActuatorState)
+        .where(ActuatorState.ecosystem_uid.in_(rv.keys()))
+    )
+    result = await session.execute(stmt)
+    for actuator_state in result.scalars():
+        rv[actuator_state.ecosystem_uid].append(actuator_state)
+    return rv
 
 
 def _summarize_actuators_state(actuators_state: list[ActuatorState]) -> list[dict]:
@@ -88,30 +141,31 @@ def _summarize_warnings(
     ]
 
 
-@make_handler(CommandHandler, "start")
+@command_registry.command("start", listed=False, max_queries=1)
 async def start(update: Update, context: CallbackContext) -> None:
     """Start command."""
     telegram_id = update.effective_user.id
-    async with db.scoped_session() as session:
-        user = await get_current_user(session, telegram_id)
+    user = await current_user(telegram_id)
     if user.is_authenticated:
         greetings = f"Hi {user.firstname}"
     else:
         greetings = "Hello"
-    await update.message.reply_html(
+    await reply_html(
+        update,
         f"{greetings}, welcome to GAIA! To see the commands available, "
         f"type /help."
     )
 
 
-@make_handler(CommandHandler, "link_account")
+@command_registry.command("link_account", max_queries=3)
 async def link_account(update: Update, context: CallbackContext) -> None:
     """Link your account using the token received on the website or by email. Once
     linked, you will have access to more commands."""
     telegram_id = update.effective_user.id
     args = context.args
     if len(args) != 1:
-        await update.message.reply_html(
+        await reply_html(
+            update,
             "You need to provide your activation token after the command"
         )
         return
@@ -121,245 +175,849 @@ async def link_account(update: Update, context: CallbackContext) -> None:
         if payload["sub"] != TELEGRAM_CHAT_ACTIVATION_SUB:
             raise InvalidTokenError
         user_id: int = payload["user_id"]
-        async with db.scoped_session() as session:
+        async with scoped_session() as session:
             user = await User.get(session, user_id=user_id)
-            if not user:
-                await update.message.reply_html(
-                    "Could not find any user linked to this token"
-                )
-                return
-            await link_user(session, user, telegram_id)
-            await update.message.reply_html(
-                f"Hi {user.username}. You are now allowed to fully use the "
-                f"chatbot. To see the commands available, type /help"
+            if user:
+                await link_user(session, user, telegram_id)
+        if not user:
+            await reply_html(
+                update,
+                "Could not find any user linked to this token"
             )
+            return
+        await reply_html(
+            update,
+            f"Hi {user.username}. You are now allowed to fully use the "
+            f"chatbot. To see the commands available, type /help"
+        )
+        await command_registry.update_chat_menu(
+            context.bot, update.effective_chat.id, user)
     except ExpiredTokenError:
-        await update.message.reply_html(
+        await reply_html(
+            update,
             "This token has expired, ask for a new one and repeat the "
             "activation process"
         )
     except (InvalidTokenError, KeyError):
-        await update.message.reply_html("This token is invalid")
+        await reply_html(update, "This token is invalid")
+
+
+def _ecosystems_key(ecosystems: Sequence[Ecosystem | EcosystemRef]) -> frozenset[str]:
+    return frozenset(ecosystem.uid for ecosystem in ecosystems)
+
+
+async def _render_ecosystems(session) -> str:
+    ecosystems = await reference_data.get_ecosystems()
+    return await render_template("ecosystems_available", ecosystems=ecosystems)
+
+
+async def _render_ecosystems_status(session, ecosystems: Sequence[Ecosystem]) -> str:
+    return await render_template("ecosystems_status", ecosystems=ecosystems)
+
 
+async def _render_current_sensors(
+        session,
+        ecosystems: Sequence[Ecosystem | EcosystemRef],
+) -> str:
+    current_data = await _get_sensors_summary(session, ecosystems)
+    data = [
+        {
+            "name": ecosystem.name,
+            "current_data": current_data[ecosystem.uid],
+        }
+        for ecosystem in ecosystems
+    ]
+    data = [ecosystem for ecosystem in data if ecosystem["current_data"]]
+    units = await reference_data.get_units()
+    return await render_template("current_sensors", ecosystems=data, units=units)
+
+
+async def _render_actuators_state(
+        session,
+        ecosystems: Sequence[Ecosystem | EcosystemRef],
+) -> str:
+    actuators_state = await _get_actuators_state(session, ecosystems)
+    data = [
+        {
+            "name": ecosystem.name,
+            "actuators_state": _summarize_actuators_state(
+                actuators_state[ecosystem.uid]),
+        }
+        for ecosystem in ecosystems
+    ]
+    data = [ecosystem for ecosystem in data if ecosystem["actuators_state"]]
+    return await render_template("actuators_state", ecosystems=data)
+
+
+def _warnings_context(
+        page: WarningsPage,
+        ecosystems: Sequence[Ecosystem | EcosystemRef],
+) -> dict:
+    names = {ecosystem.uid: ecosystem.name for ecosystem in ecosystems}
+    return {
+        "warnings": _summarize_warnings(page.warnings, names),
+        "warnings_counts": page.counts,
+        "warnings_total": page.total,
+    }
+
+
+def _warnings_keyboard(selection: str, page: WarningsPage) -> InlineKeyboardMarkup | None:
+    buttons = []
+    if page.newer is not None:
+        buttons.append(InlineKeyboardButton(
+            "‹ Newer", callback_data=encode_warnings_callback(selection, page.newer, True)))
+    if page.older is not None:
+        buttons.append(InlineKeyboardButton(
+            "Older ›", callback_data=encode_warnings_callback(selection, page.older, False)))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def _render_warnings(
+        session,
+        ecosystems: Sequence[Ecosystem | EcosystemRef],
+        cursor: WarningsCursor | None = None,
+        newer: bool = False,
+) -> tuple[str, WarningsPage]:
+    page = await get_warnings_page(
+        session, [ecosystem.uid for ecosystem in ecosystems], cursor, newer,
+        settings.warnings_page_size)
+    msg = await render_template("warnings", **_warnings_context(page, ecosystems))
+    return msg, page
+
+
+async def _render_history(
+        session,
+        ecosystem: EcosystemRef,
+        measure: str,
+        period: str,
+) -> str:
+    history = await get_history(
+        session, ecosystem.uid, measure, parse_period(period), settings.history_points)
+    units = await reference_data.get_units()
+    return await render_template(
+        "history", ecosystem=ecosystem.name, measure=measure, period=period,
+        unit=units.get(measure) or "", history=history)
+
+
+async def _render_chart(
+        session,
+        ecosystem: EcosystemRef,
+        measure: str | None,
+        period: str,
+) -> bytes | None:
+    histories = await get_histories(
+        session, ecosystem.uid, [measure] if measure else None, parse_period(period),
+        settings.chart_points)
+    units = await reference_data.get_units()
+    series = [
+        to_series(measure, units.get(measure), history)
+        for measure, history in sorted(histories.items())
+        if history.buckets
+    ]
+    if not series:
+        return None
+    return await chart_renderer.draw(f"{ecosystem.name}, last {period}", series)
+
+
+async def _render_recap(session, ecosystems: Sequence[Ecosystem]) -> str:
+    current_data = await _get_sensors_summary(session, ecosystems)
+    actuators_state = await _get_actuators_state(session, ecosystems)
+    data = [
+        {
+            "name": ecosystem.name,
+            "connected": ecosystem.connected,
+            "status": ecosystem.status,
+            "last_seen": ecosystem.last_seen,
+            "current_data": current_data[ecosystem.uid],
+            "actuators_state": _summarize_actuators_state(
+                actuators_state[ecosystem.uid]),
+        }
+        for ecosystem in ecosystems
+    ]
+    units = await reference_data.get_units()
+    warnings_page = await get_warnings_page(
+        session, [ecosystem.uid for ecosystem in ecosystems],
+        page_size=settings.warnings_page_size)
+    return await render_template(
+        "recap", ecosystems=data, units=units,
+        **_warnings_context(warnings_page, ecosystems))
+
+
+async def _render_recap_sensors(ecosystems: Sequence[Ecosystem | EcosystemRef]) -> str:
+    async with db.scoped_session() as session:
+        current_data = await _get_sensors_summary(session, ecosystems)
+    data = [
+        {
+            "name": ecosystem.name,
+            "current_data": current_data[ecosystem.uid],
+        }
+        for ecosystem in ecosystems
+    ]
+    units = await reference_data.get_units()
+    return await render_template("current_sensors", ecosystems=data, units=units)
 
-@make_handler(CommandHandler, "ecosystems")
-@activation_required
+
+async def _render_recap_actuators(ecosystems: Sequence[Ecosystem | EcosystemRef]) -> str:
+    async with db.scoped_session() as session:
+        actuators_state = await _get_actuators_state(session, ecosystems)
+    data = [
+        {
+            "name": ecosystem.name,
+            "actuators_state": _summarize_actuators_state(
+                actuators_state[ecosystem.uid]),
+        }
+        for ecosystem in ecosystems
+    ]
+    return await render_template("actuators_state", ecosystems=data)
+
+
+async def _render_recap_warnings(ecosystems: Sequence[Ecosystem | EcosystemRef]) -> str:
+    async with db.scoped_session() as session:
+        msg, _ = await _render_warnings(session, ecosystems)
+    return msg
+
+
+async def _render_watch(ecosystems_uid: list[str]) -> dict[str, str]:
+    """Render the live status of each watched ecosystem, the data of all of them
+    being fetched at once."""
+    async with db.scoped_session() as session:
+        ecosystems = await Ecosystem.get_multiple_by_id(
+            session, ecosystems_id=ecosystems_uid)
+        current_data = await _get_sensors_summary(session, ecosystems)
+        actuators_state = await _get_actuators_state(session, ecosystems)
+    units = await reference_data.get_units()
+    return {
+        ecosystem.uid: await render_template(
+            "watch",
+            ecosystem={
+                "name": ecosystem.name,
+                "connected": ecosystem.connected,
+                "status": ecosystem.status,
+                "last_seen": ecosystem.last_seen,
+            },
+            current_data=current_data[ecosystem.uid],
+            actuators_state=_summarize_actuators_state(actuators_state[ecosystem.uid]),
+            units=units,
+        )
+        for ecosystem in ecosystems
+    }
+
+
+# Sections of the progressive recap, sent after the ecosystems status
+RECAP_SECTIONS = {
+    "sensors": ("Loading the sensors data...", _render_recap_sensors),
+    "actuators": ("Loading the actuators state...", _render_recap_actuators),
+    "warnings": ("Loading the warnings...", _render_recap_warnings),
+}
+
+
+async def _send_progressive_recap(
+        update: Update,
+        ecosystems: Sequence[Ecosystem],
+) -> None:
+    """Send the ecosystems status at once, then edit the message as the other
+    sections, computed concurrently, become ready."""
+    key = _ecosystems_key(ecosystems)
+    status = await command_results.run(
+        ("ecosystems_status", key), _render_ecosystems_status, None, ecosystems)
+    sections = {name: placeholder for name, (placeholder, _) in RECAP_SECTIONS.items()}
+
+    def assemble() -> str:
+        return RECAP_SEPARATOR.join(
+            ["Here is your recap:", status, *sections.values()])
+
+    first, *_ = split_message(assemble(), html=True)
+    message, *_ = await reply_html(update, first)
+    tasks = {
+        asyncio.create_task(command_results.run(
+            (f"recap_{name}", key), render, ecosystems)): name
+        for name, (_, render) in RECAP_SECTIONS.items()
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                sections[tasks[task]] = task.result()
+            # Only the first part of a recap too long is edited progressively,
+            # the other parts are sent once everything is ready
+            text, *others = split_message(assemble(), html=True)
+            # Telegram refuses edits not modifying the message
+            if text != first:
+                await edit_html(message, text)
+                first = text
+    finally:
+        for task in pending:
+            task.cancel()
+    for other in others:
+        await reply_html(update, other)
+
+
+@command_registry.command("ecosystems", activation=True, max_queries=1)
 async def get_ecosystems(update: Update, context: CallbackContext) -> None:
     """Get the name of the ecosystems available."""
-    async with db.scoped_session() as session:
-        ecosystems = await Ecosystem.get_multiple_by_id(session, ecosystems_id=["recent"])
-        msg = await render_template("ecosystems_available", ecosystems=ecosystems)
-    await update.message.reply_html(msg)
+    async with scoped_session() as session:
+        msg = await command_results.run(("ecosystems", ), _render_ecosystems, session)
+    await reply_html(update, msg)
 
 
-@make_handler(CommandHandler, "ecosystems_status")
-@activation_required
+@command_registry.command("ecosystems_status", activation=True, max_queries=2)
 async def get_ecosystems_status(update: Update, context: CallbackContext) -> None:
     """Get the status of the ecosystem(s) specified or all if not specified."""
     ecosystems_name = context.args or None
-    async with db.scoped_session() as session:
+    async with scoped_session() as session:
         ecosystems = await _get_ecosystems(session, ecosystems_name)
-        msg = await render_template("ecosystems_status", ecosystems=ecosystems)
-    await update.message.reply_html(msg)
+        msg = await command_results.run(
+            ("ecosystems_status", _ecosystems_key(ecosystems)),
+            _render_ecosystems_status, session, ecosystems)
+    await reply_html(update, msg)
 
 
-@make_handler(CommandHandler, "sensors")
-@activation_required
+@command_registry.command("sensors", activation=True, max_queries=1)
 async def get_current_sensors(update: Update, context: CallbackContext) -> None:
     """Get the sensors measures from the ecosystem(s) specified or all if not
     specified."""
-    ecosystems_name = context.args or None
-    async with db.scoped_session() as session:
-        ecosystems = await _get_ecosystems(session, ecosystems_name)
-        data = [
-            {
-                "name": ecosystem.name,
-                "current_data": _summarize_sensors_data(
-                        await ecosystem.get_current_data(session)),
-            }
-            for ecosystem in ecosystems
-        ]
-        data = [ecosystem for ecosystem in data if ecosystem["current_data"]]
-        measures = await Measure.get_multiple(session)
-        units = {measure.name: measure.unit for measure in measures}
-        msg = await render_template(
-            "current_sensors", ecosystems=data, units=units)
-    await update.message.reply_html(msg)
+    ecosystems = await reference_data.get_ecosystems(context.args or None)
+    async with scoped_session() as session:
+        msg = await command_results.run(
+            ("sensors", _ecosystems_key(ecosystems)),
+            _render_current_sensors, session, ecosystems)
+    await reply_html(update, msg)
 
 
-@make_handler(CommandHandler, "actuators_state")
-@activation_required
+@command_registry.command("actuators_state", activation=True, max_queries=1)
 async def get_actuators_state(update: Update, context: CallbackContext) -> None:
     """Get the actuators state from the ecosystem(s) specified or all if not
     specified."""
-    ecosystems_name = context.args or None
-    async with db.scoped_session() as session:
-        ecosystems = await _get_ecosystems(session, ecosystems_name)
-        data = [
-            {
-                "name": ecosystem.name,
-                "actuators_state": _summarize_actuators_state(
-                    await ecosystem.get_actuators_state(session)),
-            }
-            for ecosystem in ecosystems
-        ]
-        data = [ecosystem for ecosystem in data if ecosystem["actuators_state"]]
-        msg = await render_template("actuators_state", ecosystems=data)
-    await update.message.reply_html(msg)
+    ecosystems = await reference_data.get_ecosystems(context.args or None)
+    async with scoped_session() as session:
+        msg = await command_results.run(
+            ("actuators_state", _ecosystems_key(ecosystems)),
+            _render_actuators_state, session, ecosystems)
+    await reply_html(update, msg)
 
 
-@make_handler(CommandHandler, "warnings")
-@activation_required
+@command_registry.command("warnings", activation=True, max_queries=2)
 async def get_warnings(update: Update, context: CallbackContext) -> None:
-    """Get the ecosystem(s)' unsolved warnings, if any."""
-    ecosystems_name = context.args or None
-    async with db.scoped_session() as session:
-        ecosystems = await _get_ecosystems(session, ecosystems_name)
-        warnings = await _get_warnings(session, ecosystems)
-        names = {ecosystem.uid: ecosystem.name for ecosystem in ecosystems}
-        msg = await render_template(
-            "warnings", warnings=_summarize_warnings(warnings, names))
-    await update.message.reply_html(msg)
+    """Get the ecosystem(s)' unsolved warnings, if any, from the most recent
+    one. The older warnings can be browsed with the buttons below the message."""
+    ecosystems = await reference_data.get_ecosystems(context.args or None)
+    if context.args:
+        selection = warnings_selections.add([ecosystem.uid for ecosystem in ecosystems])
+    else:
+        selection = ALL_ECOSYSTEMS
+    async with scoped_session() as session:
+        msg, page = await command_results.run(
+            ("warnings", _ecosystems_key(ecosystems)),
+            _render_warnings, session, ecosystems)
+    await reply_html(update, msg, reply_markup=_warnings_keyboard(selection, page))
+
+
+@command_registry.callback_query(f"^{WARNINGS_CALLBACK_PREFIX}:", max_queries=2)
+async def browse_warnings(update: Update, context: CallbackContext) -> None:
+    """Load the page of warnings requested by the buttons of /warnings."""
+    query = update.callback_query
+    user = await current_user(update.effective_user.id)
+    if user.is_anonymous:
+        await query.answer("You need to be registered to use this command", show_alert=True)
+        return
+    try:
+        selection, cursor, newer = decode_warnings_callback(query.data)
+    except ValueError:
+        await query.answer()
+        return
+    if selection == ALL_ECOSYSTEMS:
+        ecosystems = await reference_data.get_ecosystems()
+    else:
+        ecosystems_uid = warnings_selections.get(selection)
+        if ecosystems_uid is None:
+            await query.answer(
+                "This list has expired, use /warnings again.", show_alert=True)
+            return
+        ecosystems = [
+            EcosystemRef(uid, await reference_data.get_name(uid))
+            for uid in ecosystems_uid
+        ]
+    async with scoped_session() as session:
+        msg, page = await _render_warnings(session, ecosystems, cursor, newer)
+    await query.answer()
+    try:
+        await edit_html(
+            update.effective_message, msg,
+            reply_markup=_warnings_keyboard(selection, page))
+    except BadRequest as e:
+        # The button was pressed again before the first edit was shown
+        if "not modified" not in str(e):
+            raise
 
 
-@make_handler(CommandHandler, "recap")
-@activation_required
+@command_registry.command("recap", activation=True, max_queries=6)
 async def get_recap(update: Update, context: CallbackContext) -> None:
     """Get a recap of the ecosystem(s)' status, sensors data, actuators state
     and warnings."""
     ecosystems_name = context.args or None
-    async with db.scoped_session() as session:
+    async with scoped_session() as session:
         ecosystems = await _get_ecosystems(session, ecosystems_name)
-        data = [
-            {
-                "name": ecosystem.name,
-                "connected": ecosystem.connected,
-                "status": ecosystem.status,
-                "last_seen": ecosystem.last_seen,
-                "current_data": _summarize_sensors_data(
-                    await ecosystem.get_current_data(session)),
-                "actuators_state": _summarize_actuators_state(
-                    await ecosystem.get_actuators_state(session)),
-            }
-            for ecosystem in ecosystems
-        ]
-        measures = await Measure.get_multiple(session)
-        units = {measure.name: measure.unit for measure in measures}
-        warnings = await _get_warnings(session, ecosystems)
-        names = {ecosystem.uid: ecosystem.name for ecosystem in ecosystems}
-        msg = await render_template(
-            "recap", ecosystems=data, units=units,
-            warnings=_summarize_warnings(warnings, names))
-    await update.message.reply_html(msg)
-
-
-@make_handler(CommandHandler, "switch_actuator")
-@activation_required
-@permission_required(Permission.OPERATE)
+        progressive = settings.progressive_recap and bool(ecosystems)
+        if not progressive:
+            msg = await command_results.run(
+                ("recap", _ecosystems_key(ecosystems)),
+                _render_recap, session, ecosystems)
+    if progressive:
+        # The sections are computed in their own sessions
+        await _send_progressive_recap(update, ecosystems)
+        return
+    await reply_html(update, msg)
+
+
+@command_registry.command("history", activation=True, max_queries=1)
+async def get_sensors_history(update: Update, context: CallbackContext) -> None:
+    """Get an overview of a measure of an ecosystem over a period such as 12h, 7d
+    or 2w."""
+    args = context.args
+    if len(args) != 3:
+        await reply_text(
+            update,
+            "You need to provide the ecosystem, the measure and the period, such "
+            "as 12h, 7d or 2w"
+        )
+        return
+    ecosystem_name, measure, period = args
+    try:
+        parse_period(period)
+    except ValueError:
+        await reply_text(
+            update,
+            f"'{period}' is not a valid period. Use a number followed by m, h, d or "
+            f"w, such as 12h, 7d or 2w.")
+        return
+    ecosystems = await reference_data.get_ecosystems([ecosystem_name])
+    if not ecosystems:
+        await reply_text(update, f"No ecosystem named '{ecosystem_name}' was found.")
+        return
+    measure = measure.lower()
+    units = await reference_data.get_units()
+    if measure not in units:
+        await reply_text(
+            update,
+            f"'{measure}' is not a valid measure. Valid measures are "
+            f"{', '.join(sorted(units))}")
+        return
+    async with scoped_session() as session:
+        msg = await command_results.run(
+            ("history", ecosystems[0].uid, measure, period),
+            _render_history, session, ecosystems[0], measure, period)
+    await reply_html(update, msg)
+
+
+@command_registry.command("chart", activation=True, max_queries=1)
+async def get_sensors_chart(update: Update, context: CallbackContext) -> None:
+    """Get a chart of the sensors data of an ecosystem over a period such as 12h, 7d
+    or 2w (1d by default), for a single measure or for all of them. Require the
+    charts extra to be installed."""
+    if not charts_available():
+        await reply_text(
+            update, "Charts are not available, matplotlib is not installed.")
+        return
+    args = context.args
+    if not 1 <= len(args) <= 3:
+        await reply_text(
+            update,
+            "You need to provide the ecosystem, and optionally the measure and the "
+            "period, such as 12h, 7d or 2w"
+        )
+        return
+    ecosystem_name, *options = args
+    measure: str | None = None
+    period = DEFAULT_CHART_PERIOD
+    if len(options) == 2:
+        measure, period = options
+    elif options:
+        # A single option is either the period or the measure
+        try:
+            parse_period(options[0])
+        except ValueError:
+            measure = options[0]
+        else:
+            period = options[0]
+    try:
+        parse_period(period)
+    except ValueError:
+        await reply_text(
+            update,
+            f"'{period}' is not a valid period. Use a number followed by m, h, d or "
+            f"w, such as 12h, 7d or 2w.")
+        return
+    ecosystems = await reference_data.get_ecosystems([ecosystem_name])
+    if not ecosystems:
+        await reply_text(update, f"No ecosystem named '{ecosystem_name}' was found.")
+        return
+    if measure is not None:
+        measure = measure.lower()
+        units = await reference_data.get_units()
+        if measure not in units:
+            await reply_text(
+                update,
+                f"'{measure}' is not a valid measure. Valid measures are "
+                f"{', '.join(sorted(units))}")
+            return
+    async with scoped_session() as session:
+        chart = await chart_renderer.get(
+            (ecosystems[0].uid, measure, period),
+            _render_chart, session, ecosystems[0], measure, period)
+    if chart is None:
+        await reply_text(
+            update,
+            f"No sensors data was recorded by {ecosystems[0].name} over the last "
+            f"{period}.")
+        return
+    caption = f"{ecosystems[0].name}, {measure or 'all measures'}, last {period}"
+    await reply_photo(update, chart, caption)
+
+
+@command_registry.command(
+    "switch_actuator", activation=True, permission=Permission.OPERATE, max_queries=2)
 async def switch_actuator(update: Update, context: CallbackContext) -> None:
-    """Switch an actuator on or off. Require to be an operator."""
+    """Switch actuators on or off. Several ecosystems and actuators can be given,
+    separated by commas, and the ecosystems can be matched with patterns such as
+    'greenhouse_*'. Require to be an operator."""
     args = context.args
     if len(args) < 3 or len(args) > 4:
-        await update.message.reply_text(
-            "You need to provide the ecosystem, the actuator, the mode and "
+        await reply_text(
+            update,
+            "You need to provide the ecosystem(s), the actuator(s), the mode and "
             "optionally a countdown (in seconds)"
         )
         return
-    ecosystem_name = args[0]
-    # Get and sanitize actuator input
-    actuator = args[1]
-    try:
-        actuator = gv.safe_enum_from_name(gv.HardwareType, actuator)
-        if actuator not in gv.HardwareType.actuator:
-            raise ValueError
-    except ValueError:
-        await update.message.reply_text(
-            f"Actuator '{actuator}' is not a valid actuator. valid actuators are"
+    patterns = [pattern for pattern in args[0].split(",") if pattern]
+    # Get and sanitize actuators input
+    actuators: list[gv.HardwareType] = []
+    invalid: list[str] = []
+    for actuator_name in args[1].split(","):
+        try:
+            actuator = gv.safe_enum_from_name(gv.HardwareType, actuator_name)
+            if actuator not in gv.HardwareType.actuator:
+                raise ValueError
+        except ValueError:
+            invalid.append(actuator_name)
+        else:
+            if actuator not in actuators:
+                actuators.append(actuator)
+    if invalid:
+        await reply_text(
+            update,
+            f"'{', '.join(invalid)}' is not a valid actuator. Valid actuators are "
             f"{', '.join([x.name for x in gv.HardwareType.actuator])}")
         return
-    actuator: gv.HardwareType
     # Get and sanitize mode input
     mode = args[2]
     try:
         mode = gv.safe_enum_from_name(gv.ActuatorModePayload, mode)
     except ValueError:
-        await update.message.reply_text("Mode has to be 'on', 'off' or 'automatic'.")
+        await reply_text(update, "Mode has to be 'on', 'off' or 'automatic'.")
         return
     mode: gv.ActuatorModePayload
     # Get and sanitize countdown input
-    countdown: float = args[3] if len(args) == 4 else 0.0
+    countdown = 0.0
+    if len(args) == 4:
+        try:
+            countdown = float(args[3])
+            if not countdown >= 0:
+                raise ValueError
+        except ValueError:
+            await reply_text(
+                update, "The countdown has to be a positive number of seconds.")
+            return
     # Process to logic
-    async with db.scoped_session() as session:
-        ecosystem = await Ecosystem.get(session, name=ecosystem_name)
-        if ecosystem is None:
-            await update.message.reply_text(
-                f"No ecosystem named '{ecosystem_name}' was found.")
+    ecosystems_ref = await reference_data.match_ecosystems(patterns)
+    if not ecosystems_ref:
+        await reply_text(update, f"No ecosystem named '{args[0]}' was found.")
+        return
+    async with scoped_session() as session:
+        ecosystems = await Ecosystem.get_multiple_by_id(
+            session, ecosystems_id=[ecosystem.uid for ecosystem in ecosystems_ref])
+        actuators_state = await _get_actuators_state(session, ecosystems)
+    # No connection is held while waiting for Gaia's acknowledgements
+    requests: list[SwitchRequest] = []
+    managed: list[SwitchRequest] = []
+    for ecosystem in ecosystems:
+        active = {
+            actuator_state.type for actuator_state in actuators_state[ecosystem.uid]
+            if actuator_state.active
+        }
+        for actuator in actuators:
+            request = SwitchRequest(ecosystem, actuator)
+            requests.append(request)
+            if actuator in active:
+                managed.append(request)
+    dispatcher: AsyncDispatcher = DispatcherFactory.get("chatbot")
+    outcomes = dict(zip(managed, await switch_actuators(
+        dispatcher, managed, mode, countdown, settings.actuator_ack_timeout)))
+    msg = await render_template(
+        "actuators_switched",
+        actuators=", ".join(actuator.name for actuator in actuators),
+        mode=mode.name,
+        countdown=f"{countdown:g}" if countdown else None,
+        outcomes=[
+            {
+                "ecosystem": request.ecosystem.name,
+                "actuator": request.actuator.name,
+                "outcome": outcomes.get(request, SwitchOutcome.unmanaged),
+            }
+            for request in requests
+        ],
+    )
+    await reply_html(update, msg)
+
+
+@command_registry.command("subscribe_warnings", activation=True, max_queries=1)
+async def subscribe_warnings(update: Update, context: CallbackContext) -> None:
+    """Receive the new warnings of the ecosystem(s) specified or all if not
+    specified. The lowest warning level notified can be given first."""
+    args = list(context.args)
+    level = WARNING_LEVELS[0]
+    if args:
+        try:
+            level = gv.safe_enum_from_name(gv.WarningLevel, args[0])
+        except ValueError:
+            pass
+        else:
+            args.pop(0)
+    ecosystems_uid: frozenset[str] | None = None
+    if args:
+        ecosystems = await reference_data.get_ecosystems(args)
+        if not ecosystems:
+            await reply_text(
+                update,
+                f"No ecosystem named {', '.join(args)} was found.")
             return
-        actuator_state = await ecosystem.get_actuator_state(session, actuator)
-        if not actuator_state.active:
-            await update.message.reply_text(
-                f"Ecosystem {ecosystem_name} is cannot manage {actuator.name}.")
+        ecosystems_uid = _ecosystems_key(ecosystems)
+    warnings_notifier.subscribe(
+        update.effective_chat.id, WarningsSubscription(ecosystems_uid, level))
+    await reply_text(
+        update,
+        f"You will receive the new warnings of level {level.name} or higher. "
+        f"Use /unsubscribe_warnings to stop receiving them."
+    )
+
+
+@command_registry.command("unsubscribe_warnings", activation=True, max_queries=1)
+async def unsubscribe_warnings(update: Update, context: CallbackContext) -> None:
+    """Stop receiving the new warnings."""
+    if warnings_notifier.unsubscribe(update.effective_chat.id):
+        await reply_text(update, "You will no longer receive the new warnings.")
+    else:
+        await reply_text(update, "You were not receiving the new warnings.")
+
+
+@command_registry.command("subscribe_digest", activation=True, max_queries=1)
+async def subscribe_digest(update: Update, context: CallbackContext) -> None:
+    """Receive a recap of the ecosystem(s) specified or all if not specified,
+    every day at a given time (UTC) such as 'daily 08:00', or every hour at a
+    given minute such as 'hourly :15'."""
+    args = context.args
+    if len(args) < 2:
+        await reply_text(
+            update,
+            "You need to provide the frequency and the time of the recap, such as "
+            "'daily 08:00' or 'hourly :15'"
+        )
+        return
+    frequency, at, *ecosystems_name = args
+    ecosystems_uid: tuple[str, ...] | None = None
+    if ecosystems_name:
+        ecosystems = await reference_data.get_ecosystems(ecosystems_name)
+        if not ecosystems:
+            await reply_text(
+                update,
+                f"No ecosystem named {', '.join(ecosystems_name)} was found.")
             return
-        dispatcher: AsyncDispatcher = DispatcherFactory.get("chatbot")
-        await ecosystem.turn_actuator(dispatcher, actuator, mode, countdown)
-        await update.message.reply_text(
-            f"A request to turn {actuator.name} to {mode.name} has been sent to "
-            f"{ecosystem_name}."
+        ecosystems_uid = tuple(sorted(_ecosystems_key(ecosystems)))
+    try:
+        schedule = DigestSchedule.parse(frequency.lower(), at, ecosystems_uid)
+    except ValueError:
+        await reply_text(
+            update,
+            f"'{frequency} {at}' is not a valid schedule. Use 'daily HH:MM' or "
+            f"'hourly :MM', such as 'daily 08:00' or 'hourly :15'.")
+        return
+    digest_scheduler.subscribe(update.effective_chat.id, schedule)
+    await reply_text(
+        update,
+        f"You will receive a recap {schedule.describe()}. Use /unsubscribe_digest "
+        f"to stop receiving it."
+    )
+
+
+@command_registry.command("unsubscribe_digest", activation=True, max_queries=1)
+async def unsubscribe_digest(update: Update, context: CallbackContext) -> None:
+    """Stop receiving the recap on a schedule."""
+    if digest_scheduler.unsubscribe(update.effective_chat.id):
+        await reply_text(update, "You will no longer receive the recap.")
+    else:
+        await reply_text(update, "You were not receiving the recap.")
+
+
+@command_registry.command("watch", activation=True, max_queries=4)
+async def watch_ecosystem(update: Update, context: CallbackContext) -> None:
+    """Keep a pinned message showing the status, sensors data and actuators state of
+    an ecosystem, updated as they change. The message is no longer updated after a
+    while, or on /unwatch."""
+    args = context.args
+    if len(args) != 1:
+        await reply_text(update, "You need to provide the ecosystem to watch")
+        return
+    ecosystems = await reference_data.get_ecosystems(args)
+    contents = await _render_watch([ecosystems[0].uid]) if ecosystems else {}
+    if not contents:
+        await reply_text(update, f"No ecosystem named '{args[0]}' was found.")
+        return
+    chat_id = update.effective_chat.id
+    previous = watcher.unwatch(chat_id)
+    if previous is not None:
+        await watcher.end(chat_id, previous)
+    content = contents[ecosystems[0].uid]
+    messages = await reply_html(update, watch_message(content))
+    watcher.watch(chat_id, ecosystems[0].uid, messages[-1].message_id, content)
+    try:
+        await messages[-1].pin(disable_notification=True)
+    except TelegramError:
+        # The bot might not be allowed to pin messages in this chat
+        pass
+
+
+@command_registry.command("unwatch", activation=True, max_queries=1)
+async def unwatch_ecosystem(update: Update, context: CallbackContext) -> None:
+    """Stop updating the message of /watch."""
+    chat_id = update.effective_chat.id
+    session = watcher.unwatch(chat_id)
+    if session is None:
+        await reply_text(update, "No ecosystem is watched in this chat.")
+        return
+    await watcher.end(chat_id, session)
+    await reply_text(update, "The ecosystem is no longer watched.")
+
+
+async def _add_alert(update: Update, args: list[str]) -> None:
+    if len(args) not in (4, 6) or (len(args) == 6 and args[4].lower() != "for"):
+        await reply_text(
+            update,
+            "You need to provide the ecosystem, the measure, the operator, the "
+            "threshold and optionally for how long it must be crossed, such as "
+            "'/alert add greenhouse temperature > 30 for 10m'"
         )
+        return
+    ecosystem_name, measure, operator_, threshold = args[:4]
+    if operator_ not in OPERATORS:
+        await reply_text(
+            update,
+            f"'{operator_}' is not a valid operator. Valid operators are "
+            f"{', '.join(OPERATORS)}")
+        return
+    try:
+        threshold = float(threshold)
+    except ValueError:
+        await reply_text(update, f"'{threshold}' is not a valid threshold.")
+        return
+    duration = 0.0
+    if len(args) == 6:
+        try:
+            duration = parse_period(args[5]).total_seconds()
+        except ValueError:
+            await reply_text(
+                update,
+                f"'{args[5]}' is not a valid period. Use a number followed by m, h, "
+                f"d or w, such as 10m or 1h.")
+            return
+    ecosystems = await reference_data.get_ecosystems([ecosystem_name])
+    if not ecosystems:
+        await reply_text(update, f"No ecosystem named '{ecosystem_name}' was found.")
+        return
+    measure = measure.lower()
+    units = await reference_data.get_units()
+    if measure not in units:
+        await reply_text(
+            update,
+            f"'{measure}' is not a valid measure. Valid measures are "
+            f"{', '.join(sorted(units))}")
+        return
+    try:
+        rule = alert_engine.add(
+            update.effective_chat.id, ecosystems[0].uid, measure, operator_, threshold,
+            duration, abs(threshold) * settings.alert_hysteresis)
+    except ValueError as e:
+        await reply_text(update, f"{e}. Use /alert remove to remove one.")
+        return
+    await reply_text(
+        update,
+        f"Alert #{rule.id} added: you will be notified when "
+        f"{rule.condition.replace('_', ' ')} in {ecosystems[0].name}."
+    )
 
 
-def _get_command_helper(handler: CommandHandler) -> str:
-    commands: list[str] = [i for i in handler.commands]
-    if len(commands) > 1:
-        raise ValueError("Only one command is allowed per handler")
-    doc = getdoc(handler.callback).replace("\n", " ")
-    return f"/{commands[0]} : {doc}\n"
+@command_registry.command("alert", activation=True, max_queries=1)
+async def manage_alerts(update: Update, context: CallbackContext) -> None:
+    """Be notified when a measure of an ecosystem crosses a threshold, optionally
+    for a period, with 'add <ecosystem> <measure> <operator> <threshold> [for
+    <period>]', such as 'add greenhouse temperature > 30 for 10m'. Use 'list' to
+    list the alerts of the chat and 'remove <id>' to remove one."""
+    args = context.args
+    action = args[0].lower() if args else None
+    chat_id = update.effective_chat.id
+    if action == "add":
+        await _add_alert(update, args[1:])
+    elif action == "list":
+        rules = alert_engine.chat_rules(chat_id)
+        if not rules:
+            await reply_text(update, "No alert was added in this chat.")
+            return
+        lines = [
+            f"#{rule.id} {await reference_data.get_name(rule.ecosystem_uid)}: "
+            f"{rule.condition.replace('_', ' ')}"
+            for rule in rules
+        ]
+        await reply_text(update, "\n".join(["Alerts of this chat:", *lines]))
+    elif action == "remove" and len(args) == 2:
+        try:
+            rule_id = int(args[1].lstrip("#"))
+        except ValueError:
+            rule_id = None
+        if rule_id is not None and alert_engine.remove(chat_id, rule_id):
+            await reply_text(update, f"Alert #{rule_id} removed.")
+        else:
+            await reply_text(update, f"No alert '{args[1]}' was found in this chat.")
+    else:
+        await reply_text(
+            update,
+            "Use '/alert add <ecosystem> <measure> <operator> <threshold> [for "
+            "<period>]', '/alert list' or '/alert remove <id>'"
+        )
 
 
-@make_handler(CommandHandler, "help")
+@command_registry.command("help", listed=False, max_queries=1)
 async def get_help(update: Update, context: CallbackContext) -> None:
-    telegram_id = update.effective_user.id
-    async with db.scoped_session() as session:
-        user = await get_current_user(session, telegram_id)
-    msg = "Here is a list of the commands available:\n"
-    if user.is_anonymous:
-        msg += _get_command_helper(link_account)
-        await update.message.reply_html(msg)
-        return
-    msg += _get_command_helper(get_ecosystems)
-    msg += _get_command_helper(get_ecosystems_status)
-    msg += _get_command_helper(get_current_sensors)
-    msg += _get_command_helper(get_actuators_state)
-    msg += _get_command_helper(get_warnings)
-    msg += _get_command_helper(get_recap)
-    if user.can(Permission.OPERATE):
-        msg += _get_command_helper(switch_actuator)
-    await update.message.reply_text(msg)
-
-
-@make_handler(MessageHandler, filters.COMMAND)
+    """List the commands available."""
+    user = await current_user(update.effective_user.id)
+    await reply_text(update, command_registry.get_help(user))
+    await command_registry.update_chat_menu(context.bot, update.effective_chat.id, user)
+
+
+@command_registry.fallback(filters.COMMAND, max_queries=1)
 async def unknown_command(update: Update, context: CallbackContext):
     telegram_id = update.effective_user.id
-    async with db.scoped_session() as session:
-        user = await get_current_user(session, telegram_id)
+    user = await current_user(telegram_id)
     if user.is_authenticated:
         sorry = f"Sorry {user.username},"
     else:
         sorry = "Sorry,"
-    await update.message.reply_text(
+    await reply_text(
+        update,
         f"{sorry} I did not understand that command. Use /help to see the "
         f"commands available")
 
 
-HANDLERS = [
-    start,
-    get_ecosystems,
-    get_ecosystems_status,
-    get_current_sensors,
-    get_actuators_state,
-    get_warnings,
-    get_recap,
-    switch_actuator,
-    get_help,
-    unknown_command,
-]
+# The `max_queries` of the handlers are the number of SQL statements they can
+# execute once the user and the reference data are cached. They are checked by the
+# tests for several numbers of ecosystems, and their overruns logged in debug mode
+HANDLERS = command_registry.handlers
@@ -2,3 +2,119 @@ import os
 
 class Config:
     TELEGRAM_BOT_TOKEN: str | None = os.environ.get("OURANOS_TELEGRAM_BOT_TOKEN", None)
+    # How updates are received from Telegram: either "polling" or "webhook"
+    TELEGRAM_UPDATE_MODE: str = os.environ.get("OURANOS_TELEGRAM_UPDATE_MODE", "polling")
+    # Local address the webhook listener binds to
+    TELEGRAM_WEBHOOK_HOST: str = os.environ.get("OURANOS_TELEGRAM_WEBHOOK_HOST", "127.0.0.1")
+    TELEGRAM_WEBHOOK_PORT: int = int(os.environ.get("OURANOS_TELEGRAM_WEBHOOK_PORT", 8443))
+    TELEGRAM_WEBHOOK_PATH: str = os.environ.get("OURANOS_TELEGRAM_WEBHOOK_PATH", "telegram")
+    # Public HTTPS URL Telegram sends the updates to, usually a reverse proxy
+    # forwarding to the listener. Required in webhook mode
+    TELEGRAM_WEBHOOK_URL: str | None = os.environ.get("OURANOS_TELEGRAM_WEBHOOK_URL", None)
+    # Secret checked against the 'X-Telegram-Bot-Api-Secret-Token' header of the
+    # incoming requests. A random one is generated at startup when not set
+    TELEGRAM_WEBHOOK_SECRET_TOKEN: str | None = os.environ.get(
+        "OURANOS_TELEGRAM_WEBHOOK_SECRET_TOKEN", None)
+    # Number of seconds during which the message rendered by a read-only command is
+    # reused by identical commands. Only concurrent commands share it when set to 0
+    CHATBOT_COMMANDS_FRESHNESS: float = float(
+        os.environ.get("OURANOS_CHATBOT_COMMANDS_FRESHNESS", 0.0))
+    # Number of users kept in cache, and for how long (in seconds). Telegram ids not
+    # linked to any user are kept for a shorter time
+    CHATBOT_USER_CACHE_SIZE: int = int(os.environ.get("OURANOS_CHATBOT_USER_CACHE_SIZE", 1024))
+    CHATBOT_USER_CACHE_TTL: float = float(os.environ.get("OURANOS_CHATBOT_USER_CACHE_TTL", 60))
+    CHATBOT_ANONYMOUS_CACHE_TTL: float = float(
+        os.environ.get("OURANOS_CHATBOT_ANONYMOUS_CACHE_TTL", 10))
+    # Maximum number of updates processed concurrently. The updates of a chat are
+    # always processed in order
+    CHATBOT_CONCURRENT_UPDATES: int = int(
+        os.environ.get("OURANOS_CHATBOT_CONCURRENT_UPDATES", 16))
+    # Maximum number of messages sent per second, overall and to a single chat
+    CHATBOT_GLOBAL_SEND_RATE: float = float(
+        os.environ.get("OURANOS_CHATBOT_GLOBAL_SEND_RATE", 30))
+    CHATBOT_CHAT_SEND_RATE: float = float(
+        os.environ.get("OURANOS_CHATBOT_CHAT_SEND_RATE", 1))
+    # Address the metrics are served on, in Prometheus' text format. They are not
+    # served when no port is set
+    CHATBOT_METRICS_HOST: str = os.environ.get("OURANOS_CHATBOT_METRICS_HOST", "127.0.0.1")
+    CHATBOT_METRICS_PORT: int | None = (
+        int(os.environ["OURANOS_CHATBOT_METRICS_PORT"])
+        if "OURANOS_CHATBOT_METRICS_PORT" in os.environ
+        else None
+    )
+    # Send the ecosystems status of /recap at once and edit the message as the other
+    # sections become ready, instead of sending the whole recap at the end
+    CHATBOT_PROGRESSIVE_RECAP: bool = (
+        os.environ.get("OURANOS_CHATBOT_PROGRESSIVE_RECAP", "false").lower()
+        in ("1", "true", "yes")
+    )
+    # Number of seconds after which the ecosystems' names and the measures' units are
+    # reloaded from the database
+    CHATBOT_REFERENCE_DATA_TTL: float = float(
+        os.environ.get("OURANOS_CHATBOT_REFERENCE_DATA_TTL", 300))
+    # Directory the compiled templates are cached in between two startups. They are
+    # only compiled in memory when not set
+    CHATBOT_TEMPLATES_CACHE_DIR: str | None = os.environ.get(
+        "OURANOS_CHATBOT_TEMPLATES_CACHE_DIR", None)
+    # Number of rendered per-ecosystem message fragments kept in cache
+    CHATBOT_FRAGMENT_CACHE_SIZE: int = int(
+        os.environ.get("OURANOS_CHATBOT_FRAGMENT_CACHE_SIZE", 2048))
+    # Number of seconds /switch_actuator waits for Gaia to confirm that the actuators
+    # were switched. The requests are sent without waiting when set to 0
+    CHATBOT_ACTUATOR_ACK_TIMEOUT: float = float(
+        os.environ.get("OURANOS_CHATBOT_ACTUATOR_ACK_TIMEOUT", 10))
+    # Number of warnings per page of /warnings, and listed by /recap
+    CHATBOT_WARNINGS_PAGE_SIZE: int = int(
+        os.environ.get("OURANOS_CHATBOT_WARNINGS_PAGE_SIZE", 10))
+    # Number of seconds between two refreshes of the /watch messages, in the absence
+    # of events from the watched ecosystems, and after which a watch ends
+    CHATBOT_WATCH_INTERVAL: float = float(
+        os.environ.get("OURANOS_CHATBOT_WATCH_INTERVAL", 60))
+    CHATBOT_WATCH_DURATION: float = float(
+        os.environ.get("OURANOS_CHATBOT_WATCH_DURATION", 3600))
+    # Number of seconds over which the recaps scheduled at the same time are spread
+    CHATBOT_DIGEST_SPREAD: float = float(
+        os.environ.get("OURANOS_CHATBOT_DIGEST_SPREAD", 300))
+    # Maximal number of /alert rules per chat, and default margin, as a fraction of
+    # the threshold, the value must cross back past the threshold to clear an alert
+    CHATBOT_ALERTS_PER_CHAT: int = int(os.environ.get("OURANOS_CHATBOT_ALERTS_PER_CHAT", 20))
+    CHATBOT_ALERT_HYSTERESIS: float = float(
+        os.environ.get("OURANOS_CHATBOT_ALERT_HYSTERESIS", 0.05))
+    # Number of points /history downsamples the archived sensors data to
+    CHATBOT_HISTORY_POINTS: int = int(os.environ.get("OURANOS_CHATBOT_HISTORY_POINTS", 32))
+    # Number of workers drawing the /chart images, and whether they are processes or
+    # threads. Processes keep the drawing from competing with the event loop for the GIL
+    CHATBOT_CHART_WORKERS: int = int(os.environ.get("OURANOS_CHATBOT_CHART_WORKERS", 2))
+    CHATBOT_CHART_PROCESSES: bool = (
+        os.environ.get("OURANOS_CHATBOT_CHART_PROCESSES", "true").lower()
+        in ("1", "true", "yes")
+    )
+    # Number of points per measure of the /chart images
+    CHATBOT_CHART_POINTS: int = int(os.environ.get("OURANOS_CHATBOT_CHART_POINTS", 120))
+    # Length, in seconds, of the time buckets the /chart images are cached for
+    CHATBOT_CHART_CACHE_TTL: float = float(
+        os.environ.get("OURANOS_CHATBOT_CHART_CACHE_TTL", 300))
+    # Event loop lag, in seconds, above which a warning is logged
+    CHATBOT_LOOP_LAG_WARNING: float = float(
+        os.environ.get("OURANOS_CHATBOT_LOOP_LAG_WARNING", 0.25))
+    # Database the chatbot state (the users linked to the Telegram ids, the chats
+    # subscriptions and the last update handled) is saved in to survive restarts.
+    # Defaults to a SQLite file in Ouranos' directory
+    CHATBOT_STATE_DATABASE_URI: str | None = os.environ.get(
+        "OURANOS_CHATBOT_STATE_DATABASE_URI", None)
+    # Number of seconds between two writes of the chatbot state
+    CHATBOT_STATE_FLUSH_INTERVAL: float = float(
+        os.environ.get("OURANOS_CHATBOT_STATE_FLUSH_INTERVAL", 5))
+
+
+class Settings:
+    """Behaviour of the commands, set from the config parameters at startup."""
+    progressive_recap: bool = False
+    actuator_ack_timeout: float = 10.0
+    history_points: int = 32
+    warnings_page_size: int = 10
+    chart_points: int = 120
+    alert_hysteresis: float = 0.05
+
+
+settings = Settings()
@@ -1,34 +1,64 @@
+from datetime import datetime, timezone
 import functools
 from inspect import signature
 from typing import Type
 
 from telegram import Update
-from telegram.ext import BaseHandler, CallbackContext
+from telegram.ext import BaseHandler, CallbackContext, CallbackQueryHandler
 from telegram.ext.filters import BaseFilter
 
-from ouranos import db
 from ouranos.core.database.models.app import Permission, User
 
-from ouranos_chatbot.auth import get_current_user
+from ouranos_chatbot.metrics import span, track_handler, update_lag
+from ouranos_chatbot.request import close_session, current_user, request_scope
+from ouranos_chatbot.sender import reply_html
+
+
+def _instrument(func):
+    @functools.wraps(func)
+    async def wrapper(update: Update, context: CallbackContext):
+        message_date = getattr(update.message, "date", None)
+        if isinstance(message_date, datetime):
+            update_lag.observe(
+                (datetime.now(timezone.utc) - message_date).total_seconds())
+        with track_handler(func.__name__):
+            async with request_scope(update.effective_user.id):
+                return await func(update, context)
+    return wrapper
 
 
 def make_handler(handler: Type[BaseHandler], command_or_filter: str | BaseFilter):
     def decorator(func):
-        return handler(command_or_filter, func)
+        return handler(command_or_filter, _instrument(func))
+    return decorator
+
+
+def make_callback_query_handler(pattern: str):
+    def decorator(func):
+        return CallbackQueryHandler(_instrument(func), pattern=pattern)
     return decorator
 
 
+def _takes_user(func) -> bool:
+    # Don't follow `__wrapped__`, the wrapper of `permission_required` takes the
+    # user even when the function it wraps does not
+    return "user" in signature(func, follow_wrapped=False).parameters
+
+
 def activation_required(func):
+    pass_user = _takes_user(func)
+
     @functools.wraps(func)
     async def wrapper(update: Update, context: CallbackContext):
-        telegram_id = update.effective_user.id
-        async with db.scoped_session() as session:
-            user = await get_current_user(session, telegram_id)
+        with span("auth"):
+            user = await current_user(update.effective_user.id)
         if user.is_anonymous:
-            await update.message.reply_html(
+            await close_session()
+            await reply_html(
+                update,
                 "You need to be registered to use this command")
             return
-        if "user" in signature(func).parameters:
+        if pass_user:
             return await func(update, context, user)
         return await func(update, context)
     return wrapper
@@ -36,6 +66,8 @@ def activation_required(func):
 
 def permission_required(permission: Permission):
     def decorator(func):
+        pass_user = _takes_user(func)
+
         @functools.wraps(func)
         async def wrapped(
                 update: Update,
@@ -43,15 +75,16 @@ def permission_required(permission: Permission):
                 user: User | None = None
         ):
             if not user:
-                telegram_id = update.effective_user.id
-                async with db.scoped_session() as session:
-                    user = await get_current_user(session, telegram_id)
+                with span("auth"):
+                    user = await current_user(update.effective_user.id)
             if user.can(permission):
-                if "user" in signature(func).parameters:
+                if pass_user:
                     return await func(update, context, user)
                 return await func(update, context)
             else:
-                await update.message.reply_html(
+                await close_session()
+                await reply_html(
+                    update,
                     "You do not have the permission to use this command"
                 )
         return wrapped
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+import logging
+import re
+from typing import NamedTuple
+
+from telegram.ext import CallbackContext, Job, JobQueue
+
+from ouranos import db
+from ouranos.core.database.models.gaia import Ecosystem
+
+from ouranos_chatbot.sender import sender
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+_daily_regex = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+_hourly_regex = re.compile(r"^:?([0-5]?\d)$")
+
+
+class DigestSchedule(NamedTuple):
+    # Hour of the daily digests, or None for hourly digests
+    hour: int | None
+    minute: int
+    # Uids of the ecosystems recapped, or None for the recently seen ones
+    ecosystems: tuple[str, ...] | None
+
+    @classmethod
+    def parse(
+            cls,
+            frequency: str,
+            at: str,
+            ecosystems: tuple[str, ...] | None = None,
+    ) -> DigestSchedule:
+        """Parse a schedule such as ('daily', '08:00') or ('hourly', ':15'),
+        in UTC."""
+        if frequency == "daily" and (match := _daily_regex.match(at)):
+            return cls(int(match[1]), int(match[2]), ecosystems)
+        if frequency == "hourly" and (match := _hourly_regex.match(at)):
+            return cls(None, int(match[1]), ecosystems)
+        raise ValueError(f"'{frequency} {at}' is not a valid schedule")
+
+    def is_due(self, now: datetime) -> bool:
+        return self.minute == now.minute and self.hour in (None, now.hour)
+
+    def describe(self) -> str:
+        if self.hour is None:
+            return f"every hour at minute {self.minute:02}"
+        return f"every day at {self.hour:02}:{self.minute:02} UTC"
+
+
+class DigestScheduler:
+    """Send a recap to the chats on their schedule.
+
+    A job checks every minute which chats are due. The recap of each distinct
+    set of ecosystems is computed once per slot whatever the number of chats
+    receiving it, and the sends are spread evenly over `spread` seconds so that
+    the digests due at the same time do not all go at once.
+    """
+    def __init__(self, spread: float = 300.0) -> None:
+        self.schedules: dict[int, DigestSchedule] = {}
+        self._job: Job | None = None
+        self.configure(spread)
+
+    def configure(self, spread: float = 300.0) -> None:
+        self.spread = spread
+
+    def subscribe(self, chat_id: int, schedule: DigestSchedule) -> None:
+        self.schedules[chat_id] = schedule
+
+    def unsubscribe(self, chat_id: int) -> bool:
+        return self.schedules.pop(chat_id, None) is not None
+
+    def dump(self) -> dict[str, dict]:
+        return {
+            str(chat_id): {
+                "hour": schedule.hour,
+                "minute": schedule.minute,
+                "ecosystems": (
+                    list(schedule.ecosystems) if schedule.ecosystems is not None else None
+                ),
+            }
+            for chat_id, schedule in self.schedules.items()
+        }
+
+    def restore(self, schedules: dict[str, dict]) -> None:
+        for chat_id, schedule in schedules.items():
+            try:
+                ecosystems = schedule["ecosystems"]
+                self.schedules[int(chat_id)] = DigestSchedule(
+                    schedule["hour"],
+                    schedule["minute"],
+                    tuple(ecosystems) if ecosystems is not None else None,
+                )
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Could not restore the digest schedule of chat {chat_id}.")
+
+    def due(self, now: datetime) -> dict[tuple[str, ...] | None, list[int]]:
+        """Group the chats due at `now` by the ecosystems they follow."""
+        rv: dict[tuple[str, ...] | None, list[int]] = {}
+        for chat_id, schedule in self.schedules.items():
+            if schedule.is_due(now):
+                rv.setdefault(schedule.ecosystems, []).append(chat_id)
+        return rv
+
+    async def _render(self, ecosystems_uid: tuple[str, ...] | None) -> str:
+        # Avoid the import loop between the commands and the digests
+        from ouranos_chatbot.commands import _get_ecosystems, _render_recap
+
+        async with db.scoped_session() as session:
+            if ecosystems_uid is None:
+                ecosystems = await _get_ecosystems(session, None)
+            else:
+                ecosystems = await Ecosystem.get_multiple_by_id(
+                    session, ecosystems_id=list(ecosystems_uid))
+            return await _render_recap(session, ecosystems)
+
+    async def _send(self, context: CallbackContext) -> None:
+        try:
+            await sender.send_message(
+                context.bot, context.job.chat_id, context.job.data, html=True)
+        except Exception as e:
+            logger.error(
+                f"Could not send the digest of chat {context.job.chat_id}. ERROR "
+                f"msg: `{e.__class__.__name__} :{e}`.")
+
+    async def _tick(self, context: CallbackContext) -> None:
+        # The job runs at the start of each minute, round to the closest one in case
+        # it runs a bit early
+        now = datetime.now(timezone.utc) + timedelta(seconds=30)
+        due = self.due(now.replace(second=0, microsecond=0))
+        if not due:
+            return
+        sends: list[tuple[int, str]] = []
+        # Render the groups one after the other to keep the load on the database
+        # bounded whatever the number of distinct ecosystem sets
+        for ecosystems_uid, chat_ids in due.items():
+            try:
+                msg = await self._render(ecosystems_uid)
+            except Exception as e:
+                logger.error(
+                    f"Could not compute the digest of {len(chat_ids)} chat(s). ERROR "
+                    f"msg: `{e.__class__.__name__} :{e}`.")
+                continue
+            sends.extend((chat_id, msg) for chat_id in chat_ids)
+        interval = self.spread / len(sends) if sends else 0.0
+        for i, (chat_id, msg) in enumerate(sends):
+            context.job_queue.run_once(
+                self._send, i * interval, data=msg, chat_id=chat_id,
+                name=f"digest-{chat_id}")
+
+    def start(self, job_queue: JobQueue) -> None:
+        """Check the schedules at the start of every minute."""
+        now = datetime.now(timezone.utc)
+        first = 60 - now.second - now.microsecond / 1e6
+        self._job = job_queue.run_repeating(
+            self._tick, interval=60, first=first, name="digests")
+
+    def stop(self) -> None:
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+
+
+digest_scheduler = DigestScheduler()
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import logging
+
+from dispatcher import AsyncEventHandler
+from telegram import Bot
+
+from ouranos.core.dispatchers import DispatcherOptions
+
+from ouranos_chatbot.actuators import actuator_acknowledgements
+from ouranos_chatbot.alerts import alert_engine
+from ouranos_chatbot.notifications import warnings_notifier
+from ouranos_chatbot.reference import reference_data
+from ouranos_chatbot.watch import watcher
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+def _ecosystems_uid(data: object) -> set[str]:
+    payloads = data if isinstance(data, list) else [data]
+    return {
+        payload["uid"] for payload in payloads
+        if isinstance(payload, dict) and "uid" in payload
+    }
+
+
+def configure_dispatcher() -> None:
+    """Make the 'chatbot' dispatcher use the same transport as Ouranos' internal
+    one, to receive its events."""
+    DispatcherOptions.set_uri_lookup(
+        "chatbot", DispatcherOptions.get_uri_lookup("application-internal"))
+    DispatcherOptions.set_options(
+        "chatbot", DispatcherOptions.get_options("application-internal"))
+
+
+class ChatbotEvents(AsyncEventHandler):
+    """Handle the events Ouranos forwards on its internal namespace."""
+    def __init__(self, bot: Bot) -> None:
+        super().__init__(namespace="application-internal")
+        self.bot = bot
+
+    async def on_base_info(self, sid: str, data: object) -> None:
+        # Keep the ecosystems' names up to date without reloading all of them
+        payloads = data if isinstance(data, list) else [data]
+        for payload in payloads:
+            try:
+                info = payload["data"]
+                reference_data.update_ecosystem(info["uid"], info["name"])
+            except (KeyError, TypeError):
+                logger.debug(
+                    "Received an unexpected 'base_info' payload, the reference "
+                    "data will be reloaded.")
+                reference_data.clear()
+                return
+
+    async def on_ecosystem_status(self, sid: str, data: object) -> None:
+        watcher.notify(_ecosystems_uid(data))
+
+    async def on_sensors_data(self, sid: str, data: object) -> None:
+        watcher.notify(_ecosystems_uid(data))
+        await alert_engine.handle_payload(self.bot, data)
+
+    async def on_actuators_data(self, sid: str, data: object) -> None:
+        # Confirm the actuators switched by /switch_actuator
+        actuator_acknowledgements.handle_payload(data)
+        watcher.notify(_ecosystems_uid(data))
+
+    async def on_warnings(self, sid: str, data: object) -> None:
+        # The event is only used as a trigger, the new warnings are fetched
+        # from the database at once
+        await warnings_notifier.notify(self.bot)
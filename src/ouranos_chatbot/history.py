@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from math import ceil
+import re
+from typing import NamedTuple
+
+from sqlalchemy import cast, func, Integer, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import ColumnElement
+
+from ouranos.core.database.models.gaia import SensorDataRecord
+
+
+SPARKS = "▁▂▃▄▅▆▇█"
+
+PERIOD_UNITS = {
+    "m": timedelta(minutes=1),
+    "h": timedelta(hours=1),
+    "d": timedelta(days=1),
+    "w": timedelta(weeks=1),
+}
+
+_period_regex = re.compile(r"^(\d+)([mhdw])$")
+
+
+def parse_period(period: str) -> timedelta:
+    """Parse a period such as '30m', '12h', '7d' or '2w'."""
+    match = _period_regex.match(period.strip().lower())
+    if match is None or int(match[1]) == 0:
+        raise ValueError(f"'{period}' is not a valid period")
+    return int(match[1]) * PERIOD_UNITS[match[2]]
+
+
+def format_period(period: timedelta) -> str:
+    """Format a period with the largest unit dividing it, the inverse of
+    `parse_period`."""
+    for unit, length in reversed(PERIOD_UNITS.items()):
+        if period >= length and period % length == timedelta(0):
+            return f"{period // length}{unit}"
+    return f"{int(period.total_seconds())}s"
+
+
+class HistoryBucket(NamedTuple):
+    index: int
+    mean: float
+    min: float
+    max: float
+    count: int
+
+
+class History(NamedTuple):
+    start: datetime
+    end: datetime
+    points: int
+    buckets: list[HistoryBucket]
+
+    @property
+    def min(self) -> float:
+        return min(bucket.min for bucket in self.buckets)
+
+    @property
+    def max(self) -> float:
+        return max(bucket.max for bucket in self.buckets)
+
+    @property
+    def mean(self) -> float:
+        count = sum(bucket.count for bucket in self.buckets)
+        return sum(bucket.mean * bucket.count for bucket in self.buckets) / count
+
+    def sparkline(self) -> str:
+        """Draw the mean of each bucket, leaving a blank for the buckets without
+        data."""
+        means = {bucket.index: bucket.mean for bucket in self.buckets}
+        low = min(means.values())
+        span = max(means.values()) - low
+        rv = []
+        for index in range(self.points):
+            try:
+                mean = means[index]
+            except KeyError:
+                rv.append(" ")
+                continue
+            level = int((mean - low) / span * (len(SPARKS) - 1)) if span else 0
+            rv.append(SPARKS[level])
+        return "".join(rv)
+
+
+def _bucket_index(
+        dialect: str,
+        timestamp: ColumnElement,
+        start: datetime,
+        width: int,
+) -> ColumnElement | None:
+    """Index of the `width` seconds long bucket the timestamp falls in, the
+    first bucket starting at `start`, or None if the dialect is not supported."""
+    start_epoch = int(start.timestamp())
+    if dialect == "sqlite":
+        epoch = cast(func.strftime("%s", timestamp), Integer)
+        # Integer division, rounding down the non-negative integers
+        return (epoch - start_epoch) // width
+    if dialect == "postgresql":
+        epoch = func.extract("epoch", timestamp)
+    elif dialect in ("mysql", "mariadb"):
+        epoch = func.unix_timestamp(timestamp)
+    else:
+        return None
+    return func.floor((epoch - start_epoch) / width)
+
+
+async def _get_buckets_in_python(
+        session: AsyncSession,
+        stmt,
+        start: datetime,
+        width: int,
+) -> list[tuple[str, int, float, float, float, int]]:
+    """Group the rows (measure, timestamp, value) selected by `stmt` into time
+    buckets, for the dialects the database cannot compute the buckets with. The
+    rows are streamed rather than all loaded at once."""
+    # (measure, index): [sum, min, max, count]
+    buckets: dict[tuple[str, int], list[float]] = {}
+    result = await session.stream(stmt)
+    async for measure, timestamp, value in result:
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        index = int((timestamp - start).total_seconds() // width)
+        try:
+            bucket = buckets[(measure, index)]
+        except KeyError:
+            buckets[(measure, index)] = [value, value, value, 1]
+        else:
+            bucket[0] += value
+            bucket[1] = min(bucket[1], value)
+            bucket[2] = max(bucket[2], value)
+            bucket[3] += 1
+    return [
+        (measure, index, total / count, min_, max_, count)
+        for (measure, index), (total, min_, max_, count) in sorted(buckets.items())
+    ]
+
+
+async def get_histories(
+        session: AsyncSession,
+        ecosystem_uid: str,
+        measures: list[str] | None,
+        period: timedelta,
+        points: int = 32,
+        end: datetime | None = None,
+) -> dict[str, History]:
+    """Get the archived sensors data of the measures of an ecosystem, or of all
+    its measures when None is given, over a period.
+
+    The data is downsampled by the database into `points` time buckets per
+    measure, so that at most `points` rows per measure are loaded whatever the
+    length of the period. With the databases the buckets cannot be computed by,
+    the rows are grouped into buckets as they are streamed.
+    """
+    end = end or datetime.now(timezone.utc)
+    start = end - period
+    width = max(1, ceil(period.total_seconds() / points))
+    dialect = session.get_bind(SensorDataRecord).dialect.name
+    bucket = _bucket_index(dialect, SensorDataRecord.timestamp, start, width)
+    if bucket is None:
+        stmt = select(
+            SensorDataRecord.measure,
+            SensorDataRecord.timestamp,
+            SensorDataRecord.value,
+        )
+    else:
+        bucket = bucket.label("bucket")
+        stmt = (
+            select(
+                SensorDataRecord.measure,
+                bucket,
+                func.avg(SensorDataRecord.value),
+                func.min(SensorDataRecord.value),
+                func.max(SensorDataRecord.value),
+                func.count(SensorDataRecord.value),
+            )
+            .group_by(SensorDataRecord.measure, bucket)
+            .order_by(SensorDataRecord.measure, bucket)
+        )
+    stmt = (
+        stmt
+        .where(SensorDataRecord.ecosystem_uid == ecosystem_uid)
+        .where(SensorDataRecord.timestamp >= start)
+        .where(SensorDataRecord.timestamp < end)
+    )
+    if measures is not None:
+        stmt = stmt.where(SensorDataRecord.measure.in_(measures))
+    if bucket is None:
+        result = await _get_buckets_in_python(session, stmt, start, width)
+    else:
+        result = await session.execute(stmt)
+    rv: dict[str, History] = {
+        measure: History(start, end, points, []) for measure in measures or []}
+    for measure, index, mean, min_, max_, count in result:
+        # Rounding might put the very last timestamps in an extra bucket
+        if int(index) >= points:
+            continue
+        if measure not in rv:
+            rv[measure] = History(start, end, points, [])
+        rv[measure].buckets.append(
+            HistoryBucket(int(index), float(mean), float(min_), float(max_), count))
+    return rv
+
+
+async def get_history(
+        session: AsyncSession,
+        ecosystem_uid: str,
+        measure: str,
+        period: timedelta,
+        points: int = 32,
+        end: datetime | None = None,
+) -> History:
+    """Get the archived sensors data of a measure of an ecosystem over a period,
+    downsampled into `points` time buckets."""
+    histories = await get_histories(
+        session, ecosystem_uid, [measure], period, points, end)
+    return histories[measure]
@@ -1,11 +1,27 @@
-from telegram.ext import Application
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import secrets
+from typing import Any, TYPE_CHECKING
 
 from gaia_validators import missing
-from ouranos.core.config import ConfigDict
 from ouranos.sdk import Functionality
 
 from ouranos_chatbot.config import Config
 
+if TYPE_CHECKING:
+    from telegram.ext import Application
+
+    from ouranos.core.config import ConfigDict
+
+
+# Only the modules needed to declare the plugin are imported at the module level,
+# Telegram, Jinja and the models are imported at startup. Ouranos imports this
+# module whenever it discovers its plugins, even when the chatbot is not used
+
+UPDATE_MODES = ("polling", "webhook")
+
 
 class Chatbot(Functionality):
     def __init__(self, config: ConfigDict, **kwargs) -> None:
@@ -21,29 +37,224 @@ class Chatbot(Functionality):
                 "The config parameters 'TELEGRAM_BOT_TOKEN' is not set, it is "
                 "not possible to use the chatbot functionality.")
         self.token = token
+        self.update_mode: str = self.get_config_value("TELEGRAM_UPDATE_MODE")
         self.application: Application | None = None
+        self.metrics_server: asyncio.Server | None = None
+
+    def get_config_value(self, key: str) -> Any:
+        """Get a chatbot config parameter, falling back to `Config` default
+        value when Ouranos' config class does not define it."""
+        return self.config.get(key, getattr(Config, key))
 
     def load_handlers(self):
+        from telegram import Update
+        from telegram.ext import TypeHandler
+
         from ouranos_chatbot.commands import HANDLERS
+        from ouranos_chatbot.registry import command_registry
+        from ouranos_chatbot.update_processor import skip_handled_updates
 
+        self.application.add_handler(TypeHandler(Update, skip_handled_updates), group=-1)
         for handler in HANDLERS:
             self.application.add_handler(handler)
+        command_registry.compile()
+
+    async def _start_webhook(self) -> None:
+        secret_token = self.get_config_value("TELEGRAM_WEBHOOK_SECRET_TOKEN")
+        if secret_token is None:
+            self.logger.warning(
+                "The config parameter 'TELEGRAM_WEBHOOK_SECRET_TOKEN' is not "
+                "set, a random secret token will be used.")
+            secret_token = secrets.token_urlsafe(32)
+        host = self.get_config_value("TELEGRAM_WEBHOOK_HOST")
+        port = int(self.get_config_value("TELEGRAM_WEBHOOK_PORT"))
+        path = self.get_config_value("TELEGRAM_WEBHOOK_PATH").strip("/")
+        self.logger.info(f"Listening for Telegram updates on {host}:{port}/{path}.")
+        await self.application.updater.start_webhook(
+            listen=host,
+            port=port,
+            url_path=path,
+            webhook_url=self.get_config_value("TELEGRAM_WEBHOOK_URL"),
+            secret_token=secret_token,
+        )
+
+    async def _start_state_store(self) -> None:
+        from ouranos_chatbot.alerts import alert_engine
+        from ouranos_chatbot.auth import restore_user_cache, user_cache
+        from ouranos_chatbot.digests import digest_scheduler
+        from ouranos_chatbot.notifications import warnings_notifier
+        from ouranos_chatbot.persistence import state_store
+        from ouranos_chatbot.update_processor import update_tracker
+        from ouranos_chatbot.watch import watcher
+
+        uri = self.get_config_value("CHATBOT_STATE_DATABASE_URI")
+        if uri is None:
+            path = Path(self.config.get("DIR", ".")) / "chatbot_state.db"
+            uri = f"sqlite+aiosqlite:///{path}"
+        state_store.configure(
+            uri=uri,
+            flush_interval=float(self.get_config_value("CHATBOT_STATE_FLUSH_INTERVAL")),
+        )
+        state_store.register("links", user_cache.dump, restore_user_cache)
+        state_store.register(
+            "subscriptions", warnings_notifier.dump, warnings_notifier.restore)
+        state_store.register("updates", update_tracker.dump, update_tracker.restore)
+        state_store.register("watches", watcher.dump, watcher.restore)
+        state_store.register(
+            "digests", digest_scheduler.dump, digest_scheduler.restore)
+        state_store.register("alerts", alert_engine.dump, alert_engine.restore)
+        await state_store.start()
+
+    async def _start_dispatcher(self) -> None:
+        from ouranos.core.dispatchers import DispatcherFactory
+
+        from ouranos_chatbot.events import ChatbotEvents, configure_dispatcher
+        from ouranos_chatbot.notifications import warnings_notifier
+
+        await warnings_notifier.initialize()
+        configure_dispatcher()
+        dispatcher = DispatcherFactory.get("chatbot")
+        dispatcher.register_event_handler(ChatbotEvents(self.application.bot))
+        await dispatcher.start(retry=True, block=False)
+
+    def _start_digests(self) -> None:
+        from ouranos_chatbot.digests import digest_scheduler
+
+        if self.application.job_queue is None:
+            self.logger.warning(
+                "The job queue of python-telegram-bot is not installed, the "
+                "scheduled recaps will not be sent.")
+            return
+        digest_scheduler.configure(
+            spread=float(self.get_config_value("CHATBOT_DIGEST_SPREAD")))
+        digest_scheduler.start(self.application.job_queue)
 
     async def _startup(self):
+        from telegram.ext import Application
+
+        from ouranos_chatbot.alerts import alert_engine
+        from ouranos_chatbot.auth import user_cache
+        from ouranos_chatbot.charts import chart_renderer
+        from ouranos_chatbot.coalescing import command_results
+        from ouranos_chatbot.config import settings
+        from ouranos_chatbot.messages.templates import (
+            fragment_cache, precompile_templates)
+        from ouranos_chatbot.metrics import (
+            event_loop_monitor, query_budgets, start_metrics_server)
+        from ouranos_chatbot.reference import reference_data
+        from ouranos_chatbot.registry import command_registry
+        from ouranos_chatbot.sender import sender
+        from ouranos_chatbot.update_processor import ChatOrderedUpdateProcessor
+        from ouranos_chatbot.watch import watcher
+
         if self.token is None:
             raise ValueError(
                 "The config parameters 'TELEGRAM_BOT_TOKEN' is not set, it is "
                 "not possible to use the chatbot functionality."
             )
-        self.application = Application.builder().token(self.token).build()
+        if self.update_mode not in UPDATE_MODES:
+            raise ValueError(
+                f"The config parameter 'TELEGRAM_UPDATE_MODE' should be one of "
+                f"{', '.join(UPDATE_MODES)}, not '{self.update_mode}'."
+            )
+        if (
+                self.update_mode == "webhook"
+                and self.get_config_value("TELEGRAM_WEBHOOK_URL") is None
+        ):
+            raise ValueError(
+                "The config parameter 'TELEGRAM_WEBHOOK_URL' is required in webhook "
+                "mode, Telegram only posts the updates to a public HTTPS URL."
+            )
+        user_cache.configure(
+            maxsize=int(self.get_config_value("CHATBOT_USER_CACHE_SIZE")),
+            ttl=float(self.get_config_value("CHATBOT_USER_CACHE_TTL")),
+            anonymous_ttl=float(self.get_config_value("CHATBOT_ANONYMOUS_CACHE_TTL")),
+        )
+        command_results.configure(
+            freshness=float(self.get_config_value("CHATBOT_COMMANDS_FRESHNESS")))
+        settings.progressive_recap = bool(
+            self.get_config_value("CHATBOT_PROGRESSIVE_RECAP"))
+        settings.actuator_ack_timeout = float(
+            self.get_config_value("CHATBOT_ACTUATOR_ACK_TIMEOUT"))
+        settings.history_points = int(self.get_config_value("CHATBOT_HISTORY_POINTS"))
+        settings.warnings_page_size = int(
+            self.get_config_value("CHATBOT_WARNINGS_PAGE_SIZE"))
+        settings.chart_points = int(self.get_config_value("CHATBOT_CHART_POINTS"))
+        settings.alert_hysteresis = float(
+            self.get_config_value("CHATBOT_ALERT_HYSTERESIS"))
+        alert_engine.configure(
+            max_rules_per_chat=int(self.get_config_value("CHATBOT_ALERTS_PER_CHAT")))
+        chart_renderer.configure(
+            workers=int(self.get_config_value("CHATBOT_CHART_WORKERS")),
+            use_processes=bool(self.get_config_value("CHATBOT_CHART_PROCESSES")),
+            cache_bucket=float(self.get_config_value("CHATBOT_CHART_CACHE_TTL")),
+        )
+        query_budgets.configure(log_overruns=bool(self.config.get("DEBUG", False)))
+        sender.configure(
+            global_rate=float(self.get_config_value("CHATBOT_GLOBAL_SEND_RATE")),
+            chat_rate=float(self.get_config_value("CHATBOT_CHAT_SEND_RATE")),
+        )
+        fragment_cache.configure(
+            maxsize=int(self.get_config_value("CHATBOT_FRAGMENT_CACHE_SIZE")))
+        precompile_templates(self.get_config_value("CHATBOT_TEMPLATES_CACHE_DIR"))
+        update_processor = ChatOrderedUpdateProcessor(
+            int(self.get_config_value("CHATBOT_CONCURRENT_UPDATES")))
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(update_processor)
+            .build()
+        )
         self.load_handlers()
         await self.application.initialize()
-        await self.application.updater.start_polling()
+        await command_registry.set_default_menu(self.application.bot)
+        reference_data.configure(
+            ttl=float(self.get_config_value("CHATBOT_REFERENCE_DATA_TTL")))
+        await reference_data.load()
+        await self._start_state_store()
+        await self._start_dispatcher()
+        watcher.configure(
+            interval=float(self.get_config_value("CHATBOT_WATCH_INTERVAL")),
+            duration=float(self.get_config_value("CHATBOT_WATCH_DURATION")),
+        )
+        watcher.start(self.application.bot)
+        self._start_digests()
+        event_loop_monitor.configure(
+            warning_threshold=float(self.get_config_value("CHATBOT_LOOP_LAG_WARNING")))
+        event_loop_monitor.start()
+        metrics_port = self.get_config_value("CHATBOT_METRICS_PORT")
+        if metrics_port is not None:
+            self.metrics_server = await start_metrics_server(
+                self.get_config_value("CHATBOT_METRICS_HOST"), int(metrics_port))
+        if self.update_mode == "webhook":
+            await self._start_webhook()
+        else:
+            await self.application.updater.start_polling()
         await self.application.start()
 
     async def _shutdown(self):
+        if self.application is None:
+            return
+        from ouranos.core.dispatchers import DispatcherFactory
+
+        from ouranos_chatbot.charts import chart_renderer
+        from ouranos_chatbot.metrics import event_loop_monitor
+        from ouranos_chatbot.persistence import state_store
+        from ouranos_chatbot.watch import watcher
+
+        await watcher.stop()
+        await DispatcherFactory.get("chatbot").stop()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+            self.metrics_server = None
+        # Stopping the updater also closes the webhook listener
         if self.application.updater.running:
             await self.application.updater.stop()
         if self.application.running:
             await self.application.stop()
+        # Save the state once no update can modify it anymore
+        await state_store.stop()
+        chart_renderer.shutdown()
+        await event_loop_monitor.stop()
         await self.application.shutdown()
@@ -1,7 +1,14 @@
+from __future__ import annotations
+
 from datetime import datetime
+from hashlib import blake2b
 from pathlib import Path
 
-from jinja2 import Environment, FileSystemLoader
+from cachetools import LRUCache
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from markupsafe import Markup
+
+from ouranos_chatbot.metrics import cache_hits, cache_misses, span
 
 
 # Template rendering
@@ -24,6 +31,61 @@ environment.filters["format_datetime"] = format_datetime
 environment.filters["get_names"] = get_names
 
 
+class FragmentCache:
+    """Cache of the rendered per-ecosystem fragments of the messages.
+
+    The fragments are keyed on a hash of their template name and context, so
+    that rendering a message only renders again the fragments whose data
+    changed. The context must only contain plain data (dicts, lists, strings,
+    numbers, datetimes ...) whose `repr` reflects the content.
+    """
+    def __init__(self, maxsize: int = 2048) -> None:
+        self._fragments: LRUCache = LRUCache(maxsize=maxsize)
+
+    def configure(self, maxsize: int = 2048) -> None:
+        self._fragments = LRUCache(maxsize=maxsize)
+
+    def clear(self) -> None:
+        self._fragments.clear()
+
+    @staticmethod
+    def _key(template_name: str, context: dict) -> bytes:
+        content = repr((template_name, sorted(context.items()))).encode()
+        return blake2b(content, digest_size=16).digest()
+
+    async def render(self, template_name: str, /, **context) -> Markup:
+        key = self._key(template_name, context)
+        try:
+            fragment = self._fragments[key]
+        except KeyError:
+            cache_misses.inc("fragments")
+            template = environment.get_template(f"{template_name}.html")
+            # The fragment is already escaped, it must not be escaped again
+            # when included in the message
+            fragment = Markup(await template.render_async(context))
+            self._fragments[key] = fragment
+        else:
+            cache_hits.inc("fragments")
+        return fragment
+
+
+fragment_cache = FragmentCache()
+
+environment.globals["fragment"] = fragment_cache.render
+
+
+def precompile_templates(bytecode_cache_dir: str | Path | None = None) -> None:
+    """Compile all the templates in advance so that the first messages do not
+    pay for it. When `bytecode_cache_dir` is given, the compiled templates are
+    also cached on disk and reused by the next startups."""
+    if bytecode_cache_dir is not None:
+        Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+        environment.bytecode_cache = FileSystemBytecodeCache(str(bytecode_cache_dir))
+    for name in environment.list_templates(extensions=["html"]):
+        environment.get_template(name)
+
+
 async def render_template(rel_path, **context) -> str:
-    template = await environment.get_template(f"{rel_path}.html").render_async(context)
+    with span("render"):
+        template = await environment.get_template(f"{rel_path}.html").render_async(context)
     return template.strip()
@@ -0,0 +1,406 @@
+from __future__ import annotations
+
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+from time import perf_counter
+from typing import Callable, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    labels = ",".join(
+        f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return f"{{{labels}}}"
+
+
+class Metric:
+    type: str
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+    def _header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, description, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labels, labels)} {value}"
+            for labels, value in self._values.items()
+        ]
+
+    def clear(self) -> None:
+        self._values.clear()
+
+
+class Gauge(Metric):
+    """A metric whose value is read from a callback when rendered."""
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, callback: Callable[[], float]) -> None:
+        super().__init__(name, description)
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        return self._header() + [f"{self.name} {self.callback()}"]
+
+    def clear(self) -> None:
+        pass
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            labels: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        # Labels: [count per bucket (the last one being +Inf), sum]
+        self._values: dict[tuple[str, ...], list[list[int] | float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        try:
+            counts, total = self._values[labels]
+        except KeyError:
+            counts, total = [0] * (len(self.buckets) + 1), 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._values[labels] = [counts, total + value]
+
+    def count(self, *labels: str) -> int:
+        try:
+            return sum(self._values[labels][0])
+        except KeyError:
+            return 0
+
+    def render(self) -> list[str]:
+        rv = self._header()
+        for labels, (counts, total) in self._values.items():
+            cumulated = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulated += count
+                bucket_labels = _format_labels(
+                    (*self.labels, "le"), (*labels, str(bound)))
+                rv.append(f"{self.name}_bucket{bucket_labels} {cumulated}")
+            formatted_labels = _format_labels(self.labels, labels)
+            rv.append(f"{self.name}_sum{formatted_labels} {total}")
+            rv.append(f"{self.name}_count{formatted_labels} {cumulated}")
+        return rv
+
+    def clear(self) -> None:
+        self._values.clear()
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        for metric in self.metrics.values():
+            metric.clear()
+
+
+registry = MetricsRegistry()
+
+handler_duration: Histogram = registry.register(Histogram(
+    "chatbot_handler_duration_seconds", "Time spent handling an update",
+    ("handler", )))
+phase_duration: Histogram = registry.register(Histogram(
+    "chatbot_handler_phase_seconds",
+    "Time spent in each phase (auth, db, render, send) of the handling of an "
+    "update. The phases can overlap, the auth phase might query the database",
+    ("handler", "phase")))
+handler_errors: Counter = registry.register(Counter(
+    "chatbot_handler_errors_total", "Errors raised while handling an update",
+    ("handler", )))
+db_queries: Counter = registry.register(Counter(
+    "chatbot_db_queries_total", "SQL statements executed while handling an update",
+    ("handler", )))
+handler_queries: Histogram = registry.register(Histogram(
+    "chatbot_handler_queries",
+    "Number of SQL statements executed per handling of an update",
+    ("handler", ),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55)))
+update_lag: Histogram = registry.register(Histogram(
+    "chatbot_update_lag_seconds",
+    "Time between the sending of a message and the start of its handling",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)))
+cache_hits: Counter = registry.register(Counter(
+    "chatbot_cache_hits_total", "Hits of the chatbot caches", ("cache", )))
+cache_misses: Counter = registry.register(Counter(
+    "chatbot_cache_misses_total", "Misses of the chatbot caches", ("cache", )))
+event_loop_lag: Histogram = registry.register(Histogram(
+    "chatbot_event_loop_lag_seconds",
+    "Delay of the event loop in waking up a sleeping task, the time during which "
+    "some code blocked it",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)))
+
+
+class HandlerTimer:
+    """Time spent in each phase of the handling of an update, and the SQL
+    statements it executed along with their duration."""
+    def __init__(self, handler: str) -> None:
+        self.handler = handler
+        self.phases: dict[str, float] = {}
+        self.statements: list[tuple[str, float]] = []
+
+    @property
+    def queries(self) -> int:
+        return len(self.statements)
+
+    @property
+    def db_time(self) -> float:
+        return self.phases.get("db", 0.0)
+
+    def add(self, phase: str, duration: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def add_statement(self, statement: str, duration: float) -> None:
+        self.statements.append((statement, duration))
+        self.add("db", duration)
+
+
+class QueryBudgetExceeded(Exception):
+    def __init__(self, timer: HandlerTimer, budget: int) -> None:
+        super().__init__(
+            f"'{timer.handler}' executed {timer.queries} SQL statements, more than "
+            f"its budget of {budget}")
+        self.timer = timer
+        self.budget = budget
+
+
+class QueryBudgets:
+    """Maximal number of SQL statements each handler can execute per update.
+
+    The handlers exceeding their budget are logged along with the statements they
+    executed when `log_overruns` is True, as in debug mode, and raise
+    `QueryBudgetExceeded` inside the `enforcing()` block used by the tests.
+    """
+    def __init__(self, log_overruns: bool = False) -> None:
+        self.budgets: dict[str, int] = {}
+        self._strict: bool = False
+        self.configure(log_overruns)
+
+    def configure(self, log_overruns: bool = False) -> None:
+        self.log_overruns = log_overruns
+
+    def set(self, handler: str, max_queries: int) -> None:
+        self.budgets[handler] = max_queries
+
+    def get(self, handler: str) -> int | None:
+        return self.budgets.get(handler)
+
+    @contextmanager
+    def enforcing(self) -> Iterator[None]:
+        """Raise `QueryBudgetExceeded` when a handler exceeds its budget."""
+        strict, self._strict = self._strict, True
+        try:
+            yield
+        finally:
+            self._strict = strict
+
+    def check(self, timer: HandlerTimer) -> None:
+        budget = self.budgets.get(timer.handler)
+        if budget is None or timer.queries <= budget:
+            return
+        if self.log_overruns:
+            statements = "\n".join(
+                f"  {duration * 1000:.2f} ms: {' '.join(statement.split())}"
+                for statement, duration in timer.statements
+            )
+            logger.warning(
+                f"'{timer.handler}' executed {timer.queries} SQL statements in "
+                f"{timer.db_time * 1000:.2f} ms, more than its budget of {budget}:"
+                f"\n{statements}")
+        if self._strict:
+            raise QueryBudgetExceeded(timer, budget)
+
+
+query_budgets = QueryBudgets()
+
+
+_current_timer: ContextVar[HandlerTimer | None] = ContextVar(
+    "current_timer", default=None)
+
+
+@contextmanager
+def track_handler(handler: str) -> Iterator[HandlerTimer]:
+    timer = HandlerTimer(handler)
+    token = _current_timer.set(timer)
+    start = perf_counter()
+    try:
+        yield timer
+    except Exception:
+        handler_errors.inc(handler)
+        raise
+    else:
+        query_budgets.check(timer)
+    finally:
+        handler_duration.observe(perf_counter() - start, handler)
+        for phase, duration in timer.phases.items():
+            phase_duration.observe(duration, handler, phase)
+        handler_queries.observe(timer.queries, handler)
+        if timer.queries:
+            db_queries.inc(handler, value=timer.queries)
+        _current_timer.reset(token)
+
+
+@contextmanager
+def span(phase: str) -> Iterator[None]:
+    """Add the time spent in the block to the phase of the handler running."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(phase, perf_counter() - start)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_timer.get() is not None:
+        conn.info.setdefault("chatbot_query_start", []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timer = _current_timer.get()
+    if timer is None:
+        return
+    try:
+        start = conn.info["chatbot_query_start"].pop()
+    except (KeyError, IndexError):
+        return
+    timer.add_statement(statement, perf_counter() - start)
+
+
+class EventLoopLagMonitor:
+    """Measure how late the event loop wakes up a task sleeping `interval`
+    seconds. The lag is the time during which some code blocked the loop, delaying
+    every update; a warning is logged when it exceeds `warning_threshold`."""
+    def __init__(self, interval: float = 0.5, warning_threshold: float = 0.25) -> None:
+        self._task: asyncio.Task | None = None
+        self.configure(interval, warning_threshold)
+
+    def configure(self, interval: float = 0.5, warning_threshold: float = 0.25) -> None:
+        self.interval = interval
+        self.warning_threshold = warning_threshold
+
+    async def _monitor(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            event_loop_lag.observe(lag)
+            if lag > self.warning_threshold:
+                logger.warning(f"The event loop was blocked for {lag:.3f} seconds.")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._monitor())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+event_loop_monitor = EventLoopLagMonitor()
+
+
+async def _handle_metrics_request(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+) -> None:
+    try:
+        request_line = await reader.readline()
+        # Skip the headers
+        while (await reader.readline()).strip():
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+            status = "200 OK"
+            body = registry.render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.Server:
+    """Serve the metrics in Prometheus' text format on `/metrics`."""
+    server = await asyncio.start_server(_handle_metrics_request, host, port)
+    logger.info(f"Serving the chatbot metrics on {host}:{port}/metrics.")
+    return server
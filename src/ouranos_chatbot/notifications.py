@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import NamedTuple, Sequence
+
+from sqlalchemy import func, select
+from telegram import Bot
+
+import gaia_validators as gv
+from ouranos import db
+from ouranos.core.database.models.gaia import GaiaWarning
+
+from ouranos_chatbot.messages.templates import render_template
+from ouranos_chatbot.reference import reference_data
+from ouranos_chatbot.sender import sender
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+WARNING_LEVELS: list[gv.WarningLevel] = list(gv.WarningLevel)
+
+
+class WarningsSubscription(NamedTuple):
+    # Uids of the ecosystems followed, or None to follow all of them
+    ecosystems: frozenset[str] | None
+    # Lowest level of the warnings notified
+    level: gv.WarningLevel
+
+    def matches(self, warning: GaiaWarning) -> bool:
+        if self.ecosystems is not None and warning.created_by not in self.ecosystems:
+            return False
+        return WARNING_LEVELS.index(warning.level) >= WARNING_LEVELS.index(self.level)
+
+
+class WarningsNotifier:
+    """Push the new warnings to the chats subscribed to them.
+
+    The new warnings are fetched once per notification, and the message is
+    rendered once for each distinct subscription, whatever the number of chats
+    sharing it.
+    """
+    def __init__(self) -> None:
+        self.subscriptions: dict[int, WarningsSubscription] = {}
+        self._last_id: int | None = None
+        self._lock = asyncio.Lock()
+
+    def subscribe(self, chat_id: int, subscription: WarningsSubscription) -> None:
+        self.subscriptions[chat_id] = subscription
+
+    def unsubscribe(self, chat_id: int) -> bool:
+        return self.subscriptions.pop(chat_id, None) is not None
+
+    def dump(self) -> dict[str, dict]:
+        return {
+            str(chat_id): {
+                "ecosystems": (
+                    sorted(subscription.ecosystems)
+                    if subscription.ecosystems is not None
+                    else None
+                ),
+                "level": subscription.level.name,
+            }
+            for chat_id, subscription in self.subscriptions.items()
+        }
+
+    def restore(self, subscriptions: dict[str, dict]) -> None:
+        for chat_id, subscription in subscriptions.items():
+            try:
+                ecosystems = subscription["ecosystems"]
+                self.subscriptions[int(chat_id)] = WarningsSubscription(
+                    frozenset(ecosystems) if ecosystems is not None else None,
+                    gv.safe_enum_from_name(gv.WarningLevel, subscription["level"]),
+                )
+            except (KeyError, TypeError, ValueError):
+                logger.warning(
+                    f"Could not restore the warnings subscription of chat {chat_id}.")
+
+    async def _get_last_id(self, session) -> int:
+        stmt = select(func.max(GaiaWarning.id))
+        result = await session.execute(stmt)
+        return result.scalar() or 0
+
+    async def initialize(self) -> None:
+        async with db.scoped_session() as session:
+            self._last_id = await self._get_last_id(session)
+
+    async def _get_new_warnings(self, session) -> Sequence[GaiaWarning]:
+        stmt = (
+            select(GaiaWarning)
+            .where(GaiaWarning.id > self._last_id)
+            .where(GaiaWarning.solved_on.is_(None))
+            .order_by(GaiaWarning.id)
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    def _group_chats(self) -> dict[WarningsSubscription, list[int]]:
+        rv: dict[WarningsSubscription, list[int]] = {}
+        for chat_id, subscription in self.subscriptions.items():
+            rv.setdefault(subscription, []).append(chat_id)
+        return rv
+
+    async def notify(self, bot: Bot) -> None:
+        """Send the warnings created since the last notification to the
+        subscribed chats."""
+        # Notifications triggered while one is being sent are covered by the
+        # next one, as it fetches all the warnings created since
+        async with self._lock:
+            async with db.scoped_session() as session:
+                if self._last_id is None:
+                    self._last_id = await self._get_last_id(session)
+                    return
+                warnings = await self._get_new_warnings(session)
+                if not warnings:
+                    return
+                self._last_id = warnings[-1].id
+                if not self.subscriptions:
+                    return
+            await reference_data.ensure_loaded()
+            names = reference_data.names
+            # Avoid the import loop between the commands and the notifications
+            from ouranos_chatbot.commands import _summarize_warnings
+
+            sends = []
+            for subscription, chat_ids in self._group_chats().items():
+                selected = [w for w in warnings if subscription.matches(w)]
+                if not selected:
+                    continue
+                msg = await render_template(
+                    "new_warnings", warnings=_summarize_warnings(selected, names))
+                sends.extend(
+                    sender.send_message(bot, chat_id, msg, html=True)
+                    for chat_id in chat_ids
+                )
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Encountered an error while pushing the new warnings. "
+                    f"ERROR msg: `{result.__class__.__name__} :{result}`.")
+
+
+warnings_notifier = WarningsNotifier()
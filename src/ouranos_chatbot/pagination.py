@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from hashlib import blake2b
+from typing import NamedTuple, Sequence
+
+from cachetools import LRUCache
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ouranos.core.database.models.gaia import GaiaWarning
+
+from ouranos_chatbot.notifications import WARNING_LEVELS
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+WARNINGS_CALLBACK_PREFIX = "warnings"
+# Selection token of the recently seen ecosystems, resolved again on each page
+ALL_ECOSYSTEMS = "*"
+
+
+class WarningsCursor(NamedTuple):
+    """Position of a warning in the list of warnings, sorted from the most recent
+    one."""
+    created_on: datetime
+    id: int
+
+    @classmethod
+    def of(cls, warning: GaiaWarning) -> WarningsCursor:
+        return cls(warning.created_on, warning.id)
+
+    def encode(self) -> str:
+        created_on = self.created_on
+        if created_on.tzinfo is None:
+            created_on = created_on.replace(tzinfo=timezone.utc)
+        return f"{(created_on - EPOCH) // timedelta(microseconds=1)}:{self.id}"
+
+    @classmethod
+    def decode(cls, data: str) -> WarningsCursor:
+        created_on, id_ = data.split(":")
+        return cls(EPOCH + timedelta(microseconds=int(created_on)), int(id_))
+
+
+class WarningsPage(NamedTuple):
+    warnings: list[GaiaWarning]
+    # Number of unsolved warnings per level, from the most severe one
+    counts: dict[str, int]
+    # Cursors to load the more recent and the older warnings, if any
+    newer: WarningsCursor | None
+    older: WarningsCursor | None
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+async def get_warnings_page(
+        session: AsyncSession,
+        ecosystems_uid: Sequence[str],
+        cursor: WarningsCursor | None = None,
+        newer: bool = False,
+        page_size: int = 10,
+) -> WarningsPage:
+    """Get a page of the unsolved warnings of the ecosystems, along with their
+    number per level.
+
+    The page starts right after the cursor, going towards the older warnings, or
+    towards the more recent ones when `newer` is set; the first page holds the
+    most recent warnings. The pages are selected with a keyset on
+    (created_on, id) rather than an offset, so that loading a page does not
+    depend on the number of warnings before it.
+    """
+    filters = [
+        GaiaWarning.solved_on.is_(None),
+        GaiaWarning.created_by.in_(ecosystems_uid),
+    ]
+    stmt = select(GaiaWarning).where(*filters)
+    if cursor is None:
+        stmt = stmt.order_by(GaiaWarning.created_on.desc(), GaiaWarning.id.desc())
+    elif newer:
+        stmt = stmt.where(or_(
+            GaiaWarning.created_on > cursor.created_on,
+            and_(GaiaWarning.created_on == cursor.created_on, GaiaWarning.id > cursor.id),
+        )).order_by(GaiaWarning.created_on.asc(), GaiaWarning.id.asc())
+    else:
+        stmt = stmt.where(or_(
+            GaiaWarning.created_on < cursor.created_on,
+            and_(GaiaWarning.created_on == cursor.created_on, GaiaWarning.id < cursor.id),
+        )).order_by(GaiaWarning.created_on.desc(), GaiaWarning.id.desc())
+    # Fetch one more warning to know whether there is another page after this one
+    result = await session.execute(stmt.limit(page_size + 1))
+    warnings = list(result.scalars())
+    more = len(warnings) > page_size
+    warnings = warnings[:page_size]
+    if newer:
+        warnings.reverse()
+    if warnings:
+        first, last = WarningsCursor.of(warnings[0]), WarningsCursor.of(warnings[-1])
+        if newer:
+            newer_cursor, older_cursor = (first if more else None), last
+        else:
+            newer_cursor, older_cursor = (first if cursor else None), (last if more else None)
+    else:
+        # The warnings past the cursor were solved in the meantime, only offer to
+        # go back
+        newer_cursor = cursor if cursor and not newer else None
+        older_cursor = cursor if cursor and newer else None
+
+    result = await session.execute(
+        select(GaiaWarning.level, func.count())
+        .where(*filters)
+        .group_by(GaiaWarning.level)
+    )
+    counts = dict(result.all())
+    return WarningsPage(
+        warnings=warnings,
+        counts={
+            level.name: counts[level]
+            for level in reversed(WARNING_LEVELS)
+            if counts.get(level)
+        },
+        newer=newer_cursor,
+        older=older_cursor,
+    )
+
+
+class WarningsSelections:
+    """Ecosystems whose warnings are browsed, stored under a short token as the
+    callback data of the navigation buttons is limited to 64 bytes."""
+    def __init__(self, maxsize: int = 1024) -> None:
+        self._selections: LRUCache[str, tuple[str, ...]] = LRUCache(maxsize=maxsize)
+
+    def add(self, ecosystems_uid: Sequence[str]) -> str:
+        uids = tuple(sorted(ecosystems_uid))
+        token = blake2b(",".join(uids).encode(), digest_size=6).hexdigest()
+        self._selections[token] = uids
+        return token
+
+    def get(self, token: str) -> tuple[str, ...] | None:
+        return self._selections.get(token)
+
+    def clear(self) -> None:
+        self._selections.clear()
+
+
+warnings_selections = WarningsSelections()
+
+
+def encode_warnings_callback(selection: str, cursor: WarningsCursor, newer: bool) -> str:
+    direction = "newer" if newer else "older"
+    return f"{WARNINGS_CALLBACK_PREFIX}:{selection}:{direction}:{cursor.encode()}"
+
+
+def decode_warnings_callback(data: str) -> tuple[str, WarningsCursor, bool]:
+    """Return the selection token, the cursor and whether the more recent
+    warnings are requested."""
+    prefix, selection, direction, cursor = data.split(":", 3)
+    if prefix != WARNINGS_CALLBACK_PREFIX or direction not in ("newer", "older"):
+        raise ValueError(f"'{data}' is not a warnings navigation callback")
+    return selection, WarningsCursor.decode(cursor), direction == "newer"
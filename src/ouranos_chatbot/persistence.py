@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import asyncio
+from inspect import isawaitable
+import logging
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import Column, delete, insert, JSON, MetaData, select, String, Table, tuple_
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+metadata = MetaData()
+
+state_table = Table(
+    "chatbot_state",
+    metadata,
+    Column("namespace", String(32), primary_key=True),
+    Column("key", String(64), primary_key=True),
+    Column("value", JSON),
+)
+
+
+# State of a component: key: JSON serializable value
+State = dict[str, Any]
+Dump = Callable[[], State]
+Restore = Callable[[State], Awaitable[None] | None]
+
+
+class StateStore:
+    """Persist the state of the chatbot across restarts.
+
+    The components register a namespace along with a `dump` function returning
+    their current state and a `restore` function reloading it at startup. The
+    state is written by batches: every `flush_interval` seconds, the keys that
+    changed since the previous write are written in a single transaction.
+    """
+    def __init__(self, uri: str | None = None, flush_interval: float = 5.0) -> None:
+        self._sources: dict[str, tuple[Dump, Restore]] = {}
+        self._written: dict[str, State] = {}
+        self._engine: AsyncEngine | None = None
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self.configure(uri, flush_interval)
+
+    def configure(self, uri: str | None = None, flush_interval: float = 5.0) -> None:
+        self.uri = uri
+        self.flush_interval = flush_interval
+
+    def register(self, namespace: str, dump: Dump, restore: Restore) -> None:
+        self._sources[namespace] = (dump, restore)
+
+    async def _load(self) -> dict[str, State]:
+        rv: dict[str, State] = {}
+        async with self._engine.connect() as connection:
+            result = await connection.execute(select(state_table))
+            for namespace, key, value in result:
+                rv.setdefault(namespace, {})[key] = value
+        return rv
+
+    async def start(self) -> None:
+        """Create the table if needed, restore the state of the registered
+        components and start writing it periodically."""
+        if self.uri is None:
+            raise ValueError("No URI was given to store the chatbot state.")
+        self._engine = create_async_engine(self.uri)
+        async with self._engine.begin() as connection:
+            await connection.run_sync(metadata.create_all)
+        stored = await self._load()
+        for namespace, (_, restore) in self._sources.items():
+            state = stored.get(namespace, {})
+            try:
+                result = restore(state)
+                if isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(
+                    f"Could not restore the chatbot state '{namespace}'. ERROR msg: "
+                    f"`{e.__class__.__name__} :{e}`.")
+            self._written[namespace] = state
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(
+                    f"Could not save the chatbot state. ERROR msg: "
+                    f"`{e.__class__.__name__} :{e}`.")
+
+    async def flush(self) -> None:
+        """Write the keys changed since the previous write."""
+        if self._engine is None:
+            return
+        async with self._lock:
+            snapshot: dict[str, State] = {}
+            changed: list[dict[str, Any]] = []
+            deleted: list[tuple[str, str]] = []
+            for namespace, (dump, _) in self._sources.items():
+                state = snapshot[namespace] = dump()
+                written = self._written.get(namespace, {})
+                changed.extend(
+                    {"namespace": namespace, "key": key, "value": value}
+                    for key, value in state.items()
+                    if key not in written or written[key] != value
+                )
+                deleted.extend((namespace, key) for key in written.keys() - state.keys())
+            if not changed and not deleted:
+                return
+            # Replace the changed rows rather than relying on a dialect-specific
+            # upsert
+            outdated = deleted + [(row["namespace"], row["key"]) for row in changed]
+            async with self._engine.begin() as connection:
+                await connection.execute(
+                    delete(state_table)
+                    .where(tuple_(state_table.c.namespace, state_table.c.key).in_(outdated))
+                )
+                if changed:
+                    await connection.execute(insert(state_table), changed)
+            self._written = snapshot
+
+    async def stop(self) -> None:
+        """Write the state a last time and close the connection."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._engine is None:
+            return
+        try:
+            await self.flush()
+        finally:
+            await self._engine.dispose()
+            self._engine = None
+
+
+state_store = StateStore()
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+from fnmatch import fnmatchcase
+from time import monotonic
+from typing import NamedTuple
+
+from sqlalchemy import select
+
+from ouranos.core.database.models.gaia import Ecosystem, Measure
+
+from ouranos_chatbot.request import scoped_session
+
+
+class EcosystemRef(NamedTuple):
+    """Lightweight stand-in for an `Ecosystem` when only its uid and name are
+    needed."""
+    uid: str
+    name: str
+
+
+class ReferenceData:
+    """In-process cache of the data that almost never changes: the ecosystems'
+    names and uids, and the measures' units.
+
+    The data is loaded at once, reloaded when older than `ttl` seconds or when
+    an unknown ecosystem name is looked up, and updated from the dispatcher
+    events in between.
+    """
+    # Minimal number of seconds between two reloads caused by unknown names
+    min_reload_interval: float = 5
+
+    def __init__(self, ttl: float = 300) -> None:
+        self.ttl = ttl
+        self.names: dict[str, str] = {}  # uid: name
+        self.uids: dict[str, str] = {}  # name: uid
+        self.recent: list[str] = []  # uids of the recently seen ecosystems
+        self.units: dict[str, str | None] = {}  # measure: unit
+        self._loaded_at: float | None = None
+        self._lock = asyncio.Lock()
+
+    def configure(self, ttl: float = 300) -> None:
+        self.ttl = ttl
+
+    @property
+    def stale(self) -> bool:
+        return self._loaded_at is None or monotonic() - self._loaded_at > self.ttl
+
+    def clear(self) -> None:
+        self.names.clear()
+        self.uids.clear()
+        self.recent.clear()
+        self.units.clear()
+        self._loaded_at = None
+
+    async def _load(self) -> None:
+        async with scoped_session() as session:
+            result = await session.execute(select(Ecosystem.uid, Ecosystem.name))
+            ecosystems = result.all()
+            recent = await Ecosystem.get_multiple_by_id(
+                session, ecosystems_id=["recent"])
+            measures = await Measure.get_multiple(session)
+        self.names = {uid: name for uid, name in ecosystems}
+        self.uids = {name: uid for uid, name in ecosystems}
+        self.recent = [ecosystem.uid for ecosystem in recent]
+        self.units = {measure.name: measure.unit for measure in measures}
+        self._loaded_at = monotonic()
+
+    async def load(self) -> None:
+        async with self._lock:
+            await self._load()
+
+    async def _reload_if_older(self, max_age: float) -> None:
+        """Reload the data if it was loaded more than `max_age` seconds ago. The
+        age is checked again once the lock is held, so that the requests waiting
+        for a reload do not each reload the data in turn."""
+        async with self._lock:
+            if self._loaded_at is None or monotonic() - self._loaded_at > max_age:
+                await self._load()
+
+    async def ensure_loaded(self) -> None:
+        if self.stale:
+            await self._reload_if_older(self.ttl)
+
+    def update_ecosystem(self, uid: str, name: str) -> None:
+        previous_name = self.names.get(uid)
+        if previous_name is not None:
+            self.uids.pop(previous_name, None)
+        self.names[uid] = name
+        self.uids[name] = uid
+        # The ecosystem sending its info was just seen
+        if uid not in self.recent:
+            self.recent.append(uid)
+
+    async def get_units(self) -> dict[str, str | None]:
+        await self.ensure_loaded()
+        return self.units
+
+    async def get_name(self, uid: str) -> str:
+        await self.ensure_loaded()
+        return self.names.get(uid, uid)
+
+    async def get_ecosystems(self, names: list[str] | None = None) -> list[EcosystemRef]:
+        """Get the ecosystems named, or the recently seen ones when no name is
+        given. Unknown names are skipped."""
+        await self.ensure_loaded()
+        if not names:
+            return [EcosystemRef(uid, self.names[uid]) for uid in self.recent]
+        if (
+                any(name not in self.uids for name in names)
+                and monotonic() - self._loaded_at > self.min_reload_interval
+        ):
+            # The ecosystem might have been registered since the last load
+            await self._reload_if_older(self.min_reload_interval)
+        return [
+            EcosystemRef(self.uids[name], name)
+            for name in names
+            if name in self.uids
+        ]
+
+    async def match_ecosystems(self, patterns: list[str]) -> list[EcosystemRef]:
+        """Get the ecosystems whose name matches any of the shell-style patterns
+        given, such as 'greenhouse_*' or '*'."""
+        await self.ensure_loaded()
+
+        def match() -> tuple[list[EcosystemRef], bool]:
+            matched = [
+                EcosystemRef(uid, name)
+                for name, uid in self.uids.items()
+                if any(fnmatchcase(name, pattern) for pattern in patterns)
+            ]
+            unmatched = any(
+                not any(fnmatchcase(ecosystem.name, pattern) for ecosystem in matched)
+                for pattern in patterns
+            )
+            return matched, unmatched
+
+        ecosystems, unmatched = match()
+        if unmatched and monotonic() - self._loaded_at > self.min_reload_interval:
+            # The ecosystem might have been registered since the last load
+            await self._reload_if_older(self.min_reload_interval)
+            ecosystems, _ = match()
+        return ecosystems
+
+
+reference_data = ReferenceData()
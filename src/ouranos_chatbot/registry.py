@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+from inspect import getdoc
+from itertools import combinations
+import logging
+from typing import Callable, NamedTuple
+
+from cachetools import LRUCache
+from telegram import Bot, BotCommand, BotCommandScopeChat, BotCommandScopeDefault
+from telegram.ext import (
+    BaseHandler, CallbackQueryHandler, CommandHandler, MessageHandler)
+from telegram.ext.filters import BaseFilter
+
+from ouranos.core.database.models.app import Permission, User
+
+from ouranos_chatbot.decorators import (
+    activation_required, make_callback_query_handler, make_handler,
+    permission_required)
+from ouranos_chatbot.metrics import query_budgets
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+# The permissions of a user among the ones required by the commands, or None for
+# the users who did not link their account
+Tier = frozenset[Permission] | None
+
+
+class Command(NamedTuple):
+    name: str
+    handler: CommandHandler
+    description: str
+    activation: bool
+    permission: Permission | None
+    listed: bool
+
+    def available_to(self, tier: Tier) -> bool:
+        """Whether the command is listed for the users of the tier. The commands
+        not requiring an activation are only listed for the users who did not
+        link their account yet."""
+        if not self.listed:
+            return False
+        if tier is None:
+            return not self.activation
+        return (
+            self.activation
+            and (self.permission is None or self.permission in tier)
+        )
+
+    @property
+    def menu_description(self) -> str:
+        # Telegram limits the descriptions of the menu to 256 characters
+        return self.description.split(". ")[0].rstrip(".")[:256]
+
+
+class CommandRegistry:
+    """Declare the commands along with their access requirements.
+
+    The registry builds the handlers of the commands, and precomputes the help
+    message and the commands menu of each tier of users. The tier whose menu was
+    set is remembered for the `max_chat_menus` most recent chats.
+    """
+    def __init__(self, max_chat_menus: int = 4096) -> None:
+        self.commands: dict[str, Command] = {}
+        self.callback_queries: list[CallbackQueryHandler] = []
+        self.fallbacks: list[BaseHandler] = []
+        self._help: dict[Tier, str] = {}
+        self._menus: dict[Tier, list[BotCommand]] = {}
+        self._chat_tiers: LRUCache[int, Tier] = LRUCache(maxsize=max_chat_menus)
+
+    def command(
+            self,
+            name: str,
+            *,
+            activation: bool = False,
+            permission: Permission | None = None,
+            listed: bool = True,
+            max_queries: int | None = None,
+    ) -> Callable:
+        """Register the decorated function as the callback of the command
+        `name`. The first sentence of its docstring describes it in the menus.
+        `max_queries` is the number of SQL statements the command can execute,
+        see `QueryBudgets`."""
+        def decorator(func) -> CommandHandler:
+            callback = func
+            if permission is not None:
+                callback = permission_required(permission)(callback)
+            if activation:
+                callback = activation_required(callback)
+            handler = make_handler(CommandHandler, name)(callback)
+            if max_queries is not None:
+                query_budgets.set(func.__name__, max_queries)
+            self.commands[name] = Command(
+                name=name,
+                handler=handler,
+                description=" ".join((getdoc(func) or "").split()),
+                activation=activation,
+                permission=permission,
+                listed=listed,
+            )
+            self._help.clear()
+            self._menus.clear()
+            return handler
+        return decorator
+
+    def callback_query(self, pattern: str, max_queries: int | None = None) -> Callable:
+        """Register the decorated function as the callback of the inline buttons
+        whose data matches the pattern. The function checks the access
+        requirements itself, as it answers a button rather than a message."""
+        def decorator(func) -> CallbackQueryHandler:
+            handler = make_callback_query_handler(pattern)(func)
+            if max_queries is not None:
+                query_budgets.set(func.__name__, max_queries)
+            self.callback_queries.append(handler)
+            return handler
+        return decorator
+
+    def fallback(self, filter_: BaseFilter, max_queries: int | None = None) -> Callable:
+        """Register the decorated function as the callback of the messages not
+        handled by any command."""
+        def decorator(func) -> MessageHandler:
+            handler = make_handler(MessageHandler, filter_)(func)
+            if max_queries is not None:
+                query_budgets.set(func.__name__, max_queries)
+            self.fallbacks.append(handler)
+            return handler
+        return decorator
+
+    @property
+    def handlers(self) -> list[BaseHandler]:
+        return [
+            *(command.handler for command in self.commands.values()),
+            *self.callback_queries,
+            *self.fallbacks,
+        ]
+
+    @property
+    def tiers(self) -> list[Tier]:
+        permissions = list(dict.fromkeys(
+            command.permission for command in self.commands.values()
+            if command.permission is not None
+        ))
+        return [None] + [
+            frozenset(subset)
+            for size in range(len(permissions) + 1)
+            for subset in combinations(permissions, size)
+        ]
+
+    def compile(self) -> None:
+        """Precompute the help message and the menu of each tier."""
+        for tier in self.tiers:
+            commands = [
+                command for command in self.commands.values()
+                if command.available_to(tier)
+            ]
+            self._help[tier] = "Here is a list of the commands available:\n" + "".join(
+                f"/{command.name} : {command.description}\n" for command in commands)
+            self._menus[tier] = [
+                BotCommand(command.name, command.menu_description)
+                for command in commands
+            ]
+
+    def get_tier(self, user: User) -> Tier:
+        if user.is_anonymous:
+            return None
+        return frozenset(
+            command.permission for command in self.commands.values()
+            if command.permission is not None and user.can(command.permission)
+        )
+
+    def get_help(self, user: User) -> str:
+        if not self._help:
+            self.compile()
+        return self._help[self.get_tier(user)]
+
+    def get_menu(self, tier: Tier) -> list[BotCommand]:
+        if not self._menus:
+            self.compile()
+        return self._menus[tier]
+
+    async def set_default_menu(self, bot: Bot) -> None:
+        """Show the commands of the users who did not link their account in the
+        chats without a menu of their own."""
+        await bot.set_my_commands(self.get_menu(None), scope=BotCommandScopeDefault())
+        self._chat_tiers.clear()
+
+    async def update_chat_menu(self, bot: Bot, chat_id: int, user: User) -> None:
+        """Show the commands available to the user in the chat, if not already
+        done since the startup."""
+        tier = self.get_tier(user)
+        if chat_id in self._chat_tiers and self._chat_tiers[chat_id] == tier:
+            return
+        try:
+            await bot.set_my_commands(
+                self.get_menu(tier), scope=BotCommandScopeChat(chat_id))
+        except Exception as e:
+            # The menu is a convenience, failing to update it is not an error
+            logger.warning(
+                f"Could not update the commands menu of chat {chat_id}. ERROR "
+                f"msg: `{e.__class__.__name__} :{e}`.")
+        else:
+            self._chat_tiers[chat_id] = tier
+
+
+command_registry = CommandRegistry()
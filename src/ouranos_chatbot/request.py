@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from contextlib import asynccontextmanager, AsyncExitStack
+from contextvars import ContextVar
+from typing import AsyncGenerator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ouranos import db
+from ouranos.core.database.models.app import UserMixin
+
+from ouranos_chatbot.auth import fetch_user, get_current_user, user_cache
+
+
+class Request:
+    """State shared by the decorators and the callback handling an update.
+
+    The database session is only opened when first needed and is then reused
+    until the outermost block using it ends, so that no connection is held while
+    replying or waiting for Gaia, and the user is only resolved once.
+    """
+    def __init__(self, telegram_id: int) -> None:
+        self.telegram_id: int = telegram_id
+        self._exit_stack: AsyncExitStack | None = None
+        self._session: AsyncSession | None = None
+        self._user: UserMixin | None = None
+        # Number of `session()` blocks currently using the session
+        self._depth: int = 0
+
+    async def get_session(self) -> AsyncSession:
+        if self._session is None:
+            self._exit_stack = AsyncExitStack()
+            self._session = await self._exit_stack.enter_async_context(
+                db.scoped_session())
+        return self._session
+
+    @asynccontextmanager
+    async def session(self) -> AsyncGenerator[AsyncSession, None]:
+        """Yield the session of the update, and close it once the outermost
+        block using it ends."""
+        session = await self.get_session()
+        self._depth += 1
+        try:
+            yield session
+        except BaseException as e:
+            self._depth -= 1
+            if self._depth == 0:
+                await self.close(e)
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            await self.close()
+
+    async def get_user(self) -> UserMixin:
+        if self._user is None:
+            try:
+                self._user = user_cache[self.telegram_id]
+            except KeyError:
+                session = await self.get_session()
+                self._user = await fetch_user(session, self.telegram_id)
+        return self._user
+
+    async def close(self, exc: BaseException | None = None) -> None:
+        if self._exit_stack is not None:
+            exit_stack = self._exit_stack
+            self._exit_stack = None
+            self._session = None
+            if exc is None:
+                await exit_stack.aclose()
+            else:
+                await exit_stack.__aexit__(type(exc), exc, exc.__traceback__)
+
+
+_current_request: ContextVar[Request | None] = ContextVar("current_request", default=None)
+
+
+def get_request() -> Request | None:
+    return _current_request.get()
+
+
+@asynccontextmanager
+async def request_scope(telegram_id: int) -> AsyncGenerator[Request, None]:
+    request = Request(telegram_id)
+    token = _current_request.set(request)
+    try:
+        yield request
+    except BaseException as e:
+        await request.close(e)
+        raise
+    else:
+        await request.close()
+    finally:
+        _current_request.reset(token)
+
+
+@asynccontextmanager
+async def scoped_session() -> AsyncGenerator[AsyncSession, None]:
+    """Yield the session of the update being handled, or a new session when
+    used outside the handling of an update."""
+    request = get_request()
+    if request is None:
+        async with db.scoped_session() as session:
+            yield session
+    else:
+        async with request.session() as session:
+            yield session
+
+
+async def close_session() -> None:
+    """Close the session of the update being handled, if any, once it no longer
+    needs the database."""
+    request = get_request()
+    if request is not None and request._depth == 0:
+        await request.close()
+
+
+async def current_user(telegram_id: int) -> UserMixin:
+    """Get the user linked to the Telegram id, using the state of the update
+    being handled when possible."""
+    request = get_request()
+    if request is not None and request.telegram_id == telegram_id:
+        return await request.get_user()
+    async with db.scoped_session() as session:
+        return await get_current_user(session, telegram_id)
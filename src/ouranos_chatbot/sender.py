@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from datetime import timedelta
+import logging
+import re
+from time import monotonic
+from typing import Any, Awaitable, Callable, Hashable
+
+from telegram import Bot, InlineKeyboardMarkup, Message, Update
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import NetworkError, RetryAfter
+
+from ouranos_chatbot.metrics import Gauge, Histogram, registry, span
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+SECTION_SEPARATOR = "\n-----------\n"
+
+
+def _split_on(text: str, separator: str, max_length: int) -> list[str]:
+    """Greedily pack the parts of `text` separated by `separator` into chunks
+    of at most `max_length` characters. Parts too long are returned as is."""
+    chunks: list[str] = []
+    current = ""
+    for part in text.split(separator):
+        candidate = f"{current}{separator}{part}" if current else part
+        if len(candidate) <= max_length:
+            current = candidate
+        else:
+            if current:
+                chunks.append(current)
+            current = part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# A tag, an entity or a single character: the places where an HTML message can
+# be cut
+_HTML_TOKEN = re.compile(r"<[^<>]*>|&[#\w]+;|.", re.DOTALL)
+_HTML_TAG = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^<>]*>")
+
+
+def _cut(line: str, max_length: int, html: bool) -> list[str]:
+    """Cut a line too long into chunks of at most `max_length` characters,
+    outside the tags and entities if `line` is HTML."""
+    if not html:
+        return [line[i:i + max_length] for i in range(0, len(line), max_length)]
+    chunks: list[str] = []
+    current = ""
+    for token in _HTML_TOKEN.findall(line):
+        if current and len(current) + len(token) > max_length:
+            chunks.append(current)
+            current = ""
+        current += token
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _balance_tags(chunks: list[str]) -> list[str]:
+    """Close the tags still open at the end of each chunk and open them again at
+    the start of the next one, so that each chunk can be parsed on its own. The
+    tags do not count towards Telegram's length limit, only the text does."""
+    rv: list[str] = []
+    # (name, opening tag) of the tags open at the end of the previous chunk
+    open_tags: list[tuple[str, str]] = []
+    for chunk in chunks:
+        prefix = "".join(tag for _, tag in open_tags)
+        for match in _HTML_TAG.finditer(chunk):
+            closing, name = match.group(1), match.group(2).lower()
+            if not closing:
+                open_tags.append((name, match.group(0)))
+                continue
+            for i in range(len(open_tags) - 1, -1, -1):
+                if open_tags[i][0] == name:
+                    del open_tags[i]
+                    break
+        suffix = "".join(f"</{name}>" for name, _ in reversed(open_tags))
+        rv.append(f"{prefix}{chunk}{suffix}")
+    return rv
+
+
+def split_message(
+        text: str,
+        max_length: int = MessageLimit.MAX_TEXT_LENGTH,
+        html: bool = False,
+) -> list[str]:
+    """Split a message into chunks short enough to be sent by Telegram.
+
+    The message is split at the sections boundaries first, then at the lines
+    boundaries, and only cut in the middle of a line as a last resort. An HTML
+    message is never cut inside a tag or an entity, and the tags open at a cut
+    are closed and opened again in the next chunk.
+    """
+    if len(text) <= max_length:
+        return [text]
+    rv: list[str] = []
+    for section in _split_on(text, SECTION_SEPARATOR, max_length):
+        if len(section) <= max_length:
+            rv.append(section)
+            continue
+        for lines in _split_on(section, "\n", max_length):
+            rv.extend(_cut(lines, max_length, html))
+    rv = [chunk.strip() for chunk in rv if chunk.strip()]
+    if html:
+        rv = _balance_tags(rv)
+    return rv
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second on average, with bursts of up to
+    `capacity` acquisitions. Waiting acquisitions are served in order."""
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens: float = capacity
+        self._updated: float = monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return not self._lock.locked() and self._tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class MessageSender:
+    """Send the messages to Telegram while respecting its rate limits.
+
+    The messages wait for both a global and a per-chat token bucket before
+    being sent. When Telegram still asks to slow down, every send is paused for
+    the requested time and the message is sent again, and network errors are
+    retried with an exponential backoff.
+    """
+    chat_burst: int = 3
+    max_chat_buckets: int = 1024
+
+    def __init__(
+            self,
+            global_rate: float = 30,
+            chat_rate: float = 1,
+            max_retries: int = 3,
+    ) -> None:
+        self.max_retries = max_retries
+        self._chat_buckets: dict[Hashable, TokenBucket] = {}
+        self._paused_until: float = 0.0
+        self.pending: int = 0
+        self.sent: int = 0
+        self.failed: int = 0
+        self.latencies: deque[float] = deque(maxlen=1000)
+        self.configure(global_rate, chat_rate, max_retries)
+
+    def configure(
+            self,
+            global_rate: float = 30,
+            chat_rate: float = 1,
+            max_retries: int = 3,
+    ) -> None:
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._chat_buckets.clear()
+
+    def _get_chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        try:
+            return self._chat_buckets[chat_id]
+        except KeyError:
+            if len(self._chat_buckets) >= self.max_chat_buckets:
+                # Idle buckets are full, forgetting them changes nothing
+                for key in [
+                    key for key, bucket in self._chat_buckets.items()
+                    if bucket.idle
+                ]:
+                    del self._chat_buckets[key]
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                self.chat_rate, self.chat_burst)
+            return bucket
+
+    async def _wait_pause(self) -> None:
+        delay = self._paused_until - monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send(
+            self,
+            chat_id: Hashable,
+            func: Callable[..., Awaitable[Any]],
+            *args,
+            **kwargs,
+    ) -> Any:
+        """Call `func`, a Telegram API method sending something to the chat,
+        once the rate limits allow it."""
+        queued_at = monotonic()
+        self.pending += 1
+        try:
+            with span("send"):
+                return await self._send(queued_at, chat_id, func, *args, **kwargs)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+
+    async def _send(
+            self,
+            queued_at: float,
+            chat_id: Hashable,
+            func: Callable[..., Awaitable[Any]],
+            *args,
+            **kwargs,
+    ) -> Any:
+        await self._get_chat_bucket(chat_id).acquire()
+        for attempt in range(self.max_retries + 1):
+            await self._wait_pause()
+            await self._global_bucket.acquire()
+            try:
+                rv = await func(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(
+                    f"Telegram flood control exceeded, pausing the sends for "
+                    f"{retry_after} seconds.")
+                self._paused_until = max(
+                    self._paused_until, monotonic() + retry_after)
+            except NetworkError:
+                # Also catches `TimedOut`
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+            else:
+                latency = monotonic() - queued_at
+                self.sent += 1
+                self.latencies.append(latency)
+                send_latency.observe(latency)
+                return rv
+
+    async def reply(
+            self,
+            message: Message,
+            text: str,
+            html: bool = False,
+            reply_markup: InlineKeyboardMarkup | None = None,
+    ) -> list[Message]:
+        """Reply to the message, splitting the reply if it is too long. The
+        markup, if any, is attached to the last part."""
+        func = message.reply_html if html else message.reply_text
+        *chunks, last = split_message(text, html=html)
+        rv = [await self.send(message.chat_id, func, chunk) for chunk in chunks]
+        if reply_markup is None:
+            rv.append(await self.send(message.chat_id, func, last))
+        else:
+            rv.append(await self.send(message.chat_id, func, last, reply_markup=reply_markup))
+        return rv
+
+    async def reply_photo(
+            self,
+            message: Message,
+            photo: bytes,
+            caption: str | None = None,
+            html: bool = False,
+    ) -> Message:
+        """Reply to the message with an image. The caption must be short enough
+        to fit in a single caption."""
+        parse_mode = ParseMode.HTML if html else None
+        return await self.send(
+            message.chat_id, message.reply_photo, photo, caption=caption,
+            parse_mode=parse_mode)
+
+    async def edit(
+            self,
+            message: Message,
+            text: str,
+            html: bool = False,
+            reply_markup: InlineKeyboardMarkup | None = None,
+    ) -> Any:
+        """Edit the text of a message sent by the bot. The text must be short
+        enough to fit in a single message."""
+        parse_mode = ParseMode.HTML if html else None
+        return await self.send(
+            message.chat_id, message.edit_text, text, parse_mode=parse_mode,
+            reply_markup=reply_markup)
+
+    async def edit_message(
+            self,
+            bot: Bot,
+            chat_id: int,
+            message_id: int,
+            text: str,
+            html: bool = False,
+    ) -> Any:
+        """Edit the text of a message sent by the bot, known by its id. The text
+        must be short enough to fit in a single message."""
+        parse_mode = ParseMode.HTML if html else None
+        return await self.send(
+            chat_id, bot.edit_message_text, text, chat_id, message_id,
+            parse_mode=parse_mode)
+
+    async def send_message(
+            self,
+            bot: Bot,
+            chat_id: int,
+            text: str,
+            html: bool = False,
+    ) -> list[Message]:
+        """Send a message to the chat, splitting it if it is too long."""
+        parse_mode = ParseMode.HTML if html else None
+        return [
+            await self.send(
+                chat_id, bot.send_message, chat_id=chat_id, text=chunk,
+                parse_mode=parse_mode)
+            for chunk in split_message(text, html=html)
+        ]
+
+    def stats(self) -> dict[str, float]:
+        latencies = sorted(self.latencies)
+        return {
+            "pending": self.pending,
+            "sent": self.sent,
+            "failed": self.failed,
+            "latency_median": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+
+sender = MessageSender()
+
+send_latency: Histogram = registry.register(Histogram(
+    "chatbot_send_latency_seconds",
+    "Time between the queuing of a message and its sending"))
+registry.register(Gauge(
+    "chatbot_send_queue_depth", "Number of messages waiting to be sent",
+    lambda: sender.pending))
+
+
+async def reply_html(
+        update: Update,
+        text: str,
+        reply_markup: InlineKeyboardMarkup | None = None,
+) -> list[Message]:
+    return await sender.reply(update.message, text, html=True, reply_markup=reply_markup)
+
+
+async def reply_text(update: Update, text: str) -> list[Message]:
+    return await sender.reply(update.message, text)
+
+
+async def reply_photo(update: Update, photo: bytes, caption: str | None = None) -> Message:
+    return await sender.reply_photo(update.message, photo, caption)
+
+
+async def edit_html(
+        message: Message,
+        text: str,
+        reply_markup: InlineKeyboardMarkup | None = None,
+) -> Any:
+    return await sender.edit(message, text, html=True, reply_markup=reply_markup)
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, BaseUpdateProcessor, CallbackContext
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process the updates concurrently while keeping the updates of a chat in
+    order.
+
+    The updates of a chat are processed one after the other, in the order they
+    were received, while up to `max_concurrent_updates` updates from different
+    chats are processed concurrently. Updates waiting for a previous update of
+    their chat do not count towards that limit, so that a busy chat cannot
+    starve the others.
+    """
+    def __init__(self, max_concurrent_updates: int) -> None:
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # The limit is enforced once the chat lock is acquired, the semaphore of
+        # the base class should never be the one limiting the updates
+        super().__init__(sys.maxsize)
+        self.limit = max_concurrent_updates
+        self._limiter = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # Chat id: [lock, number of updates holding or waiting for the lock]
+        self._chat_locks: dict[int, list[asyncio.Lock | int]] = {}
+
+    @staticmethod
+    def _get_chat_id(update: object) -> int | None:
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(
+            self,
+            update: object,
+            coroutine: Awaitable[Any],
+    ) -> None:
+        chat_id = self._get_chat_id(update)
+        if chat_id is None:
+            async with self._limiter:
+                await coroutine
+            return
+        try:
+            chat_lock = self._chat_locks[chat_id]
+        except KeyError:
+            chat_lock = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        chat_lock[1] += 1
+        try:
+            async with chat_lock[0]:
+                async with self._limiter:
+                    await coroutine
+        finally:
+            chat_lock[1] -= 1
+            if chat_lock[1] == 0:
+                del self._chat_locks[chat_id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class UpdateTracker:
+    """Track the id of the last update handled.
+
+    The id is persisted so that the updates Telegram sends again after a
+    restart, because their reception was not acknowledged before the chatbot
+    stopped, are not handled twice. Only the updates sent again right after the
+    restart are skipped: Telegram restarts the update ids from a random value
+    after a week without updates, and the updates then received with an id
+    lower than the stored one must still be handled.
+    """
+    # Telegram sends at most 100 updates per request, so at most 100 updates
+    # might be received but not acknowledged when the chatbot stops
+    max_redelivered: int = 100
+
+    def __init__(self) -> None:
+        self.last_update_id: int | None = None
+        # Id of the last update handled before the restart
+        self._restored_id: int | None = None
+
+    def seen(self, update_id: int) -> bool:
+        """Whether the update was handled before the restart. Otherwise, record
+        it as handled."""
+        # Within a run, Telegram sends each update once, but the updates of
+        # different chats might be handled out of order
+        if self._restored_id is not None:
+            distance = update_id - self._restored_id
+            if -self.max_redelivered < distance <= 0:
+                return True
+            if not 0 < distance <= self.max_redelivered:
+                # Either all the updates sent again were received, or the ids
+                # were reset: the ids lower than the stored one are new updates
+                self._restored_id = None
+                if update_id < self.last_update_id:
+                    self.last_update_id = update_id
+        if self.last_update_id is None or update_id > self.last_update_id:
+            self.last_update_id = update_id
+        return False
+
+    def dump(self) -> dict[str, int]:
+        if self.last_update_id is None:
+            return {}
+        return {"last_update_id": self.last_update_id}
+
+    def restore(self, state: dict[str, int]) -> None:
+        self._restored_id = self.last_update_id = state.get("last_update_id")
+
+
+update_tracker = UpdateTracker()
+
+
+async def skip_handled_updates(update: object, context: CallbackContext) -> None:
+    """Stop the handling of the updates already handled before a restart. To
+    register in a group preceding the commands' one."""
+    if isinstance(update, Update) and update_tracker.seen(update.update_id):
+        raise ApplicationHandlerStop
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+from hashlib import blake2b
+import logging
+from time import time
+from typing import Iterable, NamedTuple
+
+from telegram import Bot
+from telegram.error import BadRequest, TelegramError
+
+from ouranos_chatbot.sender import sender
+
+
+logger = logging.getLogger("ouranos.chatbot")
+
+
+def content_hash(text: str) -> str:
+    return blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%H:%M:%S")
+
+
+def watch_message(content: str) -> str:
+    return f"{content}\n\n<i>Updated at {_now()} UTC</i>"
+
+
+class WatchSession(NamedTuple):
+    ecosystem_uid: str
+    message_id: int
+    # Timestamp after which the message is no longer updated
+    expires_at: float
+    # Hash of the content shown by the message
+    content_hash: str
+
+
+class Watcher:
+    """Keep one message per chat showing the live status of an ecosystem.
+
+    The watched ecosystems are refreshed every `interval` seconds, or as soon as
+    an event concerning them is received, but at most once every
+    `min_interval` seconds. Each ecosystem is fetched and rendered once per
+    refresh whatever the number of chats watching it, and a message is only
+    edited when the hash of its content changed. The sessions end after
+    `duration` seconds.
+    """
+    def __init__(
+            self,
+            interval: float = 60.0,
+            duration: float = 3600.0,
+            min_interval: float = 5.0,
+    ) -> None:
+        self.sessions: dict[int, WatchSession] = {}
+        # Last content rendered for each watched ecosystem
+        self._contents: dict[str, str] = {}
+        self._bot: Bot | None = None
+        self._dirty: set[str] = set()
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.configure(interval, duration, min_interval)
+
+    def configure(
+            self,
+            interval: float = 60.0,
+            duration: float = 3600.0,
+            min_interval: float = 5.0,
+    ) -> None:
+        self.interval = interval
+        self.duration = duration
+        self.min_interval = min_interval
+
+    def watch(self, chat_id: int, ecosystem_uid: str, message_id: int, content: str) -> float:
+        """Start updating the message of the chat, replacing the previous session
+        of the chat if any. Return the time at which the session ends."""
+        expires_at = time() + self.duration
+        self.sessions[chat_id] = WatchSession(
+            ecosystem_uid, message_id, expires_at, content_hash(content))
+        self._contents[ecosystem_uid] = content
+        return expires_at
+
+    def unwatch(self, chat_id: int) -> WatchSession | None:
+        return self.sessions.pop(chat_id, None)
+
+    def _watched(self) -> set[str]:
+        return {session.ecosystem_uid for session in self.sessions.values()}
+
+    def notify(self, ecosystems_uid: Iterable[str]) -> None:
+        """Refresh the ecosystems given, if watched, as soon as possible."""
+        dirty = self._watched().intersection(ecosystems_uid)
+        if dirty:
+            self._dirty.update(dirty)
+            self._wake.set()
+
+    def dump(self) -> dict[str, dict]:
+        return {
+            str(chat_id): session._asdict()
+            for chat_id, session in self.sessions.items()
+        }
+
+    def restore(self, sessions: dict[str, dict]) -> None:
+        for chat_id, session in sessions.items():
+            try:
+                self.sessions[int(chat_id)] = WatchSession(**session)
+            except (TypeError, ValueError):
+                logger.warning(f"Could not restore the watch session of chat {chat_id}.")
+
+    async def _edit(self, chat_id: int, message_id: int, text: str) -> bool:
+        """Edit the message, returning False if it can no longer be edited."""
+        try:
+            await sender.edit_message(self._bot, chat_id, message_id, text, html=True)
+        except BadRequest as e:
+            if "not modified" in str(e):
+                return True
+            # The message was deleted or is too old to be edited
+            logger.debug(
+                f"Could not update the watch message of chat {chat_id}. ERROR msg: "
+                f"`{e.__class__.__name__} :{e}`.")
+            return False
+        return True
+
+    async def end(self, chat_id: int, session: WatchSession) -> None:
+        """Mark the message as no longer updated, and unpin it."""
+        content = self._contents.get(session.ecosystem_uid)
+        footer = f"<i>This watch ended at {_now()} UTC, use /watch to start a new one.</i>"
+        await self._edit(
+            chat_id, session.message_id, f"{content}\n\n{footer}" if content else footer)
+        try:
+            await self._bot.unpin_chat_message(chat_id, session.message_id)
+        except TelegramError:
+            # The bot might not be allowed to pin messages in this chat
+            pass
+
+    async def _expire(self) -> None:
+        now = time()
+        expired = {
+            chat_id: session for chat_id, session in self.sessions.items()
+            if session.expires_at <= now
+        }
+        for chat_id in expired:
+            del self.sessions[chat_id]
+        await asyncio.gather(
+            *(self.end(chat_id, session) for chat_id, session in expired.items()),
+            return_exceptions=True,
+        )
+        watched = self._watched()
+        for ecosystem_uid in self._contents.keys() - watched:
+            del self._contents[ecosystem_uid]
+
+    async def refresh(self, ecosystems_uid: Iterable[str] | None = None) -> None:
+        """Render the ecosystems given, or all the watched ones, and update the
+        messages whose content changed."""
+        # Avoid the import loop between the commands and the watcher
+        from ouranos_chatbot.commands import _render_watch
+
+        async with self._lock:
+            await self._expire()
+            watched = self._watched()
+            if ecosystems_uid is not None:
+                watched.intersection_update(ecosystems_uid)
+            if not watched:
+                return
+            contents = await _render_watch(sorted(watched))
+            self._contents.update(contents)
+            hashes = {uid: content_hash(content) for uid, content in contents.items()}
+            updated = {
+                chat_id: session for chat_id, session in self.sessions.items()
+                if session.ecosystem_uid in hashes
+                and session.content_hash != hashes[session.ecosystem_uid]
+            }
+            for chat_id, session in updated.items():
+                self.sessions[chat_id] = session._replace(
+                    content_hash=hashes[session.ecosystem_uid])
+        results = await asyncio.gather(
+            *(
+                self._edit(
+                    chat_id, session.message_id,
+                    watch_message(contents[session.ecosystem_uid]))
+                for chat_id, session in updated.items()
+            ),
+            return_exceptions=True,
+        )
+        for (chat_id, session), result in zip(updated.items(), results):
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Could not update the watch message of chat {chat_id}. ERROR "
+                    f"msg: `{result.__class__.__name__} :{result}`.")
+            elif result is False:
+                # The message can no longer be edited. Keep the session if the chat
+                # started a new watch in the meantime
+                current = self.sessions.get(chat_id)
+                if current is not None and current.message_id == session.message_id:
+                    del self.sessions[chat_id]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_full_refresh = loop.time() + self.interval
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), timeout=max(0.0, next_full_refresh - loop.time()))
+            except TimeoutError:
+                pass
+            if loop.time() >= next_full_refresh:
+                ecosystems_uid = None
+                next_full_refresh = loop.time() + self.interval
+            else:
+                ecosystems_uid = set(self._dirty)
+            self._wake.clear()
+            self._dirty.clear()
+            try:
+                await self.refresh(ecosystems_uid)
+            except Exception as e:
+                logger.error(
+                    f"Could not refresh the watched ecosystems. ERROR msg: "
+                    f"`{e.__class__.__name__} :{e}`.")
+            # Group the events received in the meantime in the next refresh
+            await asyncio.sleep(self.min_interval)
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+watcher = Watcher()
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from ouranos_chatbot.sender import sender
+
+
+# A result is a regression when it is worse than the baseline by this factor
+REGRESSION_FACTOR = 1.5
+
+
+@pytest.fixture
+def unlimited_sender(monkeypatch):
+    """Send the messages at once, so that the latencies measure the handlers
+    rather than the rate limits of the sender."""
+    async def send(chat_id, func, *args, **kwargs):
+        return await func(*args, **kwargs)
+
+    monkeypatch.setattr(sender, "send", send)
+
+
+class BenchmarkResults:
+    def __init__(self) -> None:
+        self.results: dict[str, dict[str, float]] = {}
+
+    def add(self, key: str, result: dict[str, float]) -> None:
+        self.results[key] = result
+
+    def save(self, path: str) -> None:
+        Path(path).write_text(json.dumps(self.results, indent=2, sort_keys=True))
+
+    def compare(self, path: str) -> list[str]:
+        baseline = json.loads(Path(path).read_text())
+        regressions = []
+        for key, result in sorted(self.results.items()):
+            previous = baseline.get(key)
+            if previous is None:
+                continue
+            if result["queries"] > previous["queries"]:
+                regressions.append(
+                    f"{key}: {result['queries']} queries instead of "
+                    f"{previous['queries']}")
+            for metric in ("p50", "p95"):
+                if result[metric] > previous[metric] * REGRESSION_FACTOR:
+                    regressions.append(
+                        f"{key}: {metric} latency of {result[metric] * 1000:.1f} ms "
+                        f"instead of {previous[metric] * 1000:.1f} ms")
+        return regressions
+
+    def report(self) -> str:
+        lines = [
+            f"{'benchmark':<45} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} "
+            f"{'queries':>8} {'peak KiB':>9}"
+        ]
+        for key, result in sorted(self.results.items()):
+            lines.append(
+                f"{key:<45} {result['p50'] * 1000:>8.1f} {result['p95'] * 1000:>8.1f} "
+                f"{result['max'] * 1000:>8.1f} {result['queries']:>8} "
+                f"{result['peak_memory'] / 1024:>9.1f}"
+            )
+        return "\n".join(lines)
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(request):
+    results = BenchmarkResults()
+    yield results
+    if not results.results:
+        return
+    terminal = request.config.pluginmanager.get_plugin("terminalreporter")
+    if terminal is not None:
+        terminal.write_line("")
+        terminal.write_line(results.report())
+    save_path = request.config.getoption("--benchmark-save")
+    if save_path:
+        results.save(save_path)
+    compare_path = request.config.getoption("--benchmark-compare")
+    if compare_path:
+        regressions = results.compare(compare_path)
+        if regressions and terminal is not None:
+            terminal.write_line("Regressions compared to the baseline:")
+            for regression in regressions:
+                terminal.write_line(f"  - {regression}")
@@ -0,0 +1,89 @@
+from statistics import quantiles
+from time import perf_counter
+import tracemalloc
+
+import pytest
+from telegram.ext import CallbackQueryHandler, CommandHandler
+
+from ouranos_chatbot.commands import HANDLERS
+from ouranos_chatbot.config import settings
+from ouranos_chatbot.metrics import db_queries
+
+from tests.utils import create_user, press_warnings_button, seed
+
+
+# (ecosystems, sensors per ecosystem, warnings)
+SIZES = [
+    (1, 2, 5),
+    (10, 4, 50),
+    (50, 8, 500),
+]
+
+ITERATIONS = 20
+
+TELEGRAM_ID = 777777
+
+# Arguments given to the commands requiring some
+COMMAND_ARGS = {
+    "link_account": ["not-a-real-token"],
+    "switch_actuator": ["ecosystem_0", "light", "on"],
+}
+
+
+def _handler_id(handler) -> str:
+    if isinstance(handler, CommandHandler):
+        return next(iter(handler.commands))
+    return handler.callback.__name__
+
+
+@pytest.mark.benchmark
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", SIZES, ids=lambda size: "x".join(map(str, size)))
+@pytest.mark.parametrize("handler", HANDLERS, ids=_handler_id)
+async def test_command(
+        db, make_update, make_context, monkeypatch, unlimited_sender, benchmark_results,
+        handler, size):
+    # No Gaia answers the actuators switches, don't wait for it
+    monkeypatch.setattr(settings, "actuator_ack_timeout", 0.0)
+    async with db.scoped_session() as session:
+        await seed(session, *size)
+        # An operator, for /switch_actuator to go past the permission check
+        await create_user(session, TELEGRAM_ID, role="Operator")
+
+    name = _handler_id(handler)
+    args = COMMAND_ARGS.get(name, [])
+    callback_name = handler.callback.__name__
+
+    def make_handler_update():
+        update = make_update(telegram_id=TELEGRAM_ID)
+        # The only callback queries are the presses of the warnings buttons
+        if isinstance(handler, CallbackQueryHandler):
+            press_warnings_button(update)
+        return update
+
+    # Warm up the caches and the templates
+    await handler.callback(make_handler_update(), make_context(args))
+
+    queries_before = db_queries.get(callback_name)
+    latencies = []
+    tracemalloc.start()
+    try:
+        for _ in range(ITERATIONS):
+            update = make_handler_update()
+            context = make_context(list(args))
+            start = perf_counter()
+            await handler.callback(update, context)
+            latencies.append(perf_counter() - start)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    queries = (db_queries.get(callback_name) - queries_before) / ITERATIONS
+
+    percentiles = quantiles(latencies, n=20)
+    benchmark_results.add(f"{name}[{'x'.join(map(str, size))}]", {
+        "p50": percentiles[9],
+        "p95": percentiles[18],
+        "max": max(latencies),
+        "queries": queries,
+        "peak_memory": peak_memory,
+    })
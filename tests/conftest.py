@@ -7,6 +7,32 @@ from ouranos import Config, db as _db, setup_config
 from ouranos.core.config import ConfigDict
 from ouranos.core.database.init import create_db_tables, insert_default_data
 
+from ouranos_chatbot.auth import user_cache
+from ouranos_chatbot.events import configure_dispatcher
+from ouranos_chatbot.reference import reference_data
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark", "Chatbot commands benchmarks")
+    group.addoption(
+        "--benchmark", action="store_true", default=False,
+        help="Run the benchmarks of the commands, skipped otherwise")
+    group.addoption(
+        "--benchmark-save", metavar="PATH", default=None,
+        help="Save the benchmarks results to PATH, to be used as a baseline")
+    group.addoption(
+        "--benchmark-compare", metavar="PATH", default=None,
+        help="Compare the benchmarks results to the baseline saved at PATH")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="Benchmarks only run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
 
 @pytest.fixture(scope="session", autouse=True)
 def config(tmp_path_factory):
@@ -24,6 +50,7 @@ def config(tmp_path_factory):
 
     config = setup_config(Config)
     _db.init(config)
+    configure_dispatcher()
     yield config
 
 
@@ -42,6 +69,9 @@ async def db(config: ConfigDict):
         if key.startswith("cache_"):
             value.clear()
 
+    user_cache.clear()
+    reference_data.clear()
+
 
 @pytest.fixture
 def make_update():
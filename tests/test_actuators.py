@@ -0,0 +1,80 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import gaia_validators as gv
+
+from ouranos_chatbot.actuators import (
+    actuator_acknowledgements, reached, SwitchOutcome, SwitchRequest, switch_actuators)
+
+
+def _make_ecosystem(uid: str, acknowledge: bool = True, fail: bool = False) -> MagicMock:
+    ecosystem = MagicMock()
+    ecosystem.uid = uid
+
+    async def turn_actuator(dispatcher, actuator, mode, countdown):
+        if fail:
+            raise ConnectionError("Gaia is unreachable")
+        if acknowledge:
+            # Gaia answers with the new actuators state a bit later
+            asyncio.get_running_loop().call_soon(
+                actuator_acknowledgements.handle_payload,
+                [{"uid": uid, "data": [{
+                    "type": actuator.name,
+                    "active": True,
+                    "mode": "automatic" if mode.name == "automatic" else "manual",
+                    "status": mode.name == "on",
+                }]}],
+            )
+
+    ecosystem.turn_actuator = AsyncMock(side_effect=turn_actuator)
+    return ecosystem
+
+
+def test_reached():
+    on = gv.ActuatorModePayload.on
+    automatic = gv.ActuatorModePayload.automatic
+
+    assert reached(on, "manual", True)
+    assert not reached(on, "manual", False)
+    assert not reached(on, "automatic", True)
+    assert reached(automatic, gv.ActuatorMode.automatic, False)
+
+
+@pytest.mark.asyncio
+class TestSwitchActuators:
+    async def test_outcomes(self):
+        light = gv.HardwareType.light
+        requests = [
+            SwitchRequest(_make_ecosystem("eco_1"), light),
+            SwitchRequest(_make_ecosystem("eco_2", acknowledge=False), light),
+            SwitchRequest(_make_ecosystem("eco_3", fail=True), light),
+        ]
+
+        outcomes = await switch_actuators(
+            MagicMock(), requests, gv.ActuatorModePayload.on, timeout=0.1)
+
+        assert outcomes == [
+            SwitchOutcome.confirmed, SwitchOutcome.unconfirmed, SwitchOutcome.failed]
+        # No acknowledgement is left waiting
+        assert not actuator_acknowledgements._expected
+
+    async def test_dispatched_concurrently(self):
+        light = gv.HardwareType.light
+        requests = [
+            SwitchRequest(_make_ecosystem(f"eco_{i}"), light) for i in range(10)]
+
+        outcomes = await asyncio.wait_for(
+            switch_actuators(MagicMock(), requests, gv.ActuatorModePayload.off),
+            timeout=1)
+
+        assert outcomes == [SwitchOutcome.confirmed] * 10
+
+    async def test_no_wait(self):
+        requests = [SwitchRequest(_make_ecosystem("eco_1"), gv.HardwareType.light)]
+
+        outcomes = await switch_actuators(
+            MagicMock(), requests, gv.ActuatorModePayload.on, timeout=0)
+
+        assert outcomes == [SwitchOutcome.sent]
@@ -0,0 +1,105 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from ouranos_chatbot.alerts import _measures_values, AlertEngine
+
+
+class TestAlertEngine:
+    def test_duration(self):
+        engine = AlertEngine()
+        rule = engine.add(1, "eco", "temperature", ">", 30.0, duration=600)
+
+        assert engine.evaluate("eco", "temperature", 31.0, 0) == []
+        assert engine.evaluate("eco", "temperature", 32.0, 300) == []
+        events = engine.evaluate("eco", "temperature", 31.0, 600)
+        assert [(event.rule, event.triggered) for event in events] == [(rule, True)]
+        # The alert is only triggered once
+        assert engine.evaluate("eco", "temperature", 33.0, 900) == []
+
+    def test_condition_interrupted(self):
+        engine = AlertEngine()
+        engine.add(1, "eco", "temperature", ">", 30.0, duration=600)
+
+        engine.evaluate("eco", "temperature", 31.0, 0)
+        engine.evaluate("eco", "temperature", 29.0, 300)
+
+        assert engine.evaluate("eco", "temperature", 31.0, 600) == []
+        assert len(engine.evaluate("eco", "temperature", 31.0, 900)) == 0
+        assert len(engine.evaluate("eco", "temperature", 31.0, 1200)) == 1
+
+    def test_hysteresis(self):
+        engine = AlertEngine()
+        engine.add(1, "eco", "humidity", "<", 40.0, hysteresis=2.0)
+
+        assert len(engine.evaluate("eco", "humidity", 39.0, 0)) == 1
+        assert engine.evaluate("eco", "humidity", 41.0, 60) == []
+        events = engine.evaluate("eco", "humidity", 42.5, 120)
+        assert [event.triggered for event in events] == [False]
+        assert len(engine.evaluate("eco", "humidity", 39.5, 180)) == 1
+
+    def test_index(self):
+        engine = AlertEngine()
+        engine.add(1, "eco", "temperature", ">", 30.0)
+        engine.add(2, "eco", "temperature", "<", 10.0)
+        engine.add(2, "other", "temperature", ">", 30.0)
+
+        assert engine.evaluate("eco", "humidity", 50.0) == []
+        events = engine.evaluate("eco", "temperature", 35.0)
+        assert [event.rule.chat_id for event in events] == [1]
+
+    def test_add_and_remove(self):
+        engine = AlertEngine(max_rules_per_chat=1)
+        rule = engine.add(1, "eco", "temperature", ">", 30.0)
+
+        with pytest.raises(ValueError):
+            engine.add(1, "eco", "humidity", ">", 80.0)
+        with pytest.raises(ValueError):
+            engine.add(2, "eco", "humidity", "!=", 80.0)
+        assert not engine.remove(2, rule.id)
+        assert engine.remove(1, rule.id)
+        assert engine.chat_rules(1) == []
+        assert engine.evaluate("eco", "temperature", 35.0) == []
+
+    def test_dump_and_restore(self):
+        engine = AlertEngine()
+        rule = engine.add(1, "eco", "temperature", ">", 30.0, duration=600)
+        engine.evaluate("eco", "temperature", 31.0, 0)
+
+        restored = AlertEngine()
+        restored.restore(engine.dump())
+
+        assert restored.rules == engine.rules
+        assert restored.states == engine.states
+        assert len(restored.evaluate("eco", "temperature", 31.0, 600)) == 1
+        assert restored.add(1, "eco", "humidity", ">", 80.0).id == rule.id + 1
+
+
+def test_measures_values():
+    assert _measures_values({
+        "records": [
+            ["sensor_1", "temperature", 20.0],
+            ["sensor_2", "temperature", 22.0],
+            ["sensor_2", "humidity", 60.0],
+        ],
+    }) == {"temperature": 21.0, "humidity": 60.0}
+    assert _measures_values({
+        "records": [["sensor_1", "temperature", 20.0]],
+        "average": [["temperature", 21.5, None]],
+    }) == {"temperature": 21.5}
+
+
+@pytest.mark.asyncio
+async def test_handle_payload(monkeypatch):
+    engine = AlertEngine()
+    engine.add(1, "eco", "temperature", ">", 30.0)
+    notify = AsyncMock()
+    monkeypatch.setattr(engine, "notify", notify)
+
+    await engine.handle_payload(MagicMock(), [
+        {"uid": "eco", "data": {"records": [["sensor_1", "temperature", 35.0]]}},
+        {"uid": "other", "data": {"records": [["sensor_1", "temperature", 35.0]]}},
+    ])
+
+    events = notify.await_args.args[1]
+    assert [(event.rule.ecosystem_uid, event.value) for event in events] == [("eco", 35.0)]
@@ -0,0 +1,68 @@
+import pytest
+
+from ouranos.core.database.models.app import anonymous_user, User
+
+from ouranos_chatbot.auth import get_current_user, link_user, UserCache, user_cache
+
+
+async def _create_user(session, **overrides) -> User:
+    values = {
+        "username": "alice",
+        "email": "alice@example.com",
+        "password": "Password1!",
+    }
+    values.update(overrides)
+    await User.create(session, values=values)
+    user = await User.get_by(session, username=values["username"])
+    assert user is not None
+    return user
+
+
+class TestUserCache:
+    def test_counts_hits_and_misses(self):
+        cache = UserCache()
+
+        with pytest.raises(KeyError):
+            cache[123]
+        cache[123] = anonymous_user
+        assert cache[123] is anonymous_user
+
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_invalidate(self):
+        cache = UserCache()
+        cache[123] = anonymous_user
+
+        cache.invalidate(123)
+
+        with pytest.raises(KeyError):
+            cache[123]
+
+
+@pytest.mark.asyncio
+class TestGetCurrentUser:
+    async def test_caches_unlinked_telegram_ids(self, db):
+        async with db.scoped_session() as session:
+            user = await get_current_user(session, 111111)
+        assert user.is_anonymous
+
+        misses = user_cache.misses
+        async with db.scoped_session() as session:
+            user = await get_current_user(session, 111111)
+        assert user.is_anonymous
+        assert user_cache.misses == misses
+
+    async def test_linking_invalidates_the_cache(self, db):
+        telegram_id = 333333
+        async with db.scoped_session() as session:
+            user = await get_current_user(session, telegram_id)
+            assert user.is_anonymous
+
+            user = await _create_user(session)
+            await link_user(session, user, telegram_id)
+
+        async with db.scoped_session() as session:
+            user = await get_current_user(session, telegram_id)
+        assert user.is_authenticated
+        assert user.username == "alice"
@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from time import sleep
+
+import pytest
+
+from ouranos_chatbot.charts import ChartRenderer, draw_chart, to_series
+from ouranos_chatbot.history import History, HistoryBucket
+from ouranos_chatbot.metrics import event_loop_lag, EventLoopLagMonitor
+
+
+def _make_series() -> list:
+    end = datetime.now(timezone.utc)
+    history = History(end - timedelta(hours=4), end, 4, [
+        HistoryBucket(0, 20.0, 18.0, 22.0, 60),
+        HistoryBucket(1, 21.0, 19.0, 23.0, 60),
+        HistoryBucket(3, 19.0, 18.5, 19.5, 60),
+    ])
+    return [to_series("temperature", "°C", history)]
+
+
+def test_to_series():
+    measure, unit, points = _make_series()[0]
+
+    assert (measure, unit) == ("temperature", "°C")
+    # The points are placed in the middle of their bucket
+    assert points[1][0] - points[0][0] == pytest.approx(3600)
+    assert [point[1:] for point in points] == [
+        (20.0, 18.0, 22.0), (21.0, 19.0, 23.0), (19.0, 18.5, 19.5)]
+
+
+def test_draw_chart():
+    pytest.importorskip("matplotlib")
+
+    chart = draw_chart("Test ecosystem, last 4h", _make_series())
+
+    assert chart.startswith(b"\x89PNG")
+
+
+@pytest.mark.asyncio
+class TestChartRenderer:
+    async def test_draw_off_loop(self):
+        pytest.importorskip("matplotlib")
+        renderer = ChartRenderer(workers=1, use_processes=False)
+        try:
+            chart = await renderer.draw("Test ecosystem, last 4h", _make_series())
+        finally:
+            renderer.shutdown()
+
+        assert chart.startswith(b"\x89PNG")
+
+    async def test_charts_cached_per_bucket(self):
+        renderer = ChartRenderer(cache_bucket=60)
+        calls = []
+
+        async def render(name: str) -> bytes:
+            calls.append(name)
+            await asyncio.sleep(0)
+            return name.encode()
+
+        results = await asyncio.gather(
+            renderer.get("eco", render, "eco"),
+            renderer.get("eco", render, "eco"),
+        )
+        results.append(await renderer.get("eco", render, "eco"))
+        results.append(await renderer.get("other", render, "other"))
+
+        assert results == [b"eco", b"eco", b"eco", b"other"]
+        assert calls == ["eco", "other"]
+
+
+@pytest.mark.asyncio
+async def test_event_loop_lag_monitor():
+    monitor = EventLoopLagMonitor(interval=0.01, warning_threshold=0.05)
+    count = event_loop_lag.count()
+    monitor.start()
+    try:
+        await asyncio.sleep(0.02)
+        # Block the loop
+        sleep(0.1)
+        await asyncio.sleep(0.02)
+    finally:
+        await monitor.stop()
+
+    assert event_loop_lag.count() > count
+    assert event_loop_lag.render()[-2].split()[-1] != "0.0"
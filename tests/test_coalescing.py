@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from ouranos_chatbot.coalescing import SingleFlight
+
+
+@pytest.mark.asyncio
+class TestSingleFlight:
+    async def test_concurrent_calls_share_the_result(self):
+        single_flight = SingleFlight("test")
+        calls = 0
+
+        async def compute() -> str:
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(
+            *[single_flight.run("key", compute) for _ in range(10)])
+
+        assert results == ["result"] * 10
+        assert calls == 1
+
+    async def test_different_keys_are_not_coalesced(self):
+        single_flight = SingleFlight("test")
+
+        async def compute(value: int) -> int:
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(
+            single_flight.run("a", compute, 1),
+            single_flight.run("b", compute, 2),
+        )
+
+        assert results == [1, 2]
+
+    async def test_sequential_calls_are_recomputed_without_freshness(self):
+        single_flight = SingleFlight("test")
+        calls = 0
+
+        async def compute() -> int:
+            nonlocal calls
+            calls += 1
+            return calls
+
+        assert await single_flight.run("key", compute) == 1
+        assert await single_flight.run("key", compute) == 2
+
+    async def test_fresh_results_are_reused(self):
+        single_flight = SingleFlight("test", freshness=60)
+        calls = 0
+
+        async def compute() -> int:
+            nonlocal calls
+            calls += 1
+            return calls
+
+        assert await single_flight.run("key", compute) == 1
+        assert await single_flight.run("key", compute) == 1
+
+    async def test_exceptions_are_shared(self):
+        single_flight = SingleFlight("test")
+
+        async def compute() -> None:
+            await asyncio.sleep(0.01)
+            raise RuntimeError("failed")
+
+        results = await asyncio.gather(
+            *[single_flight.run("key", compute) for _ in range(3)],
+            return_exceptions=True,
+        )
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    async def test_a_waiting_call_takes_over_a_cancelled_one(self):
+        single_flight = SingleFlight("test")
+        calls = 0
+
+        async def compute() -> int:
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        first = asyncio.create_task(single_flight.run("key", compute))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(single_flight.run("key", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+
+        results = await asyncio.gather(*waiting)
+
+        assert first.cancelled()
+        assert results == [2, 2, 2]
+        assert calls == 2
@@ -1,25 +1,27 @@
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
+from statistics import mean
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
+from sqlalchemy import select
 
 from ouranos.core.database.models.app import User
+from ouranos.core.database.models.gaia import Ecosystem, SensorDataCache
 from ouranos.core.utils import Tokenizer
 
+import ouranos_chatbot.commands
 from ouranos_chatbot.commands import (
-    TELEGRAM_CHAT_ACTIVATION_SUB, get_ecosystems, link_account)
+    _get_actuators_state, _get_sensors_summary, _send_progressive_recap,
+    _summarize_actuators_state, get_ecosystems, get_recap, link_account,
+    RECAP_SEPARATOR, subscribe_warnings, TELEGRAM_CHAT_ACTIVATION_SUB,
+    unsubscribe_warnings)
+from ouranos_chatbot.config import settings
+from ouranos_chatbot.notifications import warnings_notifier
+from ouranos_chatbot.reference import EcosystemRef
 
-
-async def _create_user(session, **overrides) -> User:
-    values = {
-        "username": "alice",
-        "email": "alice@example.com",
-        "password": "Password1!",
-    }
-    values.update(overrides)
-    await User.create(session, values=values)
-    user = await User.get_by(session, username=values["username"])
-    assert user is not None
-    return user
+from tests.utils import create_user, seed
 
 
 @pytest.mark.asyncio
@@ -84,7 +86,7 @@ class TestLinkAccount:
 
     async def test_success_links_the_telegram_id(self, db, make_update, make_context):
         async with db.scoped_session() as session:
-            user = await _create_user(session)
+            user = await create_user(session)
             user_id = user.id
 
         token = Tokenizer.dumps({
@@ -125,7 +127,7 @@ class TestActivationRequired:
     async def test_lets_a_linked_account_through(self, db, make_update, make_context):
         telegram_id = 222222
         async with db.scoped_session() as session:
-            await _create_user(session, telegram_id=telegram_id)
+            await create_user(session, telegram_id)
 
         update = make_update(telegram_id=telegram_id)
         context = make_context()
@@ -135,3 +137,331 @@ class TestActivationRequired:
         update.message.reply_html.assert_awaited_once()
         (msg,), _ = update.message.reply_html.call_args
         assert msg == "There is not ecosystem currently registered to GAIA"
+
+
+@pytest.mark.asyncio
+class TestRequestScope:
+    async def test_opens_a_single_session_per_command(
+            self, db, monkeypatch, make_update, make_context):
+        telegram_id = 333333
+        async with db.scoped_session() as session:
+            await create_user(session, telegram_id)
+
+        opened = 0
+        scoped_session = db.scoped_session
+
+        def counting_scoped_session():
+            nonlocal opened
+            opened += 1
+            return scoped_session()
+
+        monkeypatch.setattr(db, "scoped_session", counting_scoped_session)
+
+        update = make_update(telegram_id=telegram_id)
+        context = make_context()
+
+        await get_ecosystems.callback(update, context)
+
+        update.message.reply_html.assert_awaited_once()
+        assert opened == 1
+
+    @pytest.mark.parametrize("registered", [True, False])
+    async def test_closes_the_session_before_replying(
+            self, db, monkeypatch, make_update, make_context, registered):
+        telegram_id = 333334
+        if registered:
+            async with db.scoped_session() as session:
+                await create_user(session, telegram_id)
+
+        open_sessions = 0
+        scoped_session = db.scoped_session
+
+        @asynccontextmanager
+        async def tracked_scoped_session():
+            nonlocal open_sessions
+            open_sessions += 1
+            try:
+                async with scoped_session() as session:
+                    yield session
+            finally:
+                open_sessions -= 1
+
+        monkeypatch.setattr(db, "scoped_session", tracked_scoped_session)
+
+        update = make_update(telegram_id=telegram_id)
+        # The replies are rate-limited, no connection should be held meanwhile
+        open_while_replying = []
+        update.message.reply_html.side_effect = (
+            lambda *args, **kwargs: open_while_replying.append(open_sessions))
+
+        await get_ecosystems.callback(update, make_context())
+
+        assert open_while_replying == [0]
+
+
+@pytest.mark.asyncio
+class TestWarningsSubscription:
+    async def test_subscribe_and_unsubscribe(self, db, make_update, make_context):
+        telegram_id = 444444
+        async with db.scoped_session() as session:
+            await create_user(session, telegram_id)
+
+        update = make_update(telegram_id=telegram_id)
+        update.effective_chat.id = telegram_id
+
+        await subscribe_warnings.callback(update, make_context(args=["high"]))
+
+        subscription = warnings_notifier.subscriptions[telegram_id]
+        assert subscription.ecosystems is None
+        assert subscription.level.name == "high"
+
+        await unsubscribe_warnings.callback(update, make_context())
+
+        assert telegram_id not in warnings_notifier.subscriptions
+
+    async def test_unknown_ecosystem(self, db, make_update, make_context):
+        telegram_id = 555555
+        async with db.scoped_session() as session:
+            await create_user(session, telegram_id)
+
+        update = make_update(telegram_id=telegram_id)
+        update.effective_chat.id = telegram_id
+
+        await subscribe_warnings.callback(update, make_context(args=["nowhere"]))
+
+        (msg,), _ = update.message.reply_text.call_args
+        assert "No ecosystem named nowhere was found" in msg
+        assert telegram_id not in warnings_notifier.subscriptions
+
+
+async def _seeded_ecosystems(session, ecosystems: int, sensors: int) -> list[Ecosystem]:
+    await seed(session, ecosystems, sensors, 0)
+    result = await session.execute(select(Ecosystem).order_by(Ecosystem.uid))
+    return list(result.scalars())
+
+
+def _by_name(summaries: list[dict]) -> list[dict]:
+    return sorted(summaries, key=lambda summary: summary["name"])
+
+
+@pytest.mark.asyncio
+class TestActuatorsState:
+    async def test_matches_the_per_ecosystem_queries(self, db):
+        async with db.scoped_session() as session:
+            ecosystems = await _seeded_ecosystems(session, 4, 1)
+
+            actuators_state = await _get_actuators_state(session, ecosystems)
+
+            assert list(actuators_state) == [ecosystem.uid for ecosystem in ecosystems]
+            for ecosystem in ecosystems:
+                expected = await ecosystem.get_actuators_state(session)
+                assert expected
+                assert _by_name(_summarize_actuators_state(
+                    actuators_state[ecosystem.uid])) == _by_name(
+                    _summarize_actuators_state(expected))
+
+    async def test_ecosystems_without_actuators(self, db):
+        async with db.scoped_session() as session:
+            await _seeded_ecosystems(session, 1, 1)
+
+            assert await _get_actuators_state(session, []) == {}
+            actuators_state = await _get_actuators_state(
+                session, [EcosystemRef("unknown", "Unknown")])
+
+        assert actuators_state == {"unknown": []}
+
+
+def _summarize_sensors_data(sensors_data: list[SensorDataCache]) -> list[dict]:
+    """The summary computed in Python before it was aggregated by the database."""
+    values: dict[str, list[float]] = {}
+    for sensor_data in sensors_data:
+        values.setdefault(sensor_data.measure, []).append(sensor_data.value)
+    return [
+        {
+            "name": measure,
+            "value": round(mean(data), 2),
+            "min": round(min(data), 2),
+            "max": round(max(data), 2),
+        }
+        for measure, data in values.items()
+    ]
+
+
+@pytest.mark.asyncio
+class TestSensorsSummary:
+    async def test_matches_the_python_summary(self, db):
+        async with db.scoped_session() as session:
+            ecosystems = await _seeded_ecosystems(session, 3, 4)
+            summary = await _get_sensors_summary(session, ecosystems)
+            with_extrema = await _get_sensors_summary(session, ecosystems, extrema=True)
+            expected = {}
+            for ecosystem in ecosystems:
+                result = await session.execute(
+                    select(SensorDataCache)
+                    .where(SensorDataCache.ecosystem_uid == ecosystem.uid))
+                expected[ecosystem.uid] = _by_name(
+                    _summarize_sensors_data(list(result.scalars())))
+
+        assert list(summary) == list(with_extrema) == list(expected)
+        for ecosystem_uid, measures in expected.items():
+            assert len(measures) > 1
+            assert with_extrema[ecosystem_uid] == [
+                {
+                    "name": measure["name"],
+                    "value": pytest.approx(measure["value"], abs=0.01),
+                    "min": pytest.approx(measure["min"], abs=0.01),
+                    "max": pytest.approx(measure["max"], abs=0.01),
+                }
+                for measure in measures
+            ]
+            assert summary[ecosystem_uid] == [
+                {"name": measure["name"], "value": measure["value"]}
+                for measure in with_extrema[ecosystem_uid]
+            ]
+
+    async def test_ecosystems_without_data(self, db):
+        async with db.scoped_session() as session:
+            await _seeded_ecosystems(session, 1, 1)
+
+            assert await _get_sensors_summary(session, []) == {}
+            summary = await _get_sensors_summary(
+                session, [EcosystemRef("unknown", "Unknown")], extrema=True)
+
+        assert summary == {"unknown": []}
+
+
+@pytest.mark.asyncio
+class TestProgressiveRecap:
+    ECOSYSTEMS = [EcosystemRef("eco_1", "Eco 1"), EcosystemRef("eco_2", "Eco 2")]
+
+    @pytest.fixture
+    def messages(self, monkeypatch):
+        """Record the messages sent and edited by the progressive recap."""
+        log: list[tuple[str, str]] = []
+
+        async def render_status(session, ecosystems):
+            return "Status"
+
+        async def reply_html(update, text):
+            log.append(("reply", text))
+            return [MagicMock()]
+
+        async def edit_html(message, text):
+            log.append(("edit", text))
+
+        monkeypatch.setattr(
+            ouranos_chatbot.commands, "_render_ecosystems_status", render_status)
+        monkeypatch.setattr(ouranos_chatbot.commands, "reply_html", reply_html)
+        monkeypatch.setattr(ouranos_chatbot.commands, "edit_html", edit_html)
+        return log
+
+    def _set_sections(self, monkeypatch, renders: dict) -> None:
+        monkeypatch.setattr(ouranos_chatbot.commands, "RECAP_SECTIONS", {
+            name: (f"Loading {name}...", render) for name, render in renders.items()
+        })
+
+    async def test_edits_only_when_the_text_changed(self, monkeypatch, messages):
+        async def sensors(ecosystems):
+            return "Sensors"
+
+        async def actuators(ecosystems):
+            # Rendered as its placeholder, the message does not change
+            return "Loading actuators..."
+
+        self._set_sections(monkeypatch, {"sensors": sensors, "actuators": actuators})
+
+        await _send_progressive_recap(MagicMock(), self.ECOSYSTEMS)
+
+        assert messages == [
+            ("reply", RECAP_SEPARATOR.join([
+                "Here is your recap:", "Status", "Loading sensors...",
+                "Loading actuators..."])),
+            ("edit", RECAP_SEPARATOR.join([
+                "Here is your recap:", "Status", "Sensors", "Loading actuators..."])),
+        ]
+
+    async def test_overflow_sent_once_the_sections_are_ready(self, monkeypatch, messages):
+        long_section = "\n".join(f"Line {i} " + "x" * 80 for i in range(100))
+        finished = []
+
+        async def sensors(ecosystems):
+            finished.append("sensors")
+            return long_section
+
+        async def actuators(ecosystems):
+            await asyncio.sleep(0.01)
+            finished.append("actuators")
+            return "Actuators"
+
+        original_reply_html = ouranos_chatbot.commands.reply_html
+
+        async def reply_html(update, text):
+            messages.append(("finished", ",".join(finished)))
+            return await original_reply_html(update, text)
+
+        monkeypatch.setattr(ouranos_chatbot.commands, "reply_html", reply_html)
+        self._set_sections(monkeypatch, {"sensors": sensors, "actuators": actuators})
+
+        await _send_progressive_recap(MagicMock(), self.ECOSYSTEMS)
+
+        replies = [text for action, text in messages if action == "reply"]
+        assert len(replies) > 1
+        assert all(len(text) <= 4096 for text in replies)
+        # The parts after the first one are only sent once every section is ready
+        first_overflow = messages.index(("reply", replies[1]))
+        assert messages[first_overflow - 1] == ("finished", "sensors,actuators")
+        assert "Actuators" in replies[-1]
+
+    async def test_pending_sections_cancelled_on_error(self, monkeypatch, messages):
+        blocked: list[asyncio.Task] = []
+
+        async def sensors(ecosystems):
+            raise RuntimeError("Database unavailable")
+
+        async def actuators(ecosystems):
+            blocked.append(asyncio.current_task())
+            await asyncio.Event().wait()
+
+        self._set_sections(monkeypatch, {"actuators": actuators, "sensors": sensors})
+
+        with pytest.raises(RuntimeError):
+            await _send_progressive_recap(MagicMock(), self.ECOSYSTEMS)
+        await asyncio.sleep(0)
+
+        assert blocked and blocked[0].cancelled()
+
+    @pytest.mark.parametrize("progressive, ecosystems, expected", [
+        (False, ECOSYSTEMS, "fallback"),
+        (True, [], "fallback"),
+        (True, ECOSYSTEMS, "progressive"),
+    ])
+    async def test_fallback(
+            self, db, monkeypatch, make_update, make_context, progressive, ecosystems,
+            expected):
+        telegram_id = 666666
+        async with db.scoped_session() as session:
+            await create_user(session, telegram_id)
+
+        async def get_ecosystems_(session, names):
+            return ecosystems
+
+        async def render_recap(session, ecosystems_):
+            return "Recap"
+
+        send_progressive_recap = AsyncMock()
+        monkeypatch.setattr(settings, "progressive_recap", progressive)
+        monkeypatch.setattr(ouranos_chatbot.commands, "_get_ecosystems", get_ecosystems_)
+        monkeypatch.setattr(ouranos_chatbot.commands, "_render_recap", render_recap)
+        monkeypatch.setattr(
+            ouranos_chatbot.commands, "_send_progressive_recap", send_progressive_recap)
+        update = make_update(telegram_id=telegram_id)
+
+        await get_recap.callback(update, make_context())
+
+        if expected == "progressive":
+            send_progressive_recap.assert_awaited_once_with(update, ecosystems)
+            update.message.reply_html.assert_not_awaited()
+        else:
+            send_progressive_recap.assert_not_awaited()
+            (msg,), _ = update.message.reply_html.call_args
+            assert msg == "Recap"
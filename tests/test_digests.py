@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+
+from ouranos_chatbot.digests import DigestSchedule, DigestScheduler
+
+
+def test_parse_schedule():
+    assert DigestSchedule.parse("daily", "08:05") == DigestSchedule(8, 5, None)
+    assert DigestSchedule.parse("hourly", ":15", ("eco", )) == DigestSchedule(
+        None, 15, ("eco", ))
+    for frequency, at in (("daily", "24:00"), ("daily", ":15"), ("hourly", "75"),
+                          ("weekly", "08:00")):
+        with pytest.raises(ValueError):
+            DigestSchedule.parse(frequency, at)
+
+
+def test_due_chats_grouped_by_ecosystems():
+    scheduler = DigestScheduler()
+    scheduler.subscribe(1, DigestSchedule(8, 0, None))
+    scheduler.subscribe(2, DigestSchedule(None, 0, None))
+    scheduler.subscribe(3, DigestSchedule(8, 0, ("eco", )))
+    scheduler.subscribe(4, DigestSchedule(9, 0, None))
+
+    due = scheduler.due(datetime(2026, 1, 1, 8, 0, tzinfo=timezone.utc))
+
+    assert due == {None: [1, 2], ("eco", ): [3]}
+    assert scheduler.due(datetime(2026, 1, 1, 8, 1, tzinfo=timezone.utc)) == {}
+
+
+@pytest.mark.asyncio
+async def test_digests_rendered_once_and_spread(monkeypatch):
+    scheduler = DigestScheduler(spread=60)
+    for chat_id in range(4):
+        scheduler.subscribe(chat_id, DigestSchedule(None, 30, None))
+    scheduler.subscribe(4, DigestSchedule(None, 30, ("eco", )))
+    rendered = []
+
+    async def render(ecosystems_uid):
+        rendered.append(ecosystems_uid)
+        return f"Recap of {ecosystems_uid}"
+
+    monkeypatch.setattr(scheduler, "_render", render)
+    monkeypatch.setattr(
+        scheduler, "due", lambda now: DigestScheduler.due(
+            scheduler, now.replace(minute=30)))
+    context = MagicMock()
+
+    await scheduler._tick(context)
+
+    assert rendered == [None, ("eco", )]
+    calls = context.job_queue.run_once.call_args_list
+    assert [call.kwargs["chat_id"] for call in calls] == [0, 1, 2, 3, 4]
+    assert [call.args[1] for call in calls] == [0, 12, 24, 36, 48]
+    assert calls[-1].kwargs["data"] == "Recap of ('eco',)"
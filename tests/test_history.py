@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import insert
+
+from ouranos.core.database.models.gaia import SensorDataRecord
+
+import ouranos_chatbot.history
+from ouranos_chatbot.history import (
+    get_histories, get_history, History, HistoryBucket, parse_period)
+
+
+def test_parse_period():
+    assert parse_period("30m") == timedelta(minutes=30)
+    assert parse_period("12H") == timedelta(hours=12)
+    assert parse_period("2w") == timedelta(weeks=2)
+    for period in ("0d", "7", "d7", "1y", "-1d"):
+        with pytest.raises(ValueError):
+            parse_period(period)
+
+
+def test_sparkline():
+    now = datetime.now(timezone.utc)
+    history = History(now - timedelta(hours=5), now, 5, [
+        HistoryBucket(0, 10.0, 9.0, 11.0, 2),
+        HistoryBucket(1, 20.0, 15.0, 25.0, 2),
+        HistoryBucket(4, 15.0, 15.0, 15.0, 1),
+    ])
+
+    assert history.sparkline() == "▁█  ▄"
+    assert (history.min, history.max, history.mean) == (9.0, 25.0, 15.0)
+
+
+@pytest.mark.asyncio
+async def test_get_history(db):
+    end = datetime.now(timezone.utc)
+    async with db.scoped_session() as session:
+        # Two days of data, one point per minute
+        await session.execute(insert(SensorDataRecord), [
+            {
+                "ecosystem_uid": "eco",
+                "sensor_uid": "sensor",
+                "measure": "temperature",
+                "timestamp": end - timedelta(minutes=i),
+                "value": float(i % 60),
+            }
+            for i in range(1, 2 * 24 * 60)
+        ])
+        await session.commit()
+
+        history = await get_history(
+            session, "eco", "temperature", timedelta(days=1), points=24, end=end)
+
+    assert len(history.buckets) == 24
+    assert sum(bucket.count for bucket in history.buckets) == 24 * 60
+    assert history.min == 0.0
+    assert history.max == 59.0
+
+
+@pytest.mark.asyncio
+async def test_get_histories(db):
+    end = datetime.now(timezone.utc)
+    async with db.scoped_session() as session:
+        await session.execute(insert(SensorDataRecord), [
+            {
+                "ecosystem_uid": "eco",
+                "sensor_uid": "sensor",
+                "measure": measure,
+                "timestamp": end - timedelta(minutes=i),
+                "value": float(i),
+            }
+            for measure in ("temperature", "humidity")
+            for i in range(1, 6 * 60)
+        ])
+        await session.commit()
+
+        histories = await get_histories(
+            session, "eco", None, timedelta(hours=6), points=6, end=end)
+        missing = await get_histories(
+            session, "eco", ["light"], timedelta(hours=6), points=6, end=end)
+
+    assert sorted(histories) == ["humidity", "temperature"]
+    assert all(len(history.buckets) == 6 for history in histories.values())
+    assert missing["light"].buckets == []
+
+
+@pytest.mark.asyncio
+async def test_get_history_without_time_buckets_support(db, monkeypatch):
+    end = datetime.now(timezone.utc)
+    async with db.scoped_session() as session:
+        await session.execute(insert(SensorDataRecord), [
+            {
+                "ecosystem_uid": "eco",
+                "sensor_uid": "sensor",
+                "measure": "temperature",
+                "timestamp": end - timedelta(minutes=i),
+                "value": float(i % 60),
+            }
+            for i in range(1, 2 * 24 * 60)
+        ])
+        await session.commit()
+
+        expected = await get_history(
+            session, "eco", "temperature", timedelta(days=1), points=24, end=end)
+        # A dialect the database cannot compute the time buckets with
+        monkeypatch.setattr(
+            ouranos_chatbot.history, "_bucket_index", lambda *args: None)
+        history = await get_history(
+            session, "eco", "temperature", timedelta(days=1), points=24, end=end)
+
+    assert len(history.buckets) == 24
+    for bucket, expected_bucket in zip(history.buckets, expected.buckets):
+        assert bucket.index == expected_bucket.index
+        assert bucket.count == expected_bucket.count
+        assert (bucket.min, bucket.max) == (expected_bucket.min, expected_bucket.max)
+        assert bucket.mean == pytest.approx(expected_bucket.mean)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from ouranos_chatbot.metrics import (
+    Counter, handler_duration, Histogram, phase_duration, query_budgets,
+    QueryBudgetExceeded, registry, span, start_metrics_server, track_handler)
+
+
+class TestMetrics:
+    def test_counter_render(self):
+        counter = Counter("test_total", "A test counter", ("cache", ))
+        counter.inc("users")
+        counter.inc("users", value=2)
+
+        assert counter.render() == [
+            "# HELP test_total A test counter",
+            "# TYPE test_total counter",
+            'test_total{cache="users"} 3',
+        ]
+
+    def test_histogram_render(self):
+        histogram = Histogram("test_seconds", "A test histogram", buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        assert histogram.render()[2:] == [
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1.0"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            "test_seconds_sum 5.55",
+            "test_seconds_count 3",
+        ]
+
+    def test_track_handler(self):
+        with track_handler("test_handler"):
+            with span("render"):
+                pass
+
+        assert handler_duration.count("test_handler") == 1
+        assert phase_duration.count("test_handler", "render") == 1
+
+    def test_track_handler_statements(self):
+        engine = create_engine("sqlite://")
+        with track_handler("test_statements") as timer:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+
+        assert [statement for statement, _ in timer.statements] == ["SELECT 1", "SELECT 2"]
+        assert timer.queries == 2
+        assert timer.db_time > 0
+
+    def test_query_budgets(self, monkeypatch, caplog):
+        engine = create_engine("sqlite://")
+        monkeypatch.setitem(query_budgets.budgets, "test_budget", 1)
+        monkeypatch.setattr(query_budgets, "log_overruns", True)
+
+        with caplog.at_level(logging.WARNING, logger="ouranos.chatbot"):
+            with track_handler("test_budget"):
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                    connection.execute(text("SELECT 2"))
+
+        assert "more than its budget of 1" in caplog.text
+        assert "SELECT 2" in caplog.text
+
+        with pytest.raises(QueryBudgetExceeded) as exc_info:
+            with query_budgets.enforcing():
+                with track_handler("test_budget"):
+                    with engine.connect() as connection:
+                        connection.execute(text("SELECT 1"))
+                        connection.execute(text("SELECT 2"))
+
+        assert exc_info.value.timer.queries == 2
+
+    def test_spans_outside_handlers_are_ignored(self):
+        with span("orphan"):
+            pass
+
+        assert "orphan" not in registry.render()
+
+
+@pytest.mark.asyncio
+class TestMetricsServer:
+    async def test_serves_the_metrics(self):
+        server = await start_metrics_server("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await writer.drain()
+            response = (await reader.read()).decode()
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+        assert response.startswith("HTTP/1.1 200 OK")
+        assert "# TYPE chatbot_handler_duration_seconds histogram" in response
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from sqlalchemy import insert
+
+import gaia_validators as gv
+from ouranos.core.database.models.gaia import GaiaWarning
+
+import ouranos_chatbot.notifications
+from ouranos_chatbot.notifications import WarningsNotifier, WarningsSubscription
+from ouranos_chatbot.sender import sender
+
+
+@pytest.mark.asyncio
+async def test_notify_renders_once_per_subscription(db, monkeypatch):
+    notifier = WarningsNotifier()
+    await notifier.initialize()
+    every_warning = WarningsSubscription(None, gv.WarningLevel.low)
+    eco_1_high = WarningsSubscription(frozenset(["eco_1"]), gv.WarningLevel.high)
+    eco_2_high = WarningsSubscription(frozenset(["eco_2"]), gv.WarningLevel.high)
+    notifier.subscribe(1, every_warning)
+    notifier.subscribe(2, every_warning)
+    notifier.subscribe(3, eco_1_high)
+    notifier.subscribe(4, eco_2_high)
+
+    rendered: list[list[str]] = []
+
+    async def render_template(name, warnings):
+        rendered.append([warning["title"] for warning in warnings])
+        return f"message {len(rendered)}"
+
+    monkeypatch.setattr(ouranos_chatbot.notifications, "render_template", render_template)
+    send_message = AsyncMock()
+    monkeypatch.setattr(sender, "send_message", send_message)
+
+    async with db.scoped_session() as session:
+        await session.execute(insert(GaiaWarning), [
+            {
+                "level": level,
+                "title": title,
+                "description": "Test warning",
+                "created_on": datetime.now(timezone.utc),
+                "created_by": created_by,
+            }
+            for level, title, created_by in (
+                (gv.WarningLevel.low, "Low on eco_1", "eco_1"),
+                (gv.WarningLevel.high, "High on eco_1", "eco_1"),
+                (gv.WarningLevel.low, "Low on eco_2", "eco_2"),
+            )
+        ])
+        await session.commit()
+
+    await notifier.notify(MagicMock())
+
+    # The chats sharing a subscription share its message, and no message is
+    # rendered for the subscription not matching any warning
+    assert sorted(rendered) == [
+        ["High on eco_1"],
+        ["Low on eco_1", "High on eco_1", "Low on eco_2"],
+    ]
+    sent = {call.args[1]: call.args[2] for call in send_message.await_args_list}
+    assert sorted(sent) == [1, 2, 3]
+    assert sent[1] == sent[2] != sent[3]
+
+    # The warnings already notified are not sent again
+    send_message.reset_mock()
+    await notifier.notify(MagicMock())
+
+    send_message.assert_not_awaited()
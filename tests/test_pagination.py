@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import insert
+
+import gaia_validators as gv
+from ouranos.core.database.models.gaia import GaiaWarning
+
+from ouranos_chatbot.pagination import (
+    decode_warnings_callback, encode_warnings_callback, get_warnings_page,
+    warnings_selections, WarningsCursor)
+
+
+def test_warnings_callback():
+    cursor = WarningsCursor(datetime(2026, 1, 1, 8, 30, 12, 123456, timezone.utc), 123456)
+    selection = warnings_selections.add(["eco_1", "eco_2", "eco_3"])
+
+    data = encode_warnings_callback(selection, cursor, newer=False)
+
+    # Telegram limits the callback data to 64 bytes
+    assert len(data.encode()) <= 64
+    assert decode_warnings_callback(data) == (selection, cursor, False)
+    assert warnings_selections.get(selection) == ("eco_1", "eco_2", "eco_3")
+    with pytest.raises(ValueError):
+        decode_warnings_callback("recap:*:older:0:0")
+
+
+@pytest.mark.asyncio
+async def test_get_warnings_page(db):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    async with db.scoped_session() as session:
+        await session.execute(insert(GaiaWarning), [
+            {
+                "level": gv.WarningLevel.high if i % 5 == 0 else gv.WarningLevel.low,
+                "title": f"Warning {i}",
+                "description": "Test warning",
+                # Pairs of warnings created at the same time
+                "created_on": now - timedelta(minutes=i // 2),
+                "created_by": "eco" if i < 25 else "other_eco",
+            }
+            for i in range(30)
+        ])
+        await session.commit()
+
+        pages = [await get_warnings_page(session, ["eco"], page_size=10)]
+        while pages[-1].older is not None:
+            pages.append(await get_warnings_page(
+                session, ["eco"], pages[-1].older, page_size=10))
+        back = await get_warnings_page(session, ["eco"], pages[-1].newer, newer=True, page_size=10)
+
+    titles = [warning.title for page in pages for warning in page.warnings]
+    # Within a pair, the warning inserted last has the highest id
+    assert len(titles) == 25
+    assert len(set(titles)) == 25
+    assert titles[:2] == ["Warning 1", "Warning 0"]
+    assert [len(page.warnings) for page in pages] == [10, 10, 5]
+    assert pages[0].newer is None
+    assert pages[0].counts == {"high": 5, "low": 20}
+    assert pages[0].total == 25
+    assert [warning.title for warning in back.warnings] == [
+        warning.title for warning in pages[1].warnings]
+    assert back.older is not None and back.newer is not None
@@ -0,0 +1,104 @@
+import pytest
+from sqlalchemy import event
+
+from ouranos_chatbot.persistence import StateStore
+from ouranos_chatbot.update_processor import UpdateTracker
+
+
+class Component:
+    def __init__(self) -> None:
+        self.state: dict = {}
+        self.restored: dict | None = None
+
+    def dump(self) -> dict:
+        return dict(self.state)
+
+    async def restore(self, state: dict) -> None:
+        self.restored = state
+
+
+@pytest.mark.asyncio
+class TestStateStore:
+    async def test_restart(self, tmp_path):
+        uri = f"sqlite+aiosqlite:///{tmp_path / 'state.db'}"
+        component = Component()
+        store = StateStore(uri)
+        store.register("component", component.dump, component.restore)
+        await store.start()
+        assert component.restored == {}
+
+        component.state = {"1": {"level": "low"}, "2": {"level": "high"}}
+        await store.flush()
+        component.state = {"1": {"level": "critical"}, "3": None}
+        await store.stop()
+
+        restarted = Component()
+        store = StateStore(uri)
+        store.register("component", restarted.dump, restarted.restore)
+        await store.start()
+        await store.stop()
+
+        assert restarted.restored == {"1": {"level": "critical"}, "3": None}
+
+    async def test_batched_writes(self, tmp_path):
+        component = Component()
+        store = StateStore(f"sqlite+aiosqlite:///{tmp_path / 'state.db'}")
+        store.register("component", component.dump, component.restore)
+        await store.start()
+        statements = []
+        event.listen(
+            store._engine.sync_engine, "before_cursor_execute",
+            lambda *args: statements.append(args[2]))
+        try:
+            component.state = {str(i): i for i in range(100)}
+            await store.flush()
+            # Nothing changed, nothing to write
+            await store.flush()
+        finally:
+            await store.stop()
+
+        # One delete and one insert for the hundred keys
+        assert [s.split()[0] for s in statements] == ["DELETE", "INSERT"]
+
+
+class TestUpdateTracker:
+    def test_skip_updates_handled_before_restart(self):
+        tracker = UpdateTracker()
+        assert not tracker.seen(10)
+        assert not tracker.seen(12)
+        # The updates of different chats might be handled out of order
+        assert not tracker.seen(11)
+        assert tracker.dump() == {"last_update_id": 12}
+
+        restarted = UpdateTracker()
+        restarted.restore(tracker.dump())
+        assert restarted.seen(12)
+        assert not restarted.seen(13)
+
+    def test_skip_only_the_updates_sent_again(self):
+        tracker = UpdateTracker()
+        tracker.restore({"last_update_id": 500})
+        assert tracker.seen(499)
+        assert not tracker.seen(501)
+        # Updates of another chat sent again but handled after a newer one
+        assert tracker.seen(500)
+        # Once more updates than Telegram sends at once were received, no
+        # update sent again can be left
+        assert not tracker.seen(500 + tracker.max_redelivered + 1)
+        assert not tracker.seen(450)
+
+    def test_handle_updates_once_the_ids_are_reset(self):
+        tracker = UpdateTracker()
+        tracker.restore({"last_update_id": 5000})
+        assert tracker.seen(4999)
+        # The ids restarted from a random value, lower than the stored one
+        assert not tracker.seen(1200)
+        assert not tracker.seen(1201)
+        assert not tracker.seen(1203)
+        assert not tracker.seen(1202)
+        assert tracker.dump() == {"last_update_id": 1203}
+
+        restarted = UpdateTracker()
+        restarted.restore(tracker.dump())
+        assert restarted.seen(1203)
+        assert not restarted.seen(1204)
@@ -0,0 +1,97 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from telegram.ext import CommandHandler
+
+from ouranos_chatbot.coalescing import command_results
+from ouranos_chatbot.commands import browse_warnings, HANDLERS
+from ouranos_chatbot.config import settings
+from ouranos_chatbot.digests import digest_scheduler
+from ouranos_chatbot.metrics import query_budgets
+from ouranos_chatbot.watch import watcher
+
+from tests.utils import create_user, press_warnings_button, seed
+
+
+# (ecosystems, sensors per ecosystem, warnings). The budgets hold whatever the
+# number of ecosystems
+SIZES = [
+    (1, 2, 5),
+    (20, 4, 50),
+]
+
+TELEGRAM_ID = 777777
+
+# Arguments making the commands reach the database
+COMMAND_ARGS = {
+    "link_account": ["not-a-real-token"],
+    "history": ["ecosystem_0", "temperature", "1d"],
+    "chart": ["ecosystem_0", "temperature", "1d"],
+    "switch_actuator": ["ecosystem_0", "light", "on"],
+    "subscribe_digest": ["daily", "08:00"],
+    "watch": ["ecosystem_0"],
+    "alert": ["list"],
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_state():
+    yield
+    command_results.clear()
+    watcher.sessions.clear()
+    digest_scheduler.schedules.clear()
+
+
+def test_every_handler_has_a_budget():
+    missing = [
+        handler.callback.__name__ for handler in HANDLERS
+        if query_budgets.get(handler.callback.__name__) is None
+    ]
+    assert missing == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", SIZES, ids=lambda size: "x".join(map(str, size)))
+@pytest.mark.parametrize(
+    "command", [handler for handler in HANDLERS if isinstance(handler, CommandHandler)],
+    ids=lambda handler: next(iter(handler.commands)))
+async def test_command_budget(db, make_update, make_context, monkeypatch, command, size):
+    # No Gaia answers the actuators switches, don't wait for it
+    monkeypatch.setattr(settings, "actuator_ack_timeout", 0.0)
+    async with db.scoped_session() as session:
+        await seed(session, *size)
+        # Operator, so that `switch_actuator` goes past the permission check
+        await create_user(session, TELEGRAM_ID, role="Operator")
+    name = next(iter(command.commands))
+    args = COMMAND_ARGS.get(name, [])
+
+    def make_command_update():
+        update = make_update(telegram_id=TELEGRAM_ID)
+        update.message.reply_html.return_value.pin = AsyncMock()
+        return update
+
+    # Cache the user and the reference data, then recompute the results
+    await command.callback(make_command_update(), make_context(list(args)))
+    command_results.clear()
+
+    with query_budgets.enforcing():
+        await command.callback(make_command_update(), make_context(list(args)))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", SIZES, ids=lambda size: "x".join(map(str, size)))
+async def test_browse_warnings_budget(db, make_update, make_context, size):
+    async with db.scoped_session() as session:
+        await seed(session, *size)
+        await create_user(session, TELEGRAM_ID)
+
+    def make_callback_update():
+        return press_warnings_button(make_update(telegram_id=TELEGRAM_ID))
+
+    # Cache the user and the reference data
+    await browse_warnings.callback(make_callback_update(), make_context())
+
+    update = make_callback_update()
+    with query_budgets.enforcing():
+        await browse_warnings.callback(update, make_context())
+    update.effective_message.edit_text.assert_awaited_once()
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+import ouranos_chatbot.reference
+from ouranos_chatbot.reference import EcosystemRef, ReferenceData
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(ouranos_chatbot.reference, "monotonic", clock)
+    return clock
+
+
+def _make_reference_data(monkeypatch, clock: Clock, ttl: float = 300) -> ReferenceData:
+    """Reference data loading `ecosystems` instead of querying the database, and
+    counting its loads."""
+    reference_data = ReferenceData(ttl=ttl)
+    reference_data.ecosystems = {"eco_1": "Greenhouse", "eco_2": "Nursery"}
+    reference_data.loads = 0
+
+    async def load() -> None:
+        reference_data.loads += 1
+        # Let the concurrent requests pile up behind the load
+        await asyncio.sleep(0.01)
+        reference_data.names = dict(reference_data.ecosystems)
+        reference_data.uids = {
+            name: uid for uid, name in reference_data.ecosystems.items()}
+        reference_data.recent = list(reference_data.ecosystems)
+        reference_data.units = {"temperature": "°C"}
+        reference_data._loaded_at = clock()
+
+    monkeypatch.setattr(reference_data, "_load", load)
+    return reference_data
+
+
+@pytest.mark.asyncio
+class TestReferenceData:
+    async def test_reloaded_once_stale(self, monkeypatch, clock):
+        reference_data = _make_reference_data(monkeypatch, clock, ttl=300)
+
+        assert await reference_data.get_units() == {"temperature": "°C"}
+        clock.now += 299
+        await reference_data.get_units()
+        assert reference_data.loads == 1
+
+        clock.now += 2
+        await reference_data.get_units()
+        assert reference_data.loads == 2
+
+    async def test_concurrent_requests_reload_once(self, monkeypatch, clock):
+        reference_data = _make_reference_data(monkeypatch, clock)
+        await reference_data.ensure_loaded()
+        clock.now += 301
+
+        await asyncio.gather(*(reference_data.get_units() for _ in range(10)))
+
+        assert reference_data.loads == 2
+
+    async def test_reloaded_on_unknown_name(self, monkeypatch, clock):
+        reference_data = _make_reference_data(monkeypatch, clock)
+        await reference_data.ensure_loaded()
+        reference_data.ecosystems["eco_3"] = "Orchard"
+
+        # Not reloaded right after a load
+        assert await reference_data.get_ecosystems(["Orchard"]) == []
+        assert reference_data.loads == 1
+
+        clock.now += reference_data.min_reload_interval + 1
+        results = await asyncio.gather(*(
+            reference_data.get_ecosystems(["Greenhouse", "Orchard"])
+            for _ in range(5)
+        ))
+
+        assert reference_data.loads == 2
+        assert results[0] == [
+            EcosystemRef("eco_1", "Greenhouse"), EcosystemRef("eco_3", "Orchard")]
+        assert await reference_data.get_name("eco_3") == "Orchard"
+        assert await reference_data.get_name("unknown") == "unknown"
+
+    async def test_match_ecosystems(self, monkeypatch, clock):
+        reference_data = _make_reference_data(monkeypatch, clock)
+        reference_data.ecosystems["eco_3"] = "Greenhouse_2"
+
+        matched = await reference_data.match_ecosystems(["Greenhouse*"])
+        assert sorted(matched) == [
+            EcosystemRef("eco_1", "Greenhouse"), EcosystemRef("eco_3", "Greenhouse_2")]
+        assert await reference_data.match_ecosystems(["*"]) == [
+            EcosystemRef("eco_1", "Greenhouse"), EcosystemRef("eco_2", "Nursery"),
+            EcosystemRef("eco_3", "Greenhouse_2")]
+        assert reference_data.loads == 1
+
+        # A pattern matching nothing reloads the data, at most every
+        # `min_reload_interval` seconds
+        reference_data.ecosystems["eco_4"] = "Orchard"
+        assert await reference_data.match_ecosystems(["Orch*"]) == []
+        clock.now += reference_data.min_reload_interval + 1
+        assert await reference_data.match_ecosystems(["Orch*"]) == [
+            EcosystemRef("eco_4", "Orchard")]
+        assert reference_data.loads == 2
+
+    async def test_update_ecosystem(self, monkeypatch, clock):
+        reference_data = _make_reference_data(monkeypatch, clock)
+        await reference_data.ensure_loaded()
+
+        reference_data.update_ecosystem("eco_1", "Big greenhouse")
+        reference_data.update_ecosystem("eco_3", "Orchard")
+
+        assert await reference_data.get_ecosystems(["Big greenhouse", "Orchard"]) == [
+            EcosystemRef("eco_1", "Big greenhouse"), EcosystemRef("eco_3", "Orchard")]
+        assert "Greenhouse" not in reference_data.uids
+        assert await reference_data.get_name("eco_1") == "Big greenhouse"
+        # Listed with the recently seen ecosystems without waiting for a reload
+        assert await reference_data.get_ecosystems() == [
+            EcosystemRef("eco_1", "Big greenhouse"), EcosystemRef("eco_2", "Nursery"),
+            EcosystemRef("eco_3", "Orchard")]
+        assert reference_data.loads == 1
@@ -0,0 +1,103 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from telegram import BotCommandScopeChat
+
+from ouranos.core.database.models.app import Permission
+
+from ouranos_chatbot.commands import HANDLERS, link_account, unknown_command
+from ouranos_chatbot.registry import CommandRegistry
+
+
+def _make_user(anonymous: bool = False, permissions: tuple = ()) -> MagicMock:
+    user = MagicMock()
+    user.is_anonymous = anonymous
+    user.can = lambda permission: permission in permissions
+    return user
+
+
+@pytest.fixture
+def registry() -> CommandRegistry:
+    registry = CommandRegistry()
+
+    @registry.command("help", listed=False)
+    async def get_help(update, context):
+        """List the commands available."""
+
+    @registry.command("link_account")
+    async def link(update, context):
+        """Link your account. Once linked, you will have access to more
+        commands."""
+
+    @registry.command("recap", activation=True)
+    async def recap(update, context):
+        """Get a recap."""
+
+    @registry.command("switch_actuator", activation=True, permission=Permission.OPERATE)
+    async def switch(update, context):
+        """Switch an actuator. Require to be an operator."""
+
+    return registry
+
+
+class TestCommandRegistry:
+    def test_help_per_tier(self, registry):
+        anonymous = registry.get_help(_make_user(anonymous=True))
+        viewer = registry.get_help(_make_user())
+        operator = registry.get_help(_make_user(permissions=(Permission.OPERATE, )))
+
+        assert anonymous == (
+            "Here is a list of the commands available:\n"
+            "/link_account : Link your account. Once linked, you will have access "
+            "to more commands.\n"
+        )
+        assert viewer == (
+            "Here is a list of the commands available:\n"
+            "/recap : Get a recap.\n"
+        )
+        assert operator == (
+            f"{viewer}/switch_actuator : Switch an actuator. Require to be an "
+            f"operator.\n"
+        )
+
+    def test_menus(self, registry):
+        menu = registry.get_menu(frozenset({Permission.OPERATE}))
+
+        assert [(c.command, c.description) for c in menu] == [
+            ("recap", "Get a recap"),
+            ("switch_actuator", "Switch an actuator"),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_chat_menu_set_once(self, registry):
+        bot = MagicMock()
+        bot.set_my_commands = AsyncMock()
+        user = _make_user()
+
+        await registry.update_chat_menu(bot, 42, user)
+        await registry.update_chat_menu(bot, 42, user)
+
+        bot.set_my_commands.assert_awaited_once()
+        _, kwargs = bot.set_my_commands.call_args
+        assert kwargs["scope"] == BotCommandScopeChat(42)
+
+    @pytest.mark.asyncio
+    async def test_chat_menus_are_bounded(self):
+        registry = CommandRegistry(max_chat_menus=2)
+        bot = MagicMock()
+        bot.set_my_commands = AsyncMock()
+        user = _make_user()
+
+        for chat_id in (1, 2, 3):
+            await registry.update_chat_menu(bot, chat_id, user)
+        # The least recent chat was forgotten, its menu is set again
+        await registry.update_chat_menu(bot, 3, user)
+        await registry.update_chat_menu(bot, 1, user)
+
+        assert len(registry._chat_tiers) == 2
+        assert bot.set_my_commands.await_count == 4
+
+    def test_handlers(self):
+        assert link_account in HANDLERS
+        # Unknown commands must only be caught once no command matched
+        assert HANDLERS[-1] is unknown_command
@@ -0,0 +1,96 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from telegram.error import RetryAfter
+
+from ouranos_chatbot.sender import MessageSender, split_message
+
+
+class TestSplitMessage:
+    def test_short_messages_are_not_split(self):
+        assert split_message("Hello") == ["Hello"]
+
+    def test_splits_at_the_sections_boundaries(self):
+        sections = ["a" * 40, "b" * 40, "c" * 40]
+        text = "\n-----------\n".join(sections)
+
+        chunks = split_message(text, max_length=100)
+
+        assert chunks == [
+            f"{sections[0]}\n-----------\n{sections[1]}",
+            sections[2],
+        ]
+
+    def test_splits_long_sections_at_the_lines_boundaries(self):
+        lines = ["a" * 40, "b" * 40, "c" * 40]
+        text = "\n".join(lines)
+
+        chunks = split_message(text, max_length=100)
+
+        assert chunks == [f"{lines[0]}\n{lines[1]}", lines[2]]
+
+    def test_cuts_lines_too_long(self):
+        chunks = split_message("a" * 250, max_length=100)
+
+        assert chunks == ["a" * 100, "a" * 100, "a" * 50]
+
+    def test_cuts_html_lines_outside_tags_and_entities(self):
+        # Cutting every 100 characters would fall inside the entities and tags
+        line = "<i>a</i> &amp; " * 7 + "<b>" + "b" * 150 + "</b>"
+
+        chunks = split_message(line, max_length=100, html=True)
+
+        assert chunks == [
+            "<i>a</i> &amp; " * 6 + "<i>a</i>",
+            "&amp; <b>" + "b" * 91 + "</b>",
+            "<b>" + "b" * 59 + "</b>",
+        ]
+
+    def test_reopens_the_tags_open_at_a_cut(self):
+        lines = ["<b>" + "a" * 40, "b" * 40, "c" * 40 + "</b>"]
+
+        chunks = split_message("\n".join(lines), max_length=100, html=True)
+
+        assert chunks == [
+            f"<b>{'a' * 40}\n{'b' * 40}</b>",
+            f"<b>{'c' * 40}</b>",
+        ]
+
+    def test_plain_text_is_cut_anywhere(self):
+        chunks = split_message("a<" * 75, max_length=100)
+
+        assert [len(chunk) for chunk in chunks] == [100, 50]
+
+
+@pytest.mark.asyncio
+class TestMessageSender:
+    async def test_replies_in_several_messages(self):
+        sender = MessageSender()
+        message = MagicMock()
+        message.reply_html = AsyncMock()
+        text = "\n-----------\n".join(["a" * 3000, "b" * 3000])
+
+        await sender.reply(message, text, html=True)
+
+        assert message.reply_html.await_count == 2
+        assert sender.stats()["sent"] == 2
+
+    async def test_retries_after_a_flood_wait(self):
+        sender = MessageSender()
+        func = AsyncMock(side_effect=[RetryAfter(0), "sent"])
+
+        rv = await sender.send(1, func, "Hello")
+
+        assert rv == "sent"
+        assert func.await_count == 2
+
+    async def test_gives_up_after_max_retries(self):
+        sender = MessageSender(max_retries=1)
+        func = AsyncMock(side_effect=RetryAfter(0))
+
+        with pytest.raises(RetryAfter):
+            await sender.send(1, func, "Hello")
+
+        assert func.await_count == 2
+        assert sender.stats()["failed"] == 1
+        assert sender.stats()["pending"] == 0
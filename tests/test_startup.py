@@ -0,0 +1,18 @@
+import subprocess
+import sys
+
+
+def test_plugin_discovery_is_light():
+    # Ouranos imports the plugin entry point whenever it discovers its plugins,
+    # Telegram, Jinja and the models must only be imported at startup
+    code = (
+        "import sys\n"
+        "import ouranos_chatbot.plugin_setup\n"
+        "print(' '.join(sorted(sys.modules)))\n"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    modules = process.stdout.split()
+
+    for package in ("telegram", "jinja2", "ouranos_chatbot.commands"):
+        assert package not in modules
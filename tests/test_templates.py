@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+
+from ouranos_chatbot.messages.templates import (
+    environment, fragment_cache, precompile_templates, render_template)
+from ouranos_chatbot.metrics import cache_hits, cache_misses
+
+
+def _ecosystem(name: str, value: float) -> dict:
+    return {
+        "name": name,
+        "current_data": [{"name": "temperature", "value": value}],
+    }
+
+
+@pytest.mark.asyncio
+class TestFragmentCache:
+    async def test_unchanged_fragments_are_reused(self):
+        fragment_cache.clear()
+        units = {"temperature": "°C"}
+        ecosystems = [_ecosystem("a", 20.0), _ecosystem("b", 21.0)]
+        misses = cache_misses.get("fragments")
+        hits = cache_hits.get("fragments")
+
+        first = await render_template("current_sensors", ecosystems=ecosystems, units=units)
+        ecosystems[1] = _ecosystem("b", 22.0)
+        second = await render_template("current_sensors", ecosystems=ecosystems, units=units)
+
+        assert "- Temperature: 20.0 °C" in first
+        assert "- Temperature: 22.0 °C" in second
+        assert cache_misses.get("fragments") - misses == 3
+        assert cache_hits.get("fragments") - hits == 1
+
+    async def test_fragments_are_escaped_once(self):
+        fragment_cache.clear()
+        message = await render_template("ecosystems_status", ecosystems=[{
+            "name": "<b>", "connected": False, "status": False,
+            "last_seen": datetime(2024, 5, 1, 12, 30),
+        }])
+
+        assert message == (
+            "Ecosystem &lt;b&gt; is currently disconnected. It was last seen on "
+            "01/05/2024 12:30.")
+
+
+def test_precompile_templates(tmp_path):
+    try:
+        precompile_templates(tmp_path)
+        assert any(tmp_path.iterdir())
+    finally:
+        environment.bytecode_cache = None
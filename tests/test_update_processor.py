@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Chat, Message, Update
+
+from ouranos_chatbot.update_processor import ChatOrderedUpdateProcessor
+
+
+def _make_update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(id=chat_id, type=Chat.PRIVATE)
+    message = Message(
+        message_id=update_id, date=datetime.now(timezone.utc), chat=chat)
+    return Update(update_id=update_id, message=message)
+
+
+@pytest.mark.asyncio
+class TestChatOrderedUpdateProcessor:
+    async def test_keeps_the_updates_of_a_chat_in_order(self):
+        processor = ChatOrderedUpdateProcessor(8)
+        processed = []
+
+        async def process(update_id: int, delay: float) -> None:
+            await asyncio.sleep(delay)
+            processed.append(update_id)
+
+        await asyncio.gather(
+            processor.process_update(_make_update(1, 1), process(1, 0.03)),
+            processor.process_update(_make_update(2, 1), process(2, 0.0)),
+            processor.process_update(_make_update(3, 1), process(3, 0.01)),
+        )
+
+        assert processed == [1, 2, 3]
+
+    async def test_processes_different_chats_concurrently(self):
+        processor = ChatOrderedUpdateProcessor(8)
+        processed = []
+
+        async def process(update_id: int, delay: float) -> None:
+            await asyncio.sleep(delay)
+            processed.append(update_id)
+
+        await asyncio.gather(
+            processor.process_update(_make_update(1, 1), process(1, 0.03)),
+            processor.process_update(_make_update(2, 2), process(2, 0.0)),
+        )
+
+        assert processed == [2, 1]
+
+    async def test_limits_the_concurrency(self):
+        processor = ChatOrderedUpdateProcessor(2)
+        running = 0
+        max_running = 0
+
+        async def process() -> None:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(running, max_running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*[
+            processor.process_update(_make_update(i, i), process())
+            for i in range(6)
+        ])
+
+        assert max_running == 2
+
+    async def test_waiting_updates_do_not_hold_a_slot(self):
+        processor = ChatOrderedUpdateProcessor(1)
+        processed = []
+
+        async def process(update_id: int, delay: float) -> None:
+            await asyncio.sleep(delay)
+            processed.append(update_id)
+
+        await asyncio.gather(
+            processor.process_update(_make_update(1, 1), process(1, 0.02)),
+            processor.process_update(_make_update(2, 1), process(2, 0.0)),
+            processor.process_update(_make_update(3, 2), process(3, 0.0)),
+        )
+
+        assert processed == [1, 3, 2]
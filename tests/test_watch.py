@@ -0,0 +1,88 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import ouranos_chatbot.commands
+from ouranos_chatbot.watch import Watcher
+
+
+def _make_bot() -> MagicMock:
+    bot = MagicMock()
+    bot.edit_message_text = AsyncMock()
+    bot.unpin_chat_message = AsyncMock()
+    return bot
+
+
+@pytest.mark.asyncio
+class TestWatcher:
+    async def test_render_once_and_edit_on_change(self, monkeypatch):
+        contents = {"eco": "Temperature: 21 °C", "other": "Temperature: 18 °C"}
+        rendered = []
+
+        async def render_watch(ecosystems_uid):
+            rendered.append(ecosystems_uid)
+            return {uid: contents[uid] for uid in ecosystems_uid}
+
+        monkeypatch.setattr(ouranos_chatbot.commands, "_render_watch", render_watch)
+        bot = _make_bot()
+        watcher = Watcher()
+        watcher._bot = bot
+        watcher.watch(1, "eco", 10, contents["eco"])
+        watcher.watch(2, "eco", 20, contents["eco"])
+        watcher.watch(3, "other", 30, contents["other"])
+
+        await watcher.refresh()
+
+        assert rendered == [["eco", "other"]]
+        bot.edit_message_text.assert_not_awaited()
+
+        contents["eco"] = "Temperature: 22 °C"
+        await watcher.refresh(["eco"])
+
+        assert rendered[-1] == ["eco"]
+        edited = {call.args[2] for call in bot.edit_message_text.await_args_list}
+        assert edited == {10, 20}
+        text = bot.edit_message_text.await_args.args[0]
+        assert text.startswith("Temperature: 22 °C")
+
+        bot.edit_message_text.reset_mock()
+        await watcher.refresh()
+
+        bot.edit_message_text.assert_not_awaited()
+
+    async def test_sessions_expire(self, monkeypatch):
+        async def render_watch(ecosystems_uid):
+            return {uid: "Temperature: 21 °C" for uid in ecosystems_uid}
+
+        monkeypatch.setattr(ouranos_chatbot.commands, "_render_watch", render_watch)
+        bot = _make_bot()
+        watcher = Watcher(duration=0)
+        watcher._bot = bot
+        watcher.watch(1, "eco", 10, "Temperature: 21 °C")
+
+        await watcher.refresh()
+
+        assert watcher.sessions == {}
+        text = bot.edit_message_text.await_args.args[0]
+        assert "This watch ended" in text
+        bot.unpin_chat_message.assert_awaited_once_with(1, 10)
+
+    async def test_notify_only_watched_ecosystems(self):
+        watcher = Watcher()
+        watcher.watch(1, "eco", 10, "")
+
+        watcher.notify(["other"])
+        assert not watcher._wake.is_set()
+
+        watcher.notify(["eco", "other"])
+        assert watcher._wake.is_set()
+        assert watcher._dirty == {"eco"}
+
+    async def test_dump_and_restore(self):
+        watcher = Watcher()
+        watcher.watch(1, "eco", 10, "Temperature: 21 °C")
+
+        restored = Watcher()
+        restored.restore(watcher.dump())
+
+        assert restored.sessions == watcher.sessions
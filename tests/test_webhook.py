@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import socket
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+from telegram import Update, User
+from telegram.ext import Application, ExtBot, TypeHandler
+
+from ouranos_chatbot.main import Chatbot
+
+
+SECRET_TOKEN = "test-secret-token"
+WEBHOOK_URL = "https://chatbot.example.com/telegram"
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "Test"},
+        "text": "/start",
+    },
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _make_chatbot(config: dict) -> Chatbot:
+    # Skip Ouranos' functionality setup, only the config is needed
+    chatbot = Chatbot.__new__(Chatbot)
+    chatbot.config = config
+    chatbot.logger = logging.getLogger("ouranos.chatbot")
+    chatbot.token = "123456:TEST-TOKEN"
+    chatbot.update_mode = "webhook"
+    chatbot.application = None
+    return chatbot
+
+
+@pytest.mark.asyncio
+async def test_webhook_url_is_required():
+    chatbot = _make_chatbot({})
+
+    with pytest.raises(ValueError, match="TELEGRAM_WEBHOOK_URL"):
+        await chatbot._startup()
+
+
+@pytest.mark.asyncio
+async def test_webhook_dispatches_authenticated_updates(monkeypatch):
+    bot_user = User(id=123456, first_name="Chatbot", is_bot=True, username="chatbot")
+
+    async def get_me(self, *args, **kwargs) -> User:
+        self._bot_user = bot_user
+        return bot_user
+
+    # No request reaches Telegram
+    monkeypatch.setattr(ExtBot, "get_me", get_me)
+    set_webhook = AsyncMock(return_value=True)
+    monkeypatch.setattr(ExtBot, "set_webhook", set_webhook)
+    port = _free_port()
+    chatbot = _make_chatbot({
+        "TELEGRAM_WEBHOOK_PORT": port,
+        "TELEGRAM_WEBHOOK_URL": WEBHOOK_URL,
+        "TELEGRAM_WEBHOOK_SECRET_TOKEN": SECRET_TOKEN,
+    })
+    chatbot.application = Application.builder().token(chatbot.token).build()
+    received: list[Update] = []
+
+    async def record(update: Update, context) -> None:
+        received.append(update)
+
+    chatbot.application.add_handler(TypeHandler(Update, record))
+    await chatbot.application.initialize()
+    try:
+        await chatbot._start_webhook()
+        await chatbot.application.start()
+        url = f"http://127.0.0.1:{port}/telegram"
+        async with httpx.AsyncClient() as client:
+            rejected = await client.post(url, json=UPDATE)
+            accepted = await client.post(
+                url, json=UPDATE,
+                headers={"X-Telegram-Bot-Api-Secret-Token": SECRET_TOKEN})
+        for _ in range(100):
+            if received:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        if chatbot.application.updater.running:
+            await chatbot.application.updater.stop()
+        if chatbot.application.running:
+            await chatbot.application.stop()
+        await chatbot.application.shutdown()
+
+    assert rejected.status_code == 403
+    assert accepted.status_code == 200
+    assert [update.update_id for update in received] == [1]
+    assert received[0].message.text == "/start"
+    set_webhook.assert_awaited_once()
+    assert set_webhook.await_args.kwargs["url"] == WEBHOOK_URL
+    assert set_webhook.await_args.kwargs["secret_token"] == SECRET_TOKEN
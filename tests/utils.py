@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+import random
+from unittest.mock import AsyncMock, MagicMock
+
+from sqlalchemy import insert
+
+import gaia_validators as gv
+from ouranos.core.database.models.app import User
+from ouranos.core.database.models.gaia import (
+    ActuatorState, Ecosystem, Engine, GaiaWarning, SensorDataCache)
+
+from ouranos_chatbot.pagination import (
+    ALL_ECOSYSTEMS, encode_warnings_callback, WarningsCursor)
+
+
+MEASURES = ["temperature", "humidity", "light", "moisture", "CO2"]
+
+
+async def seed(
+        session,
+        ecosystems: int,
+        sensors: int,
+        warnings: int,
+) -> None:
+    """Seed `ecosystems` ecosystems, each with `sensors` sensors measuring
+    every measure, and `warnings` unsolved warnings spread among them."""
+    now = datetime.now(timezone.utc)
+    await session.execute(insert(Engine), [{
+        "uid": "engine_bench",
+        "sid": "engine_bench_sid",
+        "registration_date": now,
+        "address": "127.0.0.1",
+        "last_seen": now,
+    }])
+    ecosystems_uid = [f"eco{i:05}" for i in range(ecosystems)]
+    await session.execute(insert(Ecosystem), [
+        {
+            "uid": uid,
+            "name": f"ecosystem_{i}",
+            "status": bool(i % 2),
+            "engine_uid": "engine_bench",
+            "last_seen": now,
+        }
+        for i, uid in enumerate(ecosystems_uid)
+    ])
+    await session.execute(insert(SensorDataCache), [
+        {
+            "ecosystem_uid": uid,
+            "sensor_uid": f"{uid}_s{j}",
+            "measure": measure,
+            "timestamp": now,
+            "value": random.uniform(0, 100),
+        }
+        for uid in ecosystems_uid
+        for j in range(sensors)
+        for measure in MEASURES
+    ])
+    await session.execute(insert(ActuatorState), [
+        {
+            "ecosystem_uid": uid,
+            "type": actuator,
+            "active": True,
+            "mode": gv.ActuatorMode.automatic,
+            "status": bool(i % 2),
+        }
+        for uid in ecosystems_uid
+        for i, actuator in enumerate(gv.HardwareType.actuator)
+    ])
+    if warnings:
+        await session.execute(insert(GaiaWarning), [
+            {
+                "level": list(gv.WarningLevel)[i % len(gv.WarningLevel)],
+                "title": f"Warning {i}",
+                "description": "Benchmark warning",
+                "created_on": now - timedelta(minutes=i),
+                "created_by": ecosystems_uid[i % ecosystems],
+            }
+            for i in range(warnings)
+        ])
+    await session.commit()
+
+
+async def create_user(session, telegram_id: int | None = None, **overrides) -> User:
+    """Create a user, linked to `telegram_id` if given. The role can be given
+    with `role`, such as "Operator"."""
+    values = {
+        "username": "alice",
+        "email": "alice@example.com",
+        "password": "Password1!",
+    }
+    if telegram_id is not None:
+        values["telegram_id"] = telegram_id
+    values.update(overrides)
+    await User.create(session, values=values)
+    user = await User.get_by(session, username=values["username"])
+    assert user is not None
+    return user
+
+
+def press_warnings_button(update: MagicMock) -> MagicMock:
+    """Make the fake update a press of the button loading the first page of the
+    warnings of every ecosystem."""
+    # The warnings older than a cursor in the future
+    cursor = WarningsCursor(datetime.now(timezone.utc) + timedelta(days=1), 0)
+    update.callback_query.data = encode_warnings_callback(ALL_ECOSYSTEMS, cursor, False)
+    update.callback_query.answer = AsyncMock()
+    update.effective_message.edit_text = AsyncMock()
+    return update